@@ -6,9 +6,13 @@ import collections
 import os
 import sys
 import math
+import time
 from dataclasses import dataclass
 from typing import Dict, List, Tuple, Optional, Set
 
+from stat_store import read_stat_columns
+from metrics import METRICS
+
 # ==========================================
 # 0. 初期設定 & ユーティリティ (Config & Utils)
 # ==========================================
@@ -143,6 +147,11 @@ class SimulationData:
         self.network_graph: nx.DiGraph = nx.DiGraph()
         
     def load(self):
+        with METRICS.phase("data.load"):
+            self._load()
+        METRICS.inc("data.zones_loaded", len(self.zones))
+
+    def _load(self):
         print(f"Loading data from {self.data_dir}...")
         
         # 1. 雛形CSV (カラム定義のみ取得)
@@ -162,8 +171,9 @@ class SimulationData:
         pop_file = os.path.join(stats_dir, "tblT001101H34.csv")
         emp_file = os.path.join(stats_dir, "tblT001108H34.csv")
         
-        df_pop = self._safe_read_csv(pop_file, "KEY_CODE")
-        df_emp = self._safe_read_csv(emp_file, "KEY_CODE")
+        # 必要な列 (総数) のみ列指向キャッシュから取得
+        df_pop = self._read_stat(pop_file, ["T001101001"])
+        df_emp = self._read_stat(emp_file, ["T001108001"])
         
         # マージ
         if not df_pop.empty:
@@ -180,16 +190,14 @@ class SimulationData:
         self.zones = self.demand["zone_id"].astype(str).unique().tolist()
         print(f"Loaded {len(self.zones)} zones.")
 
-    def _safe_read_csv(self, path, key_col):
+    def _read_stat(self, path, columns):
+        """統計表から KEY_CODE と指定列のみを読む (stat_store の列指向キャッシュ経由)"""
         if not os.path.exists(path):
             return pd.DataFrame()
         try:
-            # エンコーディング対応 (Shift-JIS or UTF-8)
-            try:
-                return pd.read_csv(path, dtype={key_col: str}, encoding="utf-8")
-            except:
-                return pd.read_csv(path, dtype={key_col: str}, encoding="cp932")
-        except:
+            return read_stat_columns(path, columns)
+        except Exception as e:
+            print(f"Warning: Could not read {path}: {e}")
             return pd.DataFrame()
 
     def _calculate_demand(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -231,6 +239,13 @@ class NetworkBuilder:
         self.G = nx.DiGraph()
         
     def build(self):
+        with METRICS.phase("network.build"):
+            self._build()
+        METRICS.inc("network.nodes", self.G.number_of_nodes())
+        METRICS.inc("network.edges", self.G.number_of_edges())
+        return self.G
+
+    def _build(self):
         print("Building Abstract Graph...")
         # 1. ノード作成
         for z in self.zones:
@@ -291,15 +306,19 @@ class TrafficSimulator:
         self.G = graph
         self.config = config
         
-    def _bpr_cost(self, free_time, flow, capacity):
-        alpha = self.config["bpr"]["alpha"]
-        beta = self.config["bpr"]["beta"]
+    def _bpr_cost(self, free_time, flow, capacity, alpha=None, beta=None):
+        # リンクに道路種別の係数 (RoadNetworkBuilder) があればそれを使う
+        alpha = self.config["bpr"]["alpha"] if alpha is None else alpha
+        beta = self.config["bpr"]["beta"] if beta is None else beta
         if capacity <= 0: return float('inf')
         return free_time * (1.0 + alpha * (flow / capacity) ** beta)
 
     def run(self, demand_df: pd.DataFrame):
         print("Starting Incremental Assignment...")
-        
+        with METRICS.phase("assignment.total"):
+            return self._run(demand_df)
+
+    def _run(self, demand_df: pd.DataFrame):
         # 1. Init Flows
         for u, v, d in self.G.edges(data=True):
             d['flow'] = 0.0
@@ -319,75 +338,85 @@ class TrafficSimulator:
             return self.G
 
         print("  Calculating OD Matrix...")
-        # メモリ節約のため、ループではなく行列演算を行うが、14000^2は重いのでチャンク処理するか
-        # または、条件を満たすものだけ抽出
-        # Flow = P[i] * A[j] / TotalA > 0.1
-        # => P[i] * A[j] > 0.1 * TotalA
-        threshold = 0.1 * total_a
+        with METRICS.phase("assignment.od_generation"):
+            # メモリ節約のため、ループではなく行列演算を行うが、14000^2は重いのでチャンク処理するか
+            # または、条件を満たすものだけ抽出
+            # Flow = P[i] * A[j] / TotalA > 0.1
+            # => P[i] * A[j] > 0.1 * TotalA
+            threshold = 0.1 * total_a
         
-        od_flows = []
-        # Pが大きい順に処理して枝刈りするなど工夫可能だが、Numpyなら一瞬
-        # ただし行列生成(1.6GB)に注意
-        try:
-            # Full Matrix is acceptable for 14k zones (approx 1.5GB doubles)
-            Mat = np.outer(P, A)
-            rows, cols = np.where(Mat > threshold)
+            od_flows = []
+            # Pが大きい順に処理して枝刈りするなど工夫可能だが、Numpyなら一瞬
+            # ただし行列生成(1.6GB)に注意
+            try:
+                # Full Matrix is acceptable for 14k zones (approx 1.5GB doubles)
+                Mat = np.outer(P, A)
+                rows, cols = np.where(Mat > threshold)
             
-            # extract
-            vals = Mat[rows, cols] / total_a
+                # extract
+                vals = Mat[rows, cols] / total_a
             
-            # Map indices to zone IDs
-            # zones[rows] -> Origin, zones[cols] -> Dest
-            # Vectorized append is hard, assume list comprehension is fast enough for sparse
-            # or better: iterate arrays
-            print(f"  Found {len(vals)} significant OD pairs.")
+                # Map indices to zone IDs
+                # zones[rows] -> Origin, zones[cols] -> Dest
+                # Vectorized append is hard, assume list comprehension is fast enough for sparse
+                # or better: iterate arrays
+                print(f"  Found {len(vals)} significant OD pairs.")
             
-            # 2.4Mは多すぎるので、デモ用にトップ100に絞る
-            LIMIT_OD = 100
-            if len(vals) > LIMIT_OD:
-                print(f"  Limiting to top {LIMIT_OD} pairs for performance...")
-                # ソートして上位を取得 (argsrotは昇順なので後ろから)
-                top_indices = np.argsort(vals)[-LIMIT_OD:]
-                rows = rows[top_indices]
-                cols = cols[top_indices]
-                vals = vals[top_indices]
-
-            for r, c, v in zip(rows, cols, vals):
-                if r == c: continue
-                od_flows.append((f"{zones[r]}_C", f"{zones[c]}_C", v))
+                # 2.4Mは多すぎるので、デモ用にトップ100に絞る
+                LIMIT_OD = 100
+                if len(vals) > LIMIT_OD:
+                    print(f"  Limiting to top {LIMIT_OD} pairs for performance...")
+                    # ソートして上位を取得 (argsrotは昇順なので後ろから)
+                    top_indices = np.argsort(vals)[-LIMIT_OD:]
+                    rows = rows[top_indices]
+                    cols = cols[top_indices]
+                    vals = vals[top_indices]
+
+                for r, c, v in zip(rows, cols, vals):
+                    if r == c: continue
+                    od_flows.append((f"{zones[r]}_C", f"{zones[c]}_C", v))
                 
-        except MemoryError:
-            print("  Memory Error with full matrix. Switching to chunked iteration.")
-            # Fallback
-            for i, p in enumerate(P):
-                if p <= 0: continue
-                # Vectorized row check
-                row_flows = p * A 
-                # Filter
-                indices = np.where(row_flows > threshold)[0]
-                for j in indices:
-                    if i == j: continue
-                    od_flows.append((f"{zones[i]}_C", f"{zones[j]}_C", row_flows[j]/total_a))
+            except MemoryError:
+                print("  Memory Error with full matrix. Switching to chunked iteration.")
+                # Fallback
+                for i, p in enumerate(P):
+                    if p <= 0: continue
+                    # Vectorized row check
+                    row_flows = p * A 
+                    # Filter
+                    indices = np.where(row_flows > threshold)[0]
+                    for j in indices:
+                        if i == j: continue
+                        od_flows.append((f"{zones[i]}_C", f"{zones[j]}_C", row_flows[j]/total_a))
 
+        METRICS.inc("assignment.od_pairs", len(od_flows))
         print(f"  Generated {len(od_flows)} OD pairs.")
 
         # 3. Incremental Assignment Loop
         steps = self.config["assignment"]["increments"]
         k_paths = self.config["route_choice"]["k_paths"]
         theta = self.config["route_choice"]["theta"]
+        timed = METRICS.enabled
+        clock = time.perf_counter
         
         for step_idx, fraction in enumerate(steps):
             print(f"  Step {step_idx+1}/{len(steps)}: Assigning {fraction*100:.0f}% demand")
             
             # Update Costs
             for u, v, d in self.G.edges(data=True):
-                d['cost'] = self._bpr_cost(d['free_time'], d['flow'], d['capacity'])
+                d['cost'] = self._bpr_cost(d['free_time'], d['flow'], d['capacity'], d.get('alpha'), d.get('beta'))
                 d['weight'] = d['cost']
 
             # Assign Flow
+            search_time = 0.0
+            load_time = 0.0
+            searched = 0
+            path_nodes = 0
             for o, d, total_vol in od_flows:
                 vol = total_vol * fraction
                 
+                if timed:
+                    t0 = clock()
                 try:
                     # K-Shortest Paths (Yen's is slow, use only 1 if K=1 or simple)
                     if k_paths > 1:
@@ -397,8 +426,14 @@ class TrafficSimulator:
                         paths = [nx.shortest_path(self.G, o, d, weight='weight')]
                 except nx.NetworkXNoPath:
                     continue
+                finally:
+                    if timed:
+                        search_time += clock() - t0
+                searched += 1
                 
                 if not paths: continue
+                if timed:
+                    t0 = clock()
 
                 # Logit Probabilities
                 path_costs = [sum(self.G[u][v]['weight'] for u, v in zip(p[:-1], p[1:])) for p in paths]
@@ -410,8 +445,16 @@ class TrafficSimulator:
                 # Add Flow
                 for p, prob in zip(paths, probs):
                     add = vol * prob
+                    path_nodes += len(p)
                     for u, v in zip(p[:-1], p[1:]):
                         self.G[u][v]['flow'] += add
+                if timed:
+                    load_time += clock() - t0
+
+            METRICS.observe("assignment.path_search", search_time)
+            METRICS.observe("assignment.flow_loading", load_time)
+            METRICS.inc("assignment.paths_searched", searched)
+            METRICS.inc("assignment.path_nodes", path_nodes)
 
         print("Simulation Completed.")
         return self.G
@@ -426,6 +469,12 @@ class ResultAggregator:
         self.cols = output_cols
         
     def aggregate(self) -> pd.DataFrame:
+        with METRICS.phase("aggregation"):
+            df = self._aggregate()
+        METRICS.inc("aggregation.zones", len(df))
+        return df
+
+    def _aggregate(self) -> pd.DataFrame:
         print("Aggregating results...")
         data = collections.defaultdict(dict)
         
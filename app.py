@@ -1,13 +1,26 @@
 import os
 import json
-from flask import Flask, render_template, jsonify, request
+import functools
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context, send_file
 import pandas as pd
 import threading
 
 # Import Simulators
 import advanced_city_simulator as acs
-from city_grid import CityGrid
-from mesh_utils import MeshGridMapper
+from city_grid import CityGrid, feature_columns
+from city_sessions import CitySessionManager, SessionLimitError
+from city_ensemble import ScenarioEnsemble, expand_sweep
+from mesh_utils import MeshGridMapper, mesh_keys
+from mesh_pyramid import MeshPyramid, mesh_bounds, parse_level
+from road_index import RoadIndex
+from road_network import build_network
+from road_tiles import RoadTileCache, MAX_ZOOM
+from payload_cache import CachedPayload
+from startup import StartupOrchestrator
+from stat_store import read_stat_columns
+from geojson_index import GeoJSONFeatureIndex
+from metrics import METRICS
+from request_profiler import RequestProfiler
 import numpy as np
 
 app = Flask(__name__)
@@ -18,36 +31,45 @@ SIM_GRAPH = None
 SIM_SIMULATOR = None
 SIM_LOCK = threading.Lock()
 LAST_RESULT = None
+LAST_RUN_METRICS = None
+# level -> LAST_RESULT flows summed over coarser meshes (rebuilt after each run)
+LAST_FLOW_LEVELS = {}
 
 # --- City Grid Simulator Globals ---
-CITY_SIM = CityGrid()
-MESH_MAPPER = MeshGridMapper()
-CITY_LOCK = threading.Lock()
+# Each planner/scenario gets its own CityGrid; unfiltered sessions fork a shared base grid.
+DEFAULT_SESSION = 'default'
+CITY_SESSIONS = CitySessionManager(max_sessions=20, idle_timeout=1800)
 
-def initialize_simulator():
-    global SIM_DATA, SIM_GRAPH, SIM_SIMULATOR
+def load_traffic_data():
+    global SIM_DATA
     print("Initializing Traffic Simulator...")
     base_dir = os.path.dirname(os.path.abspath(__file__))
     data_dir = os.path.join(base_dir, 'data')
     
     # 1. Data Load
-    SIM_DATA = acs.SimulationData(data_dir)
-    try:
-        SIM_DATA.load()
-    except Exception as e:
-        print(f"Error loading simulation data: {e}")
-        return
-
-    # 2. Graph Build
-    builder = acs.NetworkBuilder(SIM_DATA.zones)
-    SIM_GRAPH = builder.build()
+    data = acs.SimulationData(data_dir)
+    data.load()
+    SIM_DATA = data
+
+def build_traffic_network():
+    global SIM_GRAPH, SIM_SIMULATOR
+    # 2. Graph Build (道路種別テーブルがあれば区画ごとの種別・車線数から)
+    SIM_GRAPH = build_network(SIM_DATA.zones, SIM_DATA.data_dir, acs.DEFAULT_CONFIG)
     
     # 3. Simulator Init
     SIM_SIMULATOR = acs.TrafficSimulator(SIM_GRAPH, acs.DEFAULT_CONFIG)
     print("Traffic Simulator Initialized.")
 
-def initialize_city_grid(filter_codes=None):
-    global CITY_SIM, MESH_MAPPER
+def initialize_simulator():
+    try:
+        load_traffic_data()
+    except Exception as e:
+        print(f"Error loading simulation data: {e}")
+        return
+    build_traffic_network()
+
+def build_city_grid(filter_codes=None):
+    """Builds a year-0 CityGrid from the grid GeoJSON and statistics. Returns None on failure."""
     print(f"Initializing City Grid Model... Filter={len(filter_codes) if filter_codes else 'None'}")
     directory = os.path.join(app.root_path, 'grid')
     filename = 'messyude-ta001.geojson'
@@ -55,89 +77,195 @@ def initialize_city_grid(filter_codes=None):
     
     if not os.path.exists(file_path):
         print(f"Error: Grid file not found at {file_path}")
-        return
+        return None
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
-            
-        # Filter if requested
         if filter_codes:
-            filter_set = set(str(c) for c in filter_codes)
-            geojson_data['features'] = [
-                f for f in geojson_data['features'] 
-                if str(f['properties'].get('KEY_CODE')) in filter_set
-            ]
+            # Filter if requested: read only the selected features via the KEY_CODE byte-offset index
+            index = GeoJSONFeatureIndex.for_path(file_path)
+            geojson_data = {'type': 'FeatureCollection', 'features': index.read_features(filter_codes)}
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                geojson_data = json.load(f)
 
         # 1. Fit Mapper
         codes = [f['properties'].get('KEY_CODE') for f in geojson_data['features'] if f['properties'].get('KEY_CODE')]
         
         if not codes:
             print("Error: No codes found.")
-            return
+            return None
 
-        MESH_MAPPER = MeshGridMapper() # Reset
-        MESH_MAPPER.fit(codes)
-        print(f"Mesh Mapper fitted: {MESH_MAPPER.cols}x{MESH_MAPPER.rows}")
-        
-        # 2. Init Grid
-        with CITY_LOCK:
-            CITY_SIM = CityGrid() # Reset
-            CITY_SIM.set_mapper(MESH_MAPPER)
-            CITY_SIM.sync_from_geojson(geojson_data) # Loads Pop if present in GeoJSON
-
-            # 3. Load population & elderly share from statistical CSV
-            pop_csv = os.path.join(app.root_path, 'data', 'statistical', 'tblT001101H34.csv')
-            if os.path.exists(pop_csv):
-                CITY_SIM.load_population_and_elderly_from_stat(pop_csv, elderly_col="T001101022", total_col="T001101001")
-
-            # 4. Set accessibility from GeoJSON benrido property (already written)
-            acc_grid = np.zeros((CITY_SIM.height, CITY_SIM.width), dtype=np.float32)
-            mapped = 0
-            for feat in geojson_data.get('features', []):
-                props = feat.get('properties', {})
-                code = str(props.get('KEY_CODE', ''))
-                coords = MESH_MAPPER.get_grid_coords(code)
-                if not coords:
-                    continue
-                x, y = coords
-                try:
-                    val = float(props.get('benrido', 0))
-                except Exception:
-                    val = 0.0
-                acc_grid[y, x] = val
-                mapped += 1
-            CITY_SIM.set_accessibility(acc_grid)
-            CITY_SIM.base_land_price = np.ones((CITY_SIM.height, CITY_SIM.width), dtype=np.float32) * 10.0 + (CITY_SIM.population / 10.0)
-            print(f"Mapped benrido accessibility to {mapped} grid cells.")
-            
-        print("City Grid Model Initialized.")
+        mapper = MeshGridMapper()
+        mapper.fit(codes)
+        print(f"Mesh Mapper fitted: {mapper.cols}x{mapper.rows}")
         
+        # 2. Init Grid (compact: layers only over the mapped meshes)
+        city = CityGrid(compact=True)
+        city.set_mapper(mapper)
+        city.sync_from_geojson(geojson_data) # Loads Pop if present in GeoJSON
+
+        # 3. Load population & elderly share from statistical CSV
+        pop_csv = os.path.join(app.root_path, 'data', 'statistical', 'tblT001101H34.csv')
+        if os.path.exists(pop_csv):
+            city.load_population_and_elderly_from_stat(pop_csv, elderly_col="T001101022", total_col="T001101001")
+
+        # 4. Set accessibility from GeoJSON benrido property (already written; invalid -> 0)
+        feature_codes, props = feature_columns(geojson_data.get('features', []), ('benrido',))
+        mapped = city.load_layers(feature_codes, {'acc': np.nan_to_num(props['benrido'], nan=0.0)}, reset=True)
+        city.base_land_price = np.ones_like(city.population) * 10.0 + (city.population / 10.0)
+        print(f"Mapped benrido accessibility to {mapped} grid cells.")
+        return city
+
     except Exception as e:
         print(f"Error init City Grid: {e}")
+        return None
+
+def initialize_city_grid(filter_codes=None, session_id=DEFAULT_SESSION):
+    """
+    (Re)initializes a session's grid. Unfiltered inits also refresh the shared base grid,
+    and the session receives a copy-on-write fork of it.
+    """
+    city = build_city_grid(filter_codes)
+    if city is None:
+        return None
+    if not filter_codes:
+        CITY_SESSIONS.set_base(city)
+        city = city.fork()
+    CITY_SESSIONS.install(session_id, city, filter_codes)
+    print("City Grid Model Initialized.")
+    return city
+
+def _city_session_id():
+    """Session key: X-City-Session header, ?session= or the city_session cookie."""
+    return (request.headers.get('X-City-Session')
+            or request.args.get('session')
+            or request.cookies.get('city_session')
+            or DEFAULT_SESSION)
+
+def _city_session():
+    """Returns the caller's session, waiting for (or loading) the base grid first."""
+    STARTUP.ensure('city_grid')
+    return CITY_SESSIONS.get(_city_session_id())
+
+def _city_view():
+    """
+    Read-only endpoints: the caller's session if it exists, else a transient view of the
+    base grid. Never creates a session, so reads cannot evict anyone's session.
+    """
+    STARTUP.ensure('city_grid')
+    return CITY_SESSIONS.peek(_city_session_id())
+
+@app.errorhandler(SessionLimitError)
+def _session_limit(e):
+    return jsonify({"error": f"{e}; retry later."}), 503
+
+def load_roads():
+    global ROAD_INDEX, ROAD_TILES
+    road_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'roads', 'hirosima', 'roads.geojson')
+    if not os.path.exists(road_path):
+        print(f"Road data not found at {road_path}")
+        return
+    ROAD_INDEX = RoadIndex.from_geojson(road_path)
+    ROAD_TILES = RoadTileCache(ROAD_INDEX, os.path.join(os.path.dirname(road_path), 'tiles'))
+    print("Road data loaded successfully.")
 
-# Initialize on startup
-if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-    # Run in threads to not block startup if heavy
-    t1 = threading.Thread(target=initialize_simulator)
-    t2 = threading.Thread(target=initialize_city_grid)
-    t1.start()
-    t2.start()
+def load_base_city_grid():
+    if initialize_city_grid() is None:
+        raise RuntimeError("City Grid could not be initialized.")
+
+# --- Startup Orchestration ---
+# Components load in parallel on a thread pool (dependencies first) or lazily on first use.
+STARTUP = StartupOrchestrator(max_workers=4)
+STARTUP.register('roads', load_roads)
+STARTUP.register('grid_data', lambda: GRID_DATA_CACHE.ensure())
+STARTUP.register('traffic_data', load_traffic_data)
+STARTUP.register('traffic_network', build_traffic_network, deps=['traffic_data'])
+STARTUP.register('city_grid', load_base_city_grid)
+STARTUP.register('grid_index', lambda: os.path.exists(GRID_GEOJSON_PATH) and GeoJSONFeatureIndex.for_path(GRID_GEOJSON_PATH))
+
+# Initialize on startup (reloader child, or CITY_LITE_PRELOAD=1 under a WSGI server).
+# Otherwise every component is loaded on first use.
+# Spawned worker processes (city_ensemble) re-import this script as __mp_main__ with the
+# parent's environment; they must not preload.
+PRELOAD = (os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or os.environ.get('CITY_LITE_PRELOAD') == '1') \
+    and __name__ != '__mp_main__'
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-# Load Road Data (Global)
-ROAD_DATA = None
-try:
-    road_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'roads', 'hirosima', 'roads.geojson')
-    if os.path.exists(road_path):
-        with open(road_path, 'r', encoding='utf-8') as f:
-            ROAD_DATA = json.load(f)
-    print("Road data loaded successfully.")
-except Exception as e:
-    print(f"Error loading road data: {e}")
+# --- Admin: On-demand Request Profiling ---
+# Admin calls need X-Admin-Token == CITY_LITE_ADMIN_TOKEN. Without a token they are disabled,
+# unless CITY_LITE_ADMIN_LOCAL=1 opts in to trusting loopback clients (never behind a reverse
+# proxy: every proxied request arrives from loopback).
+
+def _is_admin():
+    token = os.environ.get('CITY_LITE_ADMIN_TOKEN')
+    if token:
+        return request.headers.get('X-Admin-Token') == token
+    if os.environ.get('CITY_LITE_ADMIN_LOCAL') == '1':
+        return request.remote_addr in ('127.0.0.1', '::1')
+    return False
+
+PROFILER = RequestProfiler(
+    os.path.join(app.root_path, 'data', 'profiles'),
+    routes=['/api/simulate', '/api/city/step', '/grid-data', '/api/roads'],
+    max_profiles=50
+)
+PROFILER.init_app(app, _is_admin)
+
+@app.route('/api/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """GET: current settings. POST {"enabled": bool, "sample_rate": 0..1}: toggle profiling."""
+    if not _is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            return jsonify(PROFILER.configure(data.get('enabled'), data.get('sample_rate')))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid sample_rate."}), 400
+    return jsonify(PROFILER.status())
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def admin_list_profiles():
+    if not _is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify({"profiles": PROFILER.list_profiles()})
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def admin_get_profile(profile_id):
+    """Downloads a .prof file (pstats), or ?format=text for the top functions (?sort=, a pstats.SortKey value; default cumulative)."""
+    if not _is_admin():
+        return jsonify({"error": "Forbidden"}), 403
+    if request.args.get('format') == 'text':
+        try:
+            text = PROFILER.profile_text(profile_id, sort=request.args.get('sort', 'cumulative'))
+        except ValueError as e:
+            return jsonify({"error": f"{e} (one of {', '.join(PROFILER.SORT_KEYS)})."}), 400
+        if text is None:
+            return jsonify({"error": "Profile not found."}), 404
+        return Response(text, mimetype='text/plain')
+    path = PROFILER.profile_path(profile_id)
+    if path is None:
+        return jsonify({"error": "Profile not found."}), 404
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=os.path.basename(path))
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Phase timers and work counters in Prometheus text format."""
+    return Response(METRICS.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/health/ready')
+def health_ready():
+    """Per-component startup state and load time. 503 until eager components are ready."""
+    status = STARTUP.status()
+    return jsonify(status), (200 if status["ready"] else 503)
+
+# Road Data (Global, loaded by the 'roads' startup component)
+ROAD_INDEX = None
+ROAD_TILES = None
 
 
 @app.route('/api/roads')
@@ -150,70 +278,60 @@ def get_roads():
     except (TypeError, ValueError):
         return jsonify({'type': 'FeatureCollection', 'features': []}), 400
 
-    if not ROAD_DATA:
+    STARTUP.ensure('roads')
+    if not ROAD_INDEX:
         return jsonify({'type': 'FeatureCollection', 'features': []})
 
-    filtered_features = []
-    
-    # Simple Bounding Box Filter strategy
-    for feature in ROAD_DATA['features']:
-        geom = feature.get('geometry')
-        if not geom: continue
-        
-        coords = []
-        g_type = geom['type']
-        
-        if g_type == 'LineString':
-            coords = geom['coordinates']
-        elif g_type == 'MultiLineString' or g_type == 'Polygon':
-            for part in geom['coordinates']:
-                coords.extend(part)
-        elif g_type == 'MultiPolygon':
-             for poly in geom['coordinates']:
-                 for ring in poly:
-                     coords.extend(ring)
-        
-        f_min_x, f_min_y = 180, 90
-        f_max_x, f_max_y = -180, -90
-        has_points = False
-        
-        for p in coords:
-            lon, lat = p[0], p[1]
-            if lon < f_min_x: f_min_x = lon
-            if lon > f_max_x: f_max_x = lon
-            if lat < f_min_y: f_min_y = lat
-            if lat > f_max_y: f_max_y = lat
-            has_points = True
-            
-        if has_points:
-            # Check overlap
-            if (f_min_x <= e_lng and f_max_x >= w_lng and
-                f_min_y <= n and f_max_y >= s):
-                filtered_features.append(feature)
+    # Spatial index lookup (bboxes precomputed at load)
+    filtered_features = ROAD_INDEX.query_features(w_lng, s, e_lng, n)
 
     return jsonify({
         'type': 'FeatureCollection',
         'features': filtered_features
     })
 
+
+@app.route('/api/roads/tiles/<int:z>/<int:x>/<int:y>')
+def get_road_tile(z, x, y):
+    if z < 0 or z > MAX_ZOOM or not (0 <= x < 2 ** z) or not (0 <= y < 2 ** z):
+        return jsonify({'error': 'Invalid tile coordinates.'}), 400
+
+    STARTUP.ensure('roads')
+    if not ROAD_TILES:
+        return jsonify({'type': 'FeatureCollection', 'features': []})
+
+    payload = ROAD_TILES.get_tile(z, x, y)
+    resp = Response(payload, mimetype='application/json')
+    resp.headers['Cache-Control'] = 'public, max-age=86400'
+    return resp
+
 # --- Traffic Simulation Endpoints ---
 
 @app.route('/api/simulate', methods=['POST'])
 def run_simulation():
-    global SIM_SIMULATOR, SIM_DATA, LAST_RESULT
+    global SIM_SIMULATOR, SIM_DATA, LAST_RESULT, LAST_RUN_METRICS
+    try:
+        level = parse_level((request.get_json(silent=True) or {}).get('level'))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid level: {e}"}), 400
     
-    if SIM_SIMULATOR is None:
-        initialize_simulator()
+    # Waits for (or runs) the traffic components; a failed load is retried
+    STARTUP.ensure('traffic_data', retry_failed=True)
+    STARTUP.ensure('traffic_network', retry_failed=True)
     
     if SIM_SIMULATOR is None:
         return jsonify({"error": "Simulator could not be initialized."}), 500
 
     try:
         with SIM_LOCK:
-            G_result = SIM_SIMULATOR.run(SIM_DATA.demand)
-            aggregator = acs.ResultAggregator(G_result, SIM_DATA.hinagata_cols)
-            df_result = aggregator.aggregate()
+            with METRICS.capture() as run_metrics:
+                G_result = SIM_SIMULATOR.run(SIM_DATA.demand)
+                aggregator = acs.ResultAggregator(G_result, SIM_DATA.hinagata_cols)
+                df_result = aggregator.aggregate()
             LAST_RESULT = df_result
+            LAST_RUN_METRICS = run_metrics.to_dict()
+            LAST_FLOW_LEVELS.clear()
+            df_result = _flow_table(df_result, level)
             
             flow_cols = [c for c in df_result.columns if c != 'key_code']
             results = {}
@@ -232,21 +350,44 @@ def run_simulation():
         print(f"Simulation Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _flow_table(df, level):
+    """
+    Flow table summed over the meshes of `level` (None = zones as they are). Built once per
+    simulation run with a MeshPyramid block reduction and reused by /api/simulate and /api/report.
+    """
+    if level is None:
+        return df
+    table = LAST_FLOW_LEVELS.get(level) if df is LAST_RESULT else None
+    if table is None:
+        flow_cols = [c for c in df.columns if c != 'key_code']
+        pyramid = MeshPyramid(df['key_code'].astype(str).to_numpy())
+        if level > pyramid.base_level:
+            return df
+        table = pd.DataFrame(pyramid.reduce(df[flow_cols].to_numpy(dtype=np.float64), level), columns=flow_cols)
+        table.insert(0, 'key_code', pyramid.codes(level).astype(str))
+        if df is LAST_RESULT:
+            LAST_FLOW_LEVELS[level] = table
+    return table
+
+
 @app.route('/api/report', methods=['GET'])
 def get_report():
     global LAST_RESULT
     if LAST_RESULT is None:
         return jsonify({"status": "No data", "message": "Run simulation first."})
     
-    df = LAST_RESULT
+    try:
+        df = _flow_table(LAST_RESULT, parse_level(request.args.get('level')))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid level: {e}"}), 400
     flow_cols = [c for c in df.columns if c != 'key_code']
     
     total_flow_sum = df[flow_cols].sum().sum()
     zone_count = len(df)
-    active_zones = (df[flow_cols].sum(axis=1) > 0).sum()
+    total_flow = df[flow_cols].sum(axis=1)
+    active_zones = (total_flow > 0).sum()
     
-    df['total_flow'] = df[flow_cols].sum(axis=1)
-    top_5 = df.nlargest(5, 'total_flow')[['key_code', 'total_flow']].to_dict('records')
+    top_5 = df[['key_code']].assign(total_flow=total_flow).nlargest(5, 'total_flow').to_dict('records')
     
     report = {
         "status": "Available",
@@ -255,18 +396,20 @@ def get_report():
             "active_traffic_zones": int(active_zones),
             "total_network_flow": int(total_flow_sum)
         },
-        "top_congested_zones": top_5
+        "top_congested_zones": top_5,
+        "run_metrics": LAST_RUN_METRICS
     }
 
-    # Add City Dynamics Stats if available
-    with CITY_LOCK:
-        if CITY_SIM:
-            city_stats = CITY_SIM.to_json()
-            report["city_model"] = {
-                "max_land_price": city_stats["max_stats"]["price"],
-                "max_population_cell": city_stats["max_stats"]["pop"],
-                "total_population": city_stats["total_stats"]["pop"]
-            }
+    # Add City Dynamics Stats if available (snapshot read, no lock). Does not wait for
+    # the city grid to load or create a session.
+    view = CITY_SESSIONS.peek(_city_session_id())
+    if view.grid.mapper is not None:
+        city_stats = view.snapshot().stats()
+        report["city_model"] = {
+            "max_land_price": city_stats["max_stats"]["price"],
+            "max_population_cell": city_stats["max_stats"]["pop"],
+            "total_population": city_stats["total_stats"]["pop"]
+        }
 
     return jsonify(report)
 
@@ -283,158 +426,561 @@ def init_city():
     except:
         pass
 
-    thread = threading.Thread(target=initialize_city_grid, args=(mesh_codes,))
+    session_id = _city_session_id()
+    thread = threading.Thread(target=initialize_city_grid, args=(mesh_codes, session_id))
     thread.start()
-    return jsonify({"status": "Initializing City Grid...", "filtered": bool(mesh_codes)})
+    return jsonify({"status": "Initializing City Grid...", "filtered": bool(mesh_codes), "session": session_id})
 
 
 
 @app.route('/api/city/step', methods=['POST'])
 def step_city():
-    global CITY_SIM
     try:
         steps = 1
+        binary = False
+        data = None
         try:
             data = request.get_json()
             if data and 'steps' in data:
                 steps = max(1, int(data['steps']))
+            if data and data.get('format') == 'binary':
+                binary = True
         except Exception:
             steps = 1
 
-        with CITY_LOCK:
-            for _ in range(steps):
-                CITY_SIM.step_simulation()
-            result = CITY_SIM.get_mapped_params()
-            year = CITY_SIM.current_year
-        return jsonify({"year": year, "results": result})
+        session = _city_session()
+        with session.lock:
+            city = session.grid
+            try:
+                level = _city_level(city, (data or {}).get('level'))
+            except ValueError as e:
+                return jsonify({"error": f"Invalid level: {e}"}), 400
+            with METRICS.capture() as run_metrics:
+                session.timeline.advance(city, steps)
+            if binary:
+                # Float32 layers in /api/city/codes order
+                return _layer_response(_pack_city(city, level))
+            result = _city_params(city, level)
+            year = city.current_year
+        return jsonify({"year": year, "results": result, "metrics": run_metrics.to_dict()})
+    except SessionLimitError:
+        raise
     except Exception as e:
         print(f"City Step Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+MAX_SEEK_YEAR = 1000
+
+
+@app.route('/api/city/seek', methods=['POST'])
+def seek_city():
+    """
+    Moves the session to any year (timeline scrubbing): restores the nearest earlier
+    checkpoint and replays the remaining years. Body: {"year": 12, "format": "binary"?}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        year = int(data.get('year'))
+        if not 0 <= year <= MAX_SEEK_YEAR:
+            raise ValueError(f"year must be within 0..{MAX_SEEK_YEAR}")
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid seek request: {e}"}), 400
+
+    session = _city_session()
+    with session.lock:
+        city = session.grid
+        try:
+            level = _city_level(city, data.get('level'))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid level: {e}"}), 400
+        with METRICS.capture() as run_metrics:
+            replayed = session.timeline.seek(city, year)
+        if data.get('format') == 'binary':
+            return _layer_response(_pack_city(city, level))
+        result = _city_params(city, level)
+    return jsonify({"year": year, "replayed_years": replayed, "results": result,
+                    "metrics": run_metrics.to_dict()})
+
+
+@app.route('/api/city/timeline', methods=['GET'])
+def city_timeline():
+    """Checkpoint years of the session's timeline (seek targets restore in O(1) + replay)."""
+    session = _city_view()
+    with session.lock:
+        status = session.timeline.status()
+        status["year"] = session.grid.current_year
+    return jsonify(status)
+
+
+def _city_level(city, value):
+    """
+    `level` request parameter -> mesh level to aggregate the city layers to (see MeshPyramid),
+    None for the grid's own cells. ValueError for unknown or finer-than-grid levels.
+    """
+    level = parse_level(value)
+    if level is None:
+        return None
+    pyramid = city.pyramid()
+    if pyramid is None:
+        raise ValueError("City Grid has no mesh pyramid.")
+    if level not in pyramid.levels:
+        raise ValueError(f"level {level} is finer than the grid (level {pyramid.base_level})")
+    return None if level == pyramid.base_level else level
+
+
+def _city_params(city, level):
+    return city.get_mapped_params() if level is None else city.snapshot().level_params(level)
+
+
+def _pack_city(city, level, names=("land_price", "population", "acc")):
+    return city.pack_layers(names) if level is None else city.snapshot().pack_level(level, names)
+
+
+def _layer_response(payload):
+    resp = Response(payload, mimetype='application/octet-stream')
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+@app.route('/api/city/layers', methods=['GET'])
+def get_city_layers():
+    """
+    Returns CityGrid layers as raw float32 buffers (see CityGrid.pack_layers).
+    Query: layers=land_price,population,acc  layout=cells|grid
+           level=1..4|80km|10km|1km (aggregated meshes, order of /api/city/codes?level=)
+    """
+    names = [n for n in request.args.get('layers', 'land_price,population,acc').split(',') if n]
+    layout = request.args.get('layout', 'cells')
+    session = _city_view()
+    try:
+        with session.lock:
+            level = _city_level(session.grid, request.args.get('level'))
+            if level is None:
+                payload = session.grid.pack_layers(names, layout=layout)
+            else:
+                payload = session.grid.snapshot().pack_level(level, names)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _layer_response(payload)
+
+
+@app.route('/api/city/codes', methods=['GET'])
+def get_city_codes():
+    """
+    Returns the mesh code -> cell index table used by the 'cells' layer layout.
+    With ?level= the table of the aggregated meshes (codes, cell counts, lon/lat bounds).
+    """
+    city = _city_view().grid
+    mapper = city.mapper
+    if mapper is None:
+        return jsonify({"error": "City Grid not initialized."}), 404
+    try:
+        level = _city_level(city, request.args.get('level'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid level: {e}"}), 400
+
+    etag = f'"{mapper.table_id}"' if level is None else f'"{mapper.table_id}-l{level}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        resp = Response(status=304)
+    elif level is None:
+        # The mapper caches the serialised table (shared by every session on the same meshes)
+        resp = Response(mapper.payload(), mimetype='application/json')
+    else:
+        table = city.pyramid().table(level)
+        resp = jsonify(dict(table, table_id=f"{mapper.table_id}-l{level}"))
+    resp.headers['ETag'] = etag
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+# 1リクエストで計算する年数の上限 (stream / ensemble)
+MAX_CITY_RUN_YEARS = 500
+
+
+@app.route('/api/city/stream', methods=['GET'])
+def stream_city():
+    """
+    Runs a multi-year simulation and streams one frame per year as Server-Sent Events.
+    Query: years (default 10), tol (default 0.01), keyframe (default 10)
+    Delta frames carry only cells that changed beyond `tol`, indexed as /api/city/codes.
+    """
+    try:
+        years = max(1, min(int(request.args.get('years', 10)), MAX_CITY_RUN_YEARS))
+        tol = float(request.args.get('tol', 0.01))
+        keyframe = max(0, int(request.args.get('keyframe', 10)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid parameters."}), 400
+
+    session = _city_session()
+    city = session.grid
+    if city.cell_index() is None:
+        return jsonify({"error": "City Grid not initialized."}), 404
+
+    def generate():
+        try:
+            # 各年をタイムラインに記録する (後の seek が interval 年以内の再計算で済むように)
+            for frame in city.iter_step_frames(years, tolerance=tol, keyframe_interval=keyframe, lock=session.lock,
+                                               on_step=session.timeline.record):
+                yield f"event: {frame['type']}\ndata: {json.dumps(frame, separators=(',', ':'))}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"City Stream Error: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+MAX_ENSEMBLE_SCENARIOS = 1000
+
+
+@app.route('/api/city/ensemble', methods=['POST'])
+def city_ensemble():
+    """
+    Parameter sweep from the session's current state (the grid itself is not modified).
+    Body: {"years": 20, "scenarios": [{"beta": 1.0, ...}, ...]}
+       or {"years": 20, "sweep": {"beta": [0.5, 1, 2], "inertia": [0.6, 0.8]}}
+    Optional "workers" (capped at the CPU count); years are capped at MAX_CITY_RUN_YEARS.
+    Returns per-scenario summary statistics in input order.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        years = max(1, min(int(data.get('years', 10)), MAX_CITY_RUN_YEARS))
+        if 'sweep' in data:
+            scenarios = expand_sweep(data['sweep'])
+        else:
+            scenarios = list(data.get('scenarios') or [{}])
+        workers = data.get('workers')
+        workers = int(workers) if workers is not None else None
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": f"Invalid ensemble request: {e}"}), 400
+    if len(scenarios) > MAX_ENSEMBLE_SCENARIOS:
+        return jsonify({"error": f"Too many scenarios ({len(scenarios)} > {MAX_ENSEMBLE_SCENARIOS})"}), 400
+
+    session = _city_view()
+    with session.lock:
+        ensemble = ScenarioEnsemble.from_grid(session.grid)
+        year = session.grid.current_year
+    try:
+        with METRICS.capture() as run_metrics:
+            results = ensemble.run(scenarios, years, workers=workers)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid scenario parameters: {e}"}), 400
+    return jsonify({"start_year": year, "years": years, "scenarios": results,
+                    "metrics": run_metrics.to_dict()})
+
+
+MAX_FACILITY_RADIUS = 50
+MAX_RANK_TOP_K = 1000
+
+
+def _facility_kind(data, default=None):
+    """(radius, weight) from a request body / facility entry; ValueError if out of range."""
+    default = default or (5, 1.0)
+    radius = int(data.get('radius', default[0]))
+    weight = float(data.get('weight', default[1]))
+    if not 0 <= radius <= MAX_FACILITY_RADIUS:
+        raise ValueError(f"radius must be within 0..{MAX_FACILITY_RADIUS}")
+    return radius, weight
+
+
+def _facility_xy(entry, grid):
+    """Grid (x, y) of a facility entry, None for an unknown code; ValueError if x / y is off the grid."""
+    if 'code' in entry:
+        return grid.mapper.get_grid_coords(entry['code']) if grid.mapper else None
+    if 'x' not in entry or 'y' not in entry:
+        return None
+    x, y = int(entry['x']), int(entry['y'])
+    if not (0 <= x < grid.width and 0 <= y < grid.height):
+        raise ValueError(f"({x}, {y}) is outside the {grid.width}x{grid.height} grid")
+    return x, y
+
+
+def _weighted_acc(population, acc):
+    pop = np.asarray(population, dtype=np.float64)
+    total = float(np.sum(pop))
+    weighted = float(np.sum(pop * acc))
+    return weighted, (weighted / total if total > 0 else 0.0)
+
+
+@app.route('/api/city/facilities', methods=['POST'])
+def city_facilities():
+    """
+    Facility what-if. Stamps facilities onto a fork of the session grid (acc is copied
+    on write, the session is untouched) and reports the accessibility change.
+    With "apply": true the stamps are applied to the session grid itself.
+    Body: {"facilities": [{"code": "513..."} or {"x": 10, "y": 20}, ...],
+           "radius": 5, "weight": 1.0, "apply": false}   (radius / weight per entry too)
+    """
+    data = request.get_json(silent=True) or {}
+    apply = bool(data.get('apply'))
+    # What-ifs only fork the grid; applying needs the caller's own session
+    session = _city_session() if apply else _city_view()
+    try:
+        default = _facility_kind(data)
+        entries = list(data.get('facilities') or [])
+        kinds = [_facility_kind(f, default) for f in entries]
+        # The grid size and mapper never change within a session
+        points = [_facility_xy(f, session.grid) for f in entries]
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": f"Invalid facilities request: {e}"}), 400
+
+    groups, unknown = {}, []
+    for entry, kind, xy in zip(entries, kinds, points):
+        if xy is None:
+            unknown.append(entry.get('code'))
+            continue
+        groups.setdefault(kind, []).append(xy)
+
+    with session.lock:
+        city = session.grid if apply else session.grid.fork()
+        before = _weighted_acc(city.population, city.acc)
+        with METRICS.capture() as run_metrics:
+            for (radius, weight), xys in groups.items():
+                xs, ys = zip(*xys)
+                city.add_facilities(xs, ys, radius, weight)
+        after = _weighted_acc(city.population, city.acc)
+        if apply:
+            # Later checkpoints no longer describe this grid
+            session.timeline.truncate(city)
+            city.publish_snapshot()
+        year = city.current_year
+
+    return jsonify({
+        "applied": apply,
+        "year": year,
+        "facilities": len(entries) - len(unknown),
+        "unknown": unknown,
+        "weighted_acc_gain": after[0] - before[0],
+        "mean_acc_per_person": {"before": before[1], "after": after[1]},
+        "metrics": run_metrics.to_dict()
+    })
+
+
+@app.route('/api/city/facilities/rank', methods=['POST'])
+def rank_facility_sites():
+    """
+    Ranks every cell as a site for one new facility by population-weighted acc gain
+    (CityGrid.rank_facility_sites), from the session's current state.
+    Body: {"radius": 5, "weight": 1.0, "top_k": 10, "weight_layer": "population" | "elderly"}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        radius, weight = _facility_kind(data)
+        top_k = min(MAX_RANK_TOP_K, max(1, int(data.get('top_k', 10))))
+        weight_layer = data.get('weight_layer', 'population')
+        if weight_layer not in ('population', 'elderly'):
+            raise ValueError(f"unknown weight_layer '{weight_layer}'")
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": f"Invalid ranking request: {e}"}), 400
+
+    session = _city_view()
+    with session.lock:
+        city = session.grid
+        snap = city.snapshot()
+        elderly_share = city.elderly_share
+    if city.mapper is None:
+        return jsonify({"error": "City Grid not initialized."}), 404
+    weights = snap.population if weight_layer == 'population' else snap.population * elderly_share
+    with METRICS.capture() as run_metrics:
+        sites = city.rank_facility_sites(radius, weight, top_k=top_k, weights=weights)
+    return jsonify({"year": snap.year, "radius": radius, "weight": weight, "weight_layer": weight_layer,
+                    "sites": sites, "metrics": run_metrics.to_dict()})
+
+
 @app.route('/api/city/reset', methods=['POST'])
 def reset_city():
-    global CITY_SIM
-    with CITY_LOCK:
-        CITY_SIM.reset()
-        # Re-sync if needed? Or just reset dynamic fields.
-        # Ideally we re-run init logic without reading file if possible.
-        # But for now reset() only clears accumulators.
-        # We might want to reload population.
-        initialize_city_grid() 
-    return jsonify({"status": "City Grid Reset."})
+    session_id = _city_session_id()
+    STARTUP.ensure('city_grid')
+    # Restores the session's year-0 checkpoint; only sessions without a grid re-run init
+    if not CITY_SESSIONS.reset(session_id):
+        initialize_city_grid(CITY_SESSIONS.get(session_id).filter_codes, session_id)
+    return jsonify({"status": "City Grid Reset.", "session": session_id})
+
+
+# --- Grid Data (enriched GeoJSON, cached) ---
+
+GRID_GEOJSON_PATH = os.path.join(app.root_path, 'grid', 'messyude-ta001.geojson')
+FLOOR_CSV_PATH = os.path.join(app.root_path, 'data', 'yukamenseki', 'hirosima', 'yukamenseki_hirosima.csv')
+POP_CSV_PATH = os.path.join(app.root_path, 'data', 'statistical', 'tblT001101H34.csv')
+CACHE_DIR = os.path.join(app.root_path, 'data', 'cache')
+
+
+def _load_pop_props(pop_file_path):
+    """
+    人口統計から KEY_CODE -> 付与プロパティ の辞書を作る。
+    比率は列単位でまとめて計算し、表示用文字列もここで一度だけ作る。
+    """
+    cols = ['T001101001', 'T001101002', 'T001101003', 'T001101004', 'T001101010', 'T001101019']
+    df_pop = read_stat_columns(pop_file_path, cols)
+    # 秘匿値 '*' (NaN) は 0 扱い
+    vals = df_pop[cols].fillna(0).astype(np.int64).to_numpy()
+    total = vals[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = vals[:, [3, 4, 5]] / total[:, None] * 100
+
+    pop_props = {}
+    for key_code, row, ratio in zip(df_pop['KEY_CODE'], vals, ratios):
+        props = {
+            'POP_TOTAL': int(row[0]),
+            'POP_MALE': int(row[1]),
+            'POP_FEMALE': int(row[2]),
+        }
+        if row[0] > 0:
+            r_0_14, r_15_64, r_65_over = (round(float(r), 1) for r in ratio)
+            props['RATIO_0_14'] = f"{r_0_14:.1f}%"
+            props['RATIO_15_64'] = f"{r_15_64:.1f}%"
+            props['RATIO_65_OVER'] = f"{r_65_over:.1f}%"
+            props['VAL_RATIO_0_14'] = min(r_0_14, 100.0)
+            props['VAL_RATIO_15_64'] = min(r_15_64, 100.0)
+            props['VAL_RATIO_65_OVER'] = min(r_65_over, 100.0)
+        else:
+            props['RATIO_0_14'] = "-"
+            props['RATIO_15_64'] = "-"
+            props['RATIO_65_OVER'] = "-"
+            props['VAL_RATIO_0_14'] = 0
+            props['VAL_RATIO_15_64'] = 0
+            props['VAL_RATIO_65_OVER'] = 0
+        pop_props[key_code] = props
+    return pop_props
+
+
+def build_grid_geojson():
+    """Builds the grid GeoJSON enriched with population and floor area properties."""
+    with open(GRID_GEOJSON_PATH, 'r', encoding='utf-8') as f:
+        geojson_data = json.load(f)
+
+    # Merge Floor Area Data
+    floor_map = {}
+    if os.path.exists(FLOOR_CSV_PATH):
+        try:
+            # 1行目はヘッダーなので自動的に処理されるが、念のため明示的に読み込む
+            df_floor = pd.read_csv(FLOOR_CSV_PATH, dtype={'KEY_CODE': str}, usecols=['KEY_CODE', 'total_floor_area'])
+            # カラム名: KEY_CODE, total_floor_area
+            floor_vals = pd.to_numeric(df_floor['total_floor_area'], errors='coerce').fillna(0.0)
+            floor_map = dict(zip(df_floor['KEY_CODE'], floor_vals.astype(float)))
+            print(f"Loaded {len(floor_map)} floor area records.")
+        except Exception as e:
+            print(f"Error loading floor area csv: {e}")
+
+    # Merge Population Data (Static Verification Data)
+    if not os.path.exists(POP_CSV_PATH):
+        return geojson_data
+
+    pop_map = _load_pop_props(POP_CSV_PATH)
+    for feature in geojson_data['features']:
+        props = feature['properties']
+        key_code = str(props.get('KEY_CODE', ''))
+
+        # --- Population Stats ---
+        if key_code in pop_map:
+            props.update(pop_map[key_code])
+        else:
+            props['POP_TOTAL'] = 0
+
+        # --- Floor Area Stats ---
+        # 床面積(㎡)
+        floor_area = floor_map.get(key_code, 0.0)
+        props['FLOOR_AREA'] = floor_area
+
+        # 空き床面積(㎡) = 床面積 - (セル内人口 * １人当たりの仕様床面積(40㎡))
+        # 床面積がある場合のみ計算する (データがないセルは 0)
+        if floor_area > 0:
+            vacant_area = floor_area - props.get('POP_TOTAL', 0) * 40.0
+            props['VACANT_FLOOR_AREA'] = round(vacant_area, 2)
+            # 空き床面積率(%) = 空き床面積 / 床面積 * 100 (過密の場合は負値のまま)
+            props['VACANT_FLOOR_AREA_RATE'] = round((vacant_area / floor_area) * 100.0, 1)
+        else:
+            props['VACANT_FLOOR_AREA'] = 0
+            props['VACANT_FLOOR_AREA_RATE'] = 0
+
+    return geojson_data
+
+
+# /grid-data?level=: properties summed / averaged over cells / population-weighted per coarser mesh
+GRID_SUM_PROPS = ('POP_TOTAL', 'POP_MALE', 'POP_FEMALE', 'FLOOR_AREA', 'VACANT_FLOOR_AREA')
+GRID_MEAN_PROPS = ('benrido',)
+GRID_RATIO_GROUPS = ('0_14', '15_64', '65_OVER')
+
+
+def build_grid_geojson_level(level):
+    """The /grid-data GeoJSON aggregated to the meshes of `level` (rectangles from the mesh codes)."""
+    features = build_grid_geojson()['features']
+    ratio_props = tuple(f'VAL_RATIO_{g}' for g in GRID_RATIO_GROUPS)
+    codes, props = feature_columns(features, GRID_SUM_PROPS + GRID_MEAN_PROPS + ratio_props)
+    valid = mesh_keys(codes)[1]
+    pyramid = MeshPyramid(codes[valid])
+    if level > pyramid.base_level:
+        raise ValueError(f"level {level} is finer than the grid (level {pyramid.base_level})")
+
+    def column(name):
+        return props[name][valid]
+
+    sums = dict(zip(GRID_SUM_PROPS, pyramid.reduce(
+        np.column_stack([np.nan_to_num(column(n)) for n in GRID_SUM_PROPS]), level).T))
+    pop = sums['POP_TOTAL']
+    out_codes = pyramid.codes(level)
+    west, south, east, north = mesh_bounds(out_codes, level)
+    columns = {n: sums[n].round(2).tolist() for n in ('FLOOR_AREA', 'VACANT_FLOOR_AREA')}
+    columns.update({n: sums[n].astype(np.int64).tolist() for n in ('POP_TOTAL', 'POP_MALE', 'POP_FEMALE')})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name in GRID_MEAN_PROPS:
+            values = column(name)
+            present = pyramid.reduce(np.isfinite(values), level)
+            mean = pyramid.reduce(np.nan_to_num(values), level) / present
+            columns[name] = [round(v, 4) if n else None for v, n in zip(mean.tolist(), present.tolist())]
+        for group, name in zip(GRID_RATIO_GROUPS, ratio_props):
+            weighted = pyramid.reduce(np.nan_to_num(column(name)) * np.nan_to_num(column('POP_TOTAL')), level)
+            ratio = np.where(pop > 0, weighted / pop, 0.0)
+            columns[name] = np.minimum(ratio.round(1), 100.0).tolist()
+            columns[f'RATIO_{group}'] = [f"{r:.1f}%" if p > 0 else "-" for r, p in zip(ratio.tolist(), pop.tolist())]
+        floor = sums['FLOOR_AREA']
+        columns['VACANT_FLOOR_AREA_RATE'] = np.where(floor > 0, sums['VACANT_FLOOR_AREA'] / floor * 100.0, 0).round(1).tolist()
+    columns['CELL_COUNT'] = pyramid.cells(level).tolist()
+
+    bounds = np.stack([west, south, east, north], axis=1).round(7).tolist()
+    out = []
+    for i, code in enumerate(out_codes.astype(str).tolist()):
+        w, s, e, n = bounds[i]
+        feature_props = {'KEY_CODE': code, 'LEVEL': level}
+        feature_props.update({name: values[i] for name, values in columns.items()})
+        out.append({'type': 'Feature', 'properties': feature_props,
+                    'geometry': {'type': 'Polygon', 'coordinates': [[[w, s], [e, s], [e, n], [w, n], [w, s]]]}})
+    return {'type': 'FeatureCollection', 'features': out}
+
+
+GRID_DATA_CACHE = CachedPayload(
+    'grid-data',
+    [GRID_GEOJSON_PATH, FLOOR_CSV_PATH, POP_CSV_PATH],
+    build_grid_geojson,
+    CACHE_DIR,
+)
+GRID_DATA_LEVEL_CACHES = {
+    level: CachedPayload(f'grid-data-l{level}', [GRID_GEOJSON_PATH, FLOOR_CSV_PATH, POP_CSV_PATH],
+                         functools.partial(build_grid_geojson_level, level), CACHE_DIR)
+    for level in (1, 2, 3)
+}
 
 
 @app.route('/grid-data')
 def grid_data():
+    """Grid GeoJSON; ?level=1..3 (80km|10km|1km) returns it aggregated to coarser meshes."""
+    if not os.path.exists(GRID_GEOJSON_PATH):
+        return jsonify({"error": f"File not found: {GRID_GEOJSON_PATH}"}), 404
     try:
-        directory = os.path.join(app.root_path, 'grid')
-        filename = 'messyude-ta001.geojson'
-        file_path = os.path.join(directory, filename)
-        
-        if not os.path.exists(file_path):
-            return jsonify({"error": f"File not found: {file_path}"}), 404
-            
-        with open(file_path, 'r', encoding='utf-8') as f:
-            geojson_data = json.load(f)
-
-        # Merge Floor Area Data
-        floor_file_path = os.path.join(app.root_path, 'data', 'yukamenseki', 'hirosima', 'yukamenseki_hirosima.csv')
-        floor_map = {}
-        if os.path.exists(floor_file_path):
-            try:
-                # 1行目はヘッダーなので自動的に処理されるが、念のため明示的に読み込む
-                df_floor = pd.read_csv(floor_file_path, dtype={'KEY_CODE': str})
-                # カラム名: KEY_CODE, total_floor_area
-                floor_map = df_floor.set_index('KEY_CODE')['total_floor_area'].to_dict()
-                print(f"Loaded {len(floor_map)} floor area records.")
-            except Exception as e:
-                print(f"Error loading floor area csv: {e}")
-
-        # Merge Population Data (Static Verification Data)
-        pop_file_path = os.path.join(app.root_path, 'data', 'statistical', 'tblT001101H34.csv')
-        if os.path.exists(pop_file_path):
-            df_pop = pd.read_csv(pop_file_path, dtype={'KEY_CODE': str})
-            cols = ['T001101001', 'T001101002', 'T001101003', 'T001101004', 'T001101010', 'T001101019']
-            pop_map = df_pop.set_index('KEY_CODE')[cols].to_dict('index')
-            
-            for feature in geojson_data['features']:
-                key_code = str(feature['properties'].get('KEY_CODE', ''))
-                
-                # --- Population Stats ---
-                if key_code in pop_map:
-                    stats = pop_map[key_code]
-                    
-                    def safe_int(val):
-                        try:
-                            return int(val)
-                        except:
-                            return 0
-
-                    total = safe_int(stats['T001101001'])
-                    feature['properties']['POP_TOTAL'] = total
-                    feature['properties']['POP_MALE'] = safe_int(stats['T001101002'])
-                    feature['properties']['POP_FEMALE'] = safe_int(stats['T001101003'])
-                    
-                    if total > 0:
-                        p_0_14 = safe_int(stats['T001101004'])
-                        p_15_64 = safe_int(stats['T001101010'])
-                        p_65_over = safe_int(stats['T001101019'])
-                        
-                        feature['properties']['RATIO_0_14'] = f"{(p_0_14 / total * 100):.1f}%"
-                        feature['properties']['RATIO_15_64'] = f"{(p_15_64 / total * 100):.1f}%"
-                        feature['properties']['RATIO_65_OVER'] = f"{(p_65_over / total * 100):.1f}%"
-                        
-                        feature['properties']['VAL_RATIO_0_14'] = min(float(f"{(p_0_14 / total * 100):.1f}"), 100.0)
-                        feature['properties']['VAL_RATIO_15_64'] = min(float(f"{(p_15_64 / total * 100):.1f}"), 100.0)
-                        feature['properties']['VAL_RATIO_65_OVER'] = min(float(f"{(p_65_over / total * 100):.1f}"), 100.0)
-                    else:
-                        feature['properties']['RATIO_0_14'] = "-"
-                        feature['properties']['RATIO_15_64'] = "-" 
-                        feature['properties']['RATIO_65_OVER'] = "-"
-                        feature['properties']['VAL_RATIO_0_14'] = 0
-                        feature['properties']['VAL_RATIO_15_64'] = 0
-                        feature['properties']['VAL_RATIO_65_OVER'] = 0
-                else:
-                    feature['properties']['POP_TOTAL'] = 0
-                    
-                # --- Floor Area Stats ---
-                # 床面積(㎡)
-                floor_area = 0.0
-                if key_code in floor_map:
-                    try:
-                        floor_area = float(floor_map[key_code])
-                    except:
-                        floor_area = 0.0
-                
-                feature['properties']['FLOOR_AREA'] = floor_area
-                
-                # 空き床面積(㎡) = 床面積 - (セル内人口 * １人当たりの仕様床面積(40㎡))
-                pop = feature['properties'].get('POP_TOTAL', 0)
-                required_area = pop * 40.0
-                vacant_area = floor_area - required_area
-                
-                # データがないセルはなしでいい -> 床面積が0なら空きも0にしておくか、計算不可とするか
-                # ここでは床面積がある場合のみ計算する
-                if floor_area > 0:
-                    feature['properties']['VACANT_FLOOR_AREA'] = round(vacant_area, 2)
-                    
-                    # 空き床面積率(%) = 空き床面積 / 床面積 * 100
-                    # vacant_area could be negative if pop is overcrowded? 
-                    # User didn't specify, but usually vacancy rate implies 0-100%. 
-                    # If overcrowded, it might be negative vacancy? 
-                    # Let's keep raw value but clamp rate for visualization if needed.
-                    # Formula is simple: Vacant / Floor * 100
-                    
-                    rate = (vacant_area / floor_area) * 100.0
-                    feature['properties']['VACANT_FLOOR_AREA_RATE'] = round(rate, 1)
-                else:
-                    feature['properties']['VACANT_FLOOR_AREA'] = 0
-                    feature['properties']['VACANT_FLOOR_AREA_RATE'] = 0
-                        
-        return jsonify(geojson_data)
+        level = parse_level(request.args.get('level'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid level: {e}"}), 400
+    try:
+        # 入力ファイルが変わらない限り、gzip済みのキャッシュをそのまま返す
+        cache = GRID_DATA_LEVEL_CACHES.get(level, GRID_DATA_CACHE)
+        return cache.make_response(request, Response)
     except Exception as e:
         print(f"ERROR: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+if PRELOAD:
+    STARTUP.start()
+
 if __name__ == '__main__':
     app.run(debug=True)
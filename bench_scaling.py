@@ -0,0 +1,278 @@
+"""
+スケーリングベンチマーク (合成メッシュ地域)。
+
+合成した 9桁メッシュ地域 (既定 1k / 10k / 50k / 200k ゾーン) でパイプライン各段の
+時間とメモリを計測し、JSON に保存する。前回の結果と比較して倍率を表示できる。
+
+Usage:
+  python bench_scaling.py                              # 1k, 10k
+  python bench_scaling.py --sizes 1000,10000,50000,200000 --memory
+  python bench_scaling.py --compare bench_results/prev.json
+  python bench_scaling.py --stages city_load,city_step,benrido
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import traceback
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from metrics import METRICS
+from mesh_utils import MeshGridMapper
+from city_grid import CityGrid
+from synthetic_mesh import SyntheticRegion
+import advanced_city_simulator as acs
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, "bench_results")
+
+STAGES = ["load", "network_build", "assignment", "aggregation",
+          "mapper_fit", "city_load", "benrido", "city_step"]
+DEFAULT_SIZES = [1000, 10000]
+
+# OD 行列 (zones^2 の float64) がこれを超える場合は assignment を計測しない
+DEFAULT_MAX_OD_BYTES = 4 * 1024 ** 3
+
+
+def _rss_mb():
+    """Peak RSS of this process in MB, or None where the resource module is missing (Windows)."""
+    if resource is None:
+        return None
+    # Linux: KiB, macOS: bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+class ScalingBench:
+    """One synthetic region, run through every stage in dependency order."""
+
+    def __init__(self, n_zones, work_dir, seed=0, steps=5, max_od_bytes=DEFAULT_MAX_OD_BYTES, compact=False):
+        self.n_zones = n_zones
+        self.compact = compact
+        self.work_dir = work_dir
+        self.seed = seed
+        self.steps = steps
+        self.max_od_bytes = max_od_bytes
+        self.results = {}
+        self.state = {}
+
+    def _stage(self, name, fn):
+        if name not in self.wanted:
+            return
+        entry = {"status": "ok"}
+        try:
+            with METRICS.capture() as run:
+                t0 = time.perf_counter()
+                with METRICS.phase(f"bench.{name}"):
+                    skipped = fn()
+                entry["seconds"] = round(time.perf_counter() - t0, 6)
+            if skipped:
+                entry = {"status": "skipped", "reason": skipped}
+            else:
+                phases = run.to_dict()["phases"]
+                own = phases.pop(f"bench.{name}", {})
+                if "peak_bytes" in own:
+                    entry["peak_bytes"] = own["peak_bytes"]
+                if phases:
+                    entry["phases"] = phases
+                if run.counters:
+                    entry["counters"] = dict(run.counters)
+        except Exception as e:
+            entry = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            traceback.print_exc()
+        entry["rss_peak_mb"] = _rss_mb()
+        self.results[name] = entry
+        status = entry["status"] if entry["status"] != "ok" else f"{entry['seconds']:.3f}s"
+        print(f"  [{self.n_zones:>7}] {name:<14} {status}")
+
+    def run(self, stages):
+        self.wanted = set(stages)
+        # assignment / aggregation は前段の結果が必要
+        if self.wanted & {"network_build", "assignment", "aggregation"}:
+            self.wanted.add("load")
+        if self.wanted & {"assignment", "aggregation"}:
+            self.wanted.add("network_build")
+        if "aggregation" in self.wanted:
+            self.wanted.add("assignment")
+        if self.wanted & {"city_load", "benrido", "city_step"}:
+            self.wanted.add("mapper_fit")
+        if "city_step" in self.wanted:
+            self.wanted.add("city_load")
+
+        t0 = time.perf_counter()
+        region = SyntheticRegion(self.n_zones, seed=self.seed, fill=0.85)
+        self.data_dir = region.write_data_dir(os.path.join(self.work_dir, f"zones_{self.n_zones}"))
+        self.region = region
+        generate_seconds = round(time.perf_counter() - t0, 3)
+
+        for name in STAGES:
+            self._stage(name, getattr(self, f"_{name}"))
+        return {"zones": self.n_zones, "seed": self.seed, "generate_seconds": generate_seconds,
+                "stages": self.results}
+
+    # --- Traffic pipeline ---
+
+    def _load(self):
+        data = acs.SimulationData(self.data_dir)
+        data.load()
+        self.state["data"] = data
+
+    def _network_build(self):
+        self.state["graph"] = acs.NetworkBuilder(self.state["data"].zones).build()
+
+    def _assignment(self):
+        zones = len(self.state["data"].demand)
+        od_bytes = zones * zones * 8
+        if od_bytes > self.max_od_bytes:
+            return f"OD matrix {od_bytes / 1024 ** 3:.1f} GiB > --max-od-bytes"
+        sim = acs.TrafficSimulator(self.state["graph"], acs.DEFAULT_CONFIG)
+        sim.run(self.state["data"].demand)
+
+    def _aggregation(self):
+        if "flow" not in next(iter(self.state["graph"].edges(data=True)), (0, 0, {}))[2]:
+            return "assignment did not run"
+        acs.ResultAggregator(self.state["graph"], self.state["data"].hinagata_cols).aggregate()
+
+    # --- City grid ---
+
+    def _mapper_fit(self):
+        mapper = MeshGridMapper()
+        mapper.fit(self.region.code_strings)
+        self.state["mapper"] = mapper
+
+    def _city_load(self):
+        mapper = self.state["mapper"]
+        grid = CityGrid(width=mapper.cols, height=mapper.rows, compact=self.compact)
+        grid.set_mapper(mapper)
+        grid.load_population_and_elderly_from_stat(
+            os.path.join(self.data_dir, "statistical", "tblT001101H34.csv"))
+        self.state["grid"] = grid
+
+    def _benrido(self):
+        stat_dir = os.path.join(self.data_dir, "statistical")
+        fac = os.path.join(stat_dir, "tblT001164H34.csv")
+        mapping = os.path.join(stat_dir, "tblT001164H34_mapping_with_benrido.csv")
+        if not os.path.exists(fac):
+            return "no benrido mapping in data/statistical"
+        grid = self.state.get("grid")
+        if grid is None:
+            mapper = self.state["mapper"]
+            grid = CityGrid(width=mapper.cols, height=mapper.rows, compact=self.compact)
+            grid.set_mapper(mapper)
+        grid.compute_benrido_from_statistical(fac, mapping)
+
+    def _city_step(self):
+        grid = self.state["grid"]
+        for _ in range(self.steps):
+            grid.step_simulation()
+
+
+def compare(current, previous):
+    """Prints per-stage time ratios current / previous for matching zone counts."""
+    prev_runs = {r["zones"]: r for r in previous.get("runs", [])}
+    print(f"\nComparison with {previous.get('meta', {}).get('timestamp', '?')} "
+          f"({previous.get('meta', {}).get('git_rev')}):")
+    if previous.get("meta", {}).get("memory_tracking") != current["meta"]["memory_tracking"]:
+        print("  Note: memory tracking differs between runs; tracemalloc inflates timings.")
+    print(f"  {'zones':>7} {'stage':<14} {'prev':>10} {'now':>10} {'ratio':>7}")
+    for run in current["runs"]:
+        prev = prev_runs.get(run["zones"])
+        if not prev:
+            continue
+        for name in STAGES:
+            a = prev["stages"].get(name, {}).get("seconds")
+            b = run["stages"].get(name, {}).get("seconds")
+            if a is None or b is None:
+                continue
+            ratio = b / a if a > 0 else float("inf")
+            flag = "  <-- slower" if ratio > 1.2 else ""
+            print(f"  {run['zones']:>7} {name:<14} {a:>10.3f} {b:>10.3f} {ratio:>7.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic mesh-region scaling benchmark")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma separated zone counts (e.g. 1000,10000,50000,200000)")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated subset of " + ",".join(STAGES))
+    parser.add_argument("--steps", type=int, default=5, help="CityGrid steps per run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compact", action="store_true", help="CityGrid layers over valid cells only")
+    parser.add_argument("--memory", action="store_true", help="record per-stage peak memory (tracemalloc; slower)")
+    parser.add_argument("--max-od-bytes", type=float, default=DEFAULT_MAX_OD_BYTES)
+    parser.add_argument("--out", default=None, help="result JSON path (default: bench_results/<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="previous result JSON to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep generated data directories")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    METRICS.enabled = True
+    if args.memory:
+        METRICS.set_track_memory(True)
+
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    result = {
+        "meta": {
+            "timestamp": timestamp,
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "memory_tracking": bool(args.memory),
+            "compact": bool(args.compact),
+            "steps": args.steps,
+        },
+        "runs": []
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="city_bench_")
+    try:
+        for n in sizes:
+            print(f"\n=== {n} zones ===")
+            bench = ScalingBench(n, work_dir, seed=args.seed, steps=args.steps, max_od_bytes=args.max_od_bytes,
+                                 compact=args.compact)
+            result["runs"].append(bench.run(stages))
+    finally:
+        if args.keep:
+            print(f"Generated data kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{timestamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved results to {out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import os
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from city_grid import DEFAULT_STEP_PARAMS, land_price_step
+from metrics import METRICS
+
+# シナリオのテンソル (S, cells) をこの大きさ以下に分割して計算する
+# (大きすぎるとキャッシュから溢れてメモリ帯域律速になる)
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+# これ以上のシナリオ数ならプロセスプールに分割する (workers 未指定時)
+PARALLEL_MIN_SCENARIOS = 64
+
+
+def expand_sweep(sweep):
+    """
+    {"beta": [0.5, 1.0], "inertia": [0.6, 0.8]} -> the cartesian product as a list of
+    parameter dicts. Scalar values are held fixed.
+    """
+    names = list(sweep)
+    values = [v if isinstance(v, (list, tuple)) else [v] for v in sweep.values()]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+
+def _param_columns(scenarios):
+    """(S,) float64 arrays of every step parameter, defaults filled in."""
+    return {name: np.array([float(s.get(name, default)) for s in scenarios], dtype=np.float64)
+            for name, default in DEFAULT_STEP_PARAMS.items()}
+
+
+def _shared_rows(keys, build, out):
+    """Fills out[i] = build(keys[i]), evaluating build() once per distinct key."""
+    uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+    for j, key in enumerate(uniq):
+        out[inverse.reshape(-1) == j] = build(key)
+
+
+def run_batch(acc, population, elderly_share, scenarios, years, total_population=None,
+              base_land_price=None, neighbors=None):
+    """
+    Runs all `scenarios` for `years` at once on (S, cells) tensors. Same update as
+    CityGrid.run_years, evaluated for every scenario per NumPy op. Layers may be any
+    shape; they are flattened to cells. Returns (final (S, cells), totals (S, years)).
+
+    Without density / land price penalty the softmax target distribution depends only
+    on beta (acc is static), so it is computed once per distinct beta instead of every
+    year, and the attrition factor once per distinct (attrition_base, attrition_elderly_factor).
+    Scenarios with price_beta need base_land_price and neighbors (see land_price_step).
+    """
+    S = len(scenarios)
+    acc = np.ascontiguousarray(acc, dtype=np.float32).reshape(-1)
+    pop0 = np.ascontiguousarray(population, dtype=np.float32).reshape(-1)
+    elderly = np.ascontiguousarray(elderly_share, dtype=np.float32).reshape(-1)
+    n = acc.shape[0]
+    p = _param_columns(scenarios)
+    inertia = p['inertia'].astype(np.float32)[:, None]
+    density_penalty = p['density_penalty'].astype(np.float32)[:, None]
+
+    pop = np.empty((S, n), dtype=np.float32)
+    pop[:] = pop0
+    new = np.empty((S, n), dtype=np.float32)
+    work = np.empty((S, n), dtype=np.float32)
+    keep = np.empty((S, n), dtype=np.float32)
+    # Attrition based on elderly share (static)
+    _shared_rows(np.stack([p['attrition_base'], p['attrition_elderly_factor']], axis=1),
+                 lambda k: 1.0 - np.clip(np.float32(k[0]) + np.float32(k[1]) * elderly, 0.0, 1.0), keep)
+
+    price_weight = p['price_beta'].astype(np.float32)[:, None]
+    priced = bool(np.any(price_weight))
+    if priced:
+        if base_land_price is None or neighbors is None:
+            raise ValueError("price_beta needs base_land_price and neighbors")
+        base = np.ascontiguousarray(base_land_price, dtype=np.float32).reshape(-1)
+        base_acc = base * acc
+        price_scale = price_weight / np.float32(max(float(np.mean(base)), 1e-6) if n else 1.0)
+        price_density = p['price_density'].astype(np.float32)[:, None]
+        price_acc = p['price_acc'].astype(np.float32)[:, None]
+        smoothing = p['price_smoothing'].astype(np.float32)[:, None]
+        price = np.empty((S, n), dtype=np.float32)
+        nb_sum = np.empty((S, n), dtype=np.float32)
+
+    dynamic = bool(np.any(density_penalty)) or priced
+    if dynamic:
+        beta = p['beta'].astype(np.float32)[:, None]
+    else:
+        # target distribution * (1 - inertia), fixed for the whole run
+        def softmax(b):
+            u = acc * np.float32(b[0])
+            np.exp(u - np.max(u), out=u)
+            total = np.sum(u)
+            return u / total if total > 0 else np.zeros_like(u)
+        coeff = np.empty((S, n), dtype=np.float32)
+        _shared_rows(p['beta'][:, None], softmax, coeff)
+        np.multiply(coeff, 1.0 - inertia, out=coeff)
+        degenerate = ~np.any(coeff, axis=1) if n else np.zeros(S, dtype=bool)
+
+    totals = np.empty((S, years), dtype=np.float64)
+    for year in range(years):
+        if total_population is None:
+            total = np.sum(pop, axis=1, keepdims=True)
+        else:
+            total = np.full((S, 1), total_population, dtype=np.float32)
+
+        if dynamic:
+            # Utility from benrido (acc) minus density / land price penalty, softmax per scenario
+            np.multiply(acc, beta, out=work)
+            np.multiply(pop, density_penalty, out=new)
+            np.subtract(work, new, out=work)
+            if priced:
+                land_price_step(pop, base, base_acc, price_density, price_acc, smoothing,
+                                neighbors, price, nb_sum, new)
+                np.multiply(price, price_scale, out=new)
+                np.subtract(work, new, out=work)
+            np.subtract(work, np.max(work, axis=1, keepdims=True), out=work)
+            np.exp(work, out=work)
+            sum_exp = np.sum(work, axis=1, keepdims=True)
+            degenerate = ~(sum_exp[:, 0] > 0)
+            np.divide(work, np.where(degenerate[:, None], 1.0, sum_exp), out=work)
+            np.multiply(work, total, out=work)
+            np.multiply(work, 1.0 - inertia, out=work)
+        else:
+            np.multiply(coeff, total, out=work)
+        np.multiply(pop, inertia, out=new)
+        np.add(new, work, out=new)
+        if degenerate.any():
+            new[degenerate] = pop[degenerate]
+        np.multiply(new, keep, out=new)
+
+        pop, new = new, pop
+        totals[:, year] = np.sum(pop, axis=1, dtype=np.float64)
+    return pop, totals
+
+
+def summarize(final, totals, acc, population, scenarios, top_share=0.1):
+    """Per-scenario summary statistics."""
+    acc = np.asarray(acc, dtype=np.float64).reshape(-1)
+    start_total = float(np.sum(population, dtype=np.float64))
+    final64 = final.astype(np.float64)
+    end_total = final64.sum(axis=1)
+    k = min(final.shape[1], max(1, int(round(final.shape[1] * top_share))))
+    top = np.partition(final64, final.shape[1] - k, axis=1)[:, final.shape[1] - k:].sum(axis=1) if k else np.zeros(len(final))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_acc = (final64 @ acc) / end_total
+        top_ratio = top / end_total
+    results = []
+    for i, params in enumerate(scenarios):
+        results.append({
+            "params": dict(DEFAULT_STEP_PARAMS, **params),
+            "total_population": float(end_total[i]),
+            "population_change": float(end_total[i] / start_total - 1.0) if start_total > 0 else 0.0,
+            "max_cell_population": float(final64[i].max()) if final.shape[1] else 0.0,
+            "top_cells_share": float(np.nan_to_num(top_ratio[i])),
+            "mean_acc_per_person": float(np.nan_to_num(mean_acc[i])),
+            "occupied_cells": int(np.count_nonzero(final[i] >= 1.0)),
+            "total_by_year": np.round(totals[i], 3).tolist(),
+        })
+    return results
+
+
+# --- Process pool (one per process, created on first use and reused by every run) ---
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def max_workers():
+    return min(os.cpu_count() or 1, 8)
+
+
+def _pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None or getattr(_POOL, '_broken', False):
+            # spawn: Flask のスレッドを抱えたまま fork しない
+            _POOL = ProcessPoolExecutor(max_workers=max_workers(), mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def shutdown_pool():
+    """Stops the shared worker pool (a later run starts a new one)."""
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def _run_chunk(args):
+    # 静的レイヤはチャンク (= ワーカー) ごとに1回だけ送る
+    layers, scenarios, years, total_population, batch = args
+    return _run_batched(*layers, scenarios, years, total_population, batch)
+
+
+def _is_dynamic(params):
+    return any(float(params.get(name, DEFAULT_STEP_PARAMS[name])) != 0.0 for name in ('density_penalty', 'price_beta'))
+
+
+def _run_batched(acc, population, elderly_share, base_land_price, neighbors, scenarios, years, total_population, batch):
+    # 密度・地価ペナルティのないシナリオは固定の softmax を共有できるので別バッチにまとめる
+    order = sorted(range(len(scenarios)), key=lambda i: _is_dynamic(scenarios[i]))
+    results = [None] * len(scenarios)
+    for s in range(0, len(order), batch):
+        idx = order[s:s + batch]
+        chunk = [scenarios[i] for i in idx]
+        final, totals = run_batch(acc, population, elderly_share, chunk, years, total_population,
+                                  base_land_price=base_land_price, neighbors=neighbors)
+        for i, summary in zip(idx, summarize(final, totals, acc, population, chunk)):
+            results[i] = summary
+    return results
+
+
+class ScenarioEnsemble:
+    """
+    パラメータスイープ / シナリオアンサンブル。
+    S 個のシナリオを (S, cells) の人口テンソルとしてまとめて計算し、シナリオごとの要約統計を返す。
+    - 1バッチのテンソルは max_batch_bytes 以下になるよう分割
+    - シナリオ数が多い場合はプロセスプールに分割 (プールはプロセス内で共有し、静的レイヤは
+      チャンクごとに1回だけ送る。ワーカー数は CPU 数 (最大8) まで)
+    元の CityGrid は変更しない (レイヤは読むだけ)。
+    """
+
+    def __init__(self, acc, population, elderly_share, max_batch_bytes=MAX_BATCH_BYTES,
+                 base_land_price=None, neighbors=None):
+        self.acc = np.ascontiguousarray(acc, dtype=np.float32)
+        self.population = np.ascontiguousarray(population, dtype=np.float32)
+        self.elderly_share = np.ascontiguousarray(elderly_share, dtype=np.float32)
+        self.max_batch_bytes = max_batch_bytes
+        # 地価フィードバック (price_beta) 用。None なら price_beta のシナリオは ValueError
+        self.base_land_price = None if base_land_price is None else np.ascontiguousarray(base_land_price, dtype=np.float32)
+        self.neighbors = neighbors
+
+    @classmethod
+    def from_grid(cls, grid, **kwargs):
+        """Ensemble over the current state of a CityGrid (reads its published snapshot + static layers)."""
+        snap = grid.snapshot()
+        return cls(snap.acc, snap.population, grid.elderly_share,
+                   base_land_price=grid.base_land_price,
+                   neighbors=grid.neighbor_table() if grid.compact else grid.layer_shape, **kwargs)
+
+    def batch_size(self):
+        # pop / new / work / keep / coeff (+ 地価の price / nb_sum) の7テンソル
+        per_scenario = 7 * 4 * max(1, self.population.size)
+        return max(1, int(self.max_batch_bytes // per_scenario))
+
+    def run(self, scenarios, years, total_population=None, workers=None):
+        """
+        Runs every scenario (list of param dicts) for `years` and returns their summaries
+        in input order. workers=None picks a pool size automatically for large sweeps;
+        workers=1 keeps everything in-process. workers is capped at max_workers().
+        """
+        scenarios = [dict(s or {}) for s in scenarios]
+        if not scenarios:
+            return []
+        batch = self.batch_size()
+        if workers is None:
+            workers = max_workers() if len(scenarios) >= PARALLEL_MIN_SCENARIOS else 1
+        workers = max(1, min(workers, len(scenarios), max_workers()))
+
+        with METRICS.phase("city.ensemble"):
+            if workers == 1:
+                results = _run_batched(self.acc, self.population, self.elderly_share, self.base_land_price,
+                                       self.neighbors, scenarios, years, total_population, batch)
+            else:
+                layers = (self.acc, self.population, self.elderly_share, self.base_land_price, self.neighbors)
+                per_worker = -(-len(scenarios) // workers)
+                chunks = [(layers, scenarios[i:i + per_worker], years, total_population, batch)
+                          for i in range(0, len(scenarios), per_worker)]
+                results = [r for part in _pool().map(_run_chunk, chunks) for r in part]
+        METRICS.inc("city.ensemble_scenarios", len(scenarios))
+        METRICS.inc("city.cells_updated", self.population.size * years * len(scenarios))
+        return results
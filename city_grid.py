@@ -1,12 +1,350 @@
+import os
 import numpy as np
 import json
 import math
+import functools
+import struct
 import pandas as pd
 
+from stat_store import read_stat_columns
+from metrics import METRICS
+from mesh_utils import MeshGridMapper
+from mesh_pyramid import MeshPyramid
+
+# Layers that never change during step_simulation / run_years; forks share them read-only (copy-on-write)
+SHARED_LAYERS = ("acc", "base_land_price", "zone_type", "elderly_share")
+# Every layer held by a checkpoint
+CHECKPOINT_LAYERS = ("population", "land_price") + SHARED_LAYERS
+
+# (source cell, kernel offset) pairs processed per chunk when spreading benrido impacts
+STAMP_CHUNK = 1 << 21
+
+# Default parameters of step_simulation / run_years
+# beta: Impact of ACC on Utility
+# inertia: Staying ratio when moving to new distribution
+# density_penalty: reduce utility by current density (optional)
+# attrition_base: baseline population decline
+# attrition_elderly_factor: additional decline proportional to elderly_share
+# price_density: land price rise per (population / mean population)
+# price_acc: land price rise per unit of acc
+# price_smoothing: blend of the 4-neighbor mean into the land price (0..1)
+# price_beta: utility penalty per (land price / mean base land price); 0 turns the land price
+#   feedback off (land price is still updated and reported)
+DEFAULT_STEP_PARAMS = {
+    'beta': 1.0,
+    'inertia': 0.7,
+    'density_penalty': 0.0,
+    'attrition_base': 0.0,
+    'attrition_elderly_factor': 0.05,
+    'price_density': 0.5,
+    'price_acc': 1.0,
+    'price_smoothing': 0.5,
+    'price_beta': 0.05
+}
+
+# How each snapshot layer is aggregated over coarser meshes (see GridSnapshot.aggregate)
+LEVEL_REDUCTIONS = {"population": "sum", "land_price": "mean", "acc": "mean"}
+
+# Binary layer payload: magic + uint32 header length + JSON header (padded to 4 bytes) + float32 LE data
+LAYER_MAGIC = b'CGLB'
+
+@functools.lru_cache(maxsize=64)
+def benrido_kernel(max_benrido, spread=True):
+    """
+    Stamp kernel (dy, dx, weight) for one benrido class: exp(-manhattan / decay) within
+    radius = ceil(3 * decay), decay = 1 + (5 - max_benrido). benrido=5 -> 1セル程度, 1 -> 5セル程度.
+    Without spread the kernel is the center cell only.
+    """
+    if not spread:
+        dy = dx = np.zeros(1, dtype=np.int64)
+        weight = np.ones(1, dtype=np.float64)
+    else:
+        decay_cells = 1.0 + (5.0 - max_benrido)
+        radius = max(1, int(math.ceil(decay_cells * 3)))
+        dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+        manhattan = np.abs(dy) + np.abs(dx)
+        inside = manhattan <= radius
+        dy, dx = dy[inside].astype(np.int64), dx[inside].astype(np.int64)
+        weight = np.exp(-manhattan[inside] / decay_cells)
+    for a in (dy, dx, weight):
+        a.flags.writeable = False
+    return dy, dx, weight
+
+
+@functools.lru_cache(maxsize=64)
+def facility_kernel(impact_radius, weight):
+    """
+    Linear-decay facility stamp (weight at the center, 0 at Manhattan distance radius + 1):
+    (2r+1, 2r+1) square plus its non-zero entries as (dy, dx, value). Cached per
+    (radius, weight); arrays are read-only.
+    """
+    r = int(impact_radius)
+    ry, rx = np.ogrid[-r:r + 1, -r:r + 1]
+    dist = np.abs(rx) + np.abs(ry)  # Manhattan distance
+    square = np.maximum(0, weight * (1 - dist / (r + 1.0)))
+    dy, dx = np.nonzero(square)
+    value = square[dy, dx]
+    dy, dx = (dy - r).astype(np.int64), (dx - r).astype(np.int64)
+    for a in (square, dy, dx, value):
+        a.flags.writeable = False
+    return square, dy, dx, value
+
+
+def land_price_step(pop, base, base_acc, price_density, price_acc, smoothing, neighbors, out, nb_sum, tmp):
+    """
+    Land Price (t) from Pop (t-1), written into `out` without allocating:
+      raw = base * (1 + price_acc * acc + price_density * pop / mean(pop))
+      out = (1 - smoothing) * raw + smoothing * (mean of the 4 neighbors of raw)
+    pop / out / nb_sum / tmp are (cells,) or (S, cells); base and base_acc (= base * acc)
+    are (cells,); coefficients are scalars or (S, 1) columns. neighbors is a (4, cells)
+    table with the cell itself where a neighbor is missing (CityGrid.neighbor_table), or
+    the (H, W) shape of a dense grid, summed with shifted slices instead of gathers.
+    """
+    mean_pop = np.mean(pop, axis=-1, keepdims=True)
+    np.multiply(pop, base, out=out)
+    np.multiply(out, price_density / np.maximum(mean_pop, 1e-6), out=out)
+    np.multiply(base_acc, price_acc, out=tmp)
+    np.add(out, tmp, out=out)
+    np.add(out, base, out=out)
+    if np.any(smoothing):
+        if isinstance(neighbors, tuple):
+            _grid_neighbor_sum(out, neighbors, nb_sum)
+        else:
+            np.take(out, neighbors[0], axis=-1, out=nb_sum, mode='clip')
+            for k in range(1, 4):
+                np.take(out, neighbors[k], axis=-1, out=tmp, mode='clip')
+                np.add(nb_sum, tmp, out=nb_sum)
+        np.multiply(out, 1.0 - smoothing, out=out)
+        np.multiply(nb_sum, smoothing / 4.0, out=nb_sum)
+        np.add(out, nb_sum, out=out)
+    return out
+
+
+def _grid_neighbor_sum(values, shape, out):
+    """N+S+E+W neighbor sum of (..., H*W) values on an (H, W) grid; edges count the cell itself."""
+    v = values.reshape(values.shape[:-1] + shape)
+    o = out.reshape(out.shape[:-1] + shape)
+    o[..., 1:, :] = v[..., :-1, :]
+    o[..., 0, :] = v[..., 0, :]
+    o[..., :-1, :] += v[..., 1:, :]
+    o[..., -1, :] += v[..., -1, :]
+    o[..., :, :-1] += v[..., :, 1:]
+    o[..., :, -1] += v[..., :, -1]
+    o[..., :, 1:] += v[..., :, :-1]
+    o[..., :, 0] += v[..., :, 0]
+    return out
+
+
+def feature_columns(features, names):
+    """
+    GeoJSON features -> (KEY_CODE array, {name: float64 array}) in one pass over the
+    properties. Missing / non-numeric values are NaN (callers mask them).
+    """
+    props = [f.get('properties') or {} for f in features]
+    codes = np.array([p.get('KEY_CODE') or '' for p in props], dtype=object)
+    columns = {name: pd.to_numeric(pd.Series([p.get(name) for p in props], dtype=object),
+                                   errors='coerce').to_numpy(dtype=np.float64)
+               for name in names}
+    return codes, columns
+
+
+def pack_float32(header, arrays):
+    """b'CGLB' + uint32 header_len + JSON header (space padded to 4 bytes) + float32 LE arrays."""
+    header = json.dumps(header).encode('utf-8')
+    # Data must start at a 4-byte boundary so the client can wrap it with Float32Array
+    pad = (-(len(LAYER_MAGIC) + 4 + len(header))) % 4
+    header += b' ' * pad
+    return LAYER_MAGIC + struct.pack('<I', len(header)) + header + b''.join(
+        np.ascontiguousarray(a, dtype='<f4').tobytes() for a in arrays)
+
+
+def create_trajectory(path, years, shape, start_year=0):
+    """
+    Creates a memory-mapped (years, *layer_shape) float32 population trajectory at `path`
+    with a JSON sidecar (<path>.json) describing it. layer_shape is (H, W), or (cells,)
+    for a compact grid.
+    """
+    trajectory = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(years,) + tuple(shape))
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump({"layer": "population", "start_year": start_year + 1, "years": years,
+                   "shape": list(shape)}, f)
+    return trajectory
+
+
+def open_trajectory(path):
+    """Opens a recorded trajectory read-only: (memmap, meta)."""
+    meta = {}
+    if os.path.exists(path + '.json'):
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    return np.load(path, mmap_mode='r'), meta
+
+
+class GridSnapshot:
+    """
+    Immutable view of a CityGrid state at one year.
+    Layers are read-only views of arrays that step_simulation never mutates in place,
+    so readers can use a snapshot without holding the grid's lock.
+    """
+
+    def __init__(self, grid, previous=None):
+        self.year = grid.current_year
+        self.width = grid.width
+        self.height = grid.height
+        for name in ("population", "land_price", "acc"):
+            view = getattr(grid, name).view()
+            view.flags.writeable = False
+            setattr(self, name, view)
+        index = grid.cell_index()
+        self._cells = index["layer"] if index else None
+        self._table_id = index["table_id"] if index else None
+        self._pyramid = grid.pyramid()
+        self._levels = {}
+        # acc は step で変わらないので、同じ読み取り専用配列なら前の snapshot の集計を引き継ぐ
+        self._acc_source = grid.acc
+        shared = (previous is not None and previous._acc_source is grid.acc
+                  and not grid.acc.flags.writeable and previous._pyramid is self._pyramid)
+        self._acc_levels = previous._acc_levels if shared else {}
+
+    def aggregate(self, level):
+        """
+        Layers over the meshes of `level` (population summed, land_price / acc averaged over
+        cells; see LEVEL_REDUCTIONS), computed once per snapshot:
+        {"codes": int64 array, "population": float32 array, ...}
+        """
+        result = self._levels.get(level)
+        if result is None:
+            if self._pyramid is None:
+                raise ValueError("No mapper set for CityGrid.")
+            result = {"codes": self._pyramid.codes(level)}
+            for name, how in LEVEL_REDUCTIONS.items():
+                cache = self._acc_levels if name == "acc" else None
+                values = cache.get(level) if cache is not None else None
+                if values is None:
+                    values = self._pyramid.reduce(getattr(self, name).reshape(-1)[self._cells], level, how)
+                    values = values.astype(np.float32)
+                    if cache is not None:
+                        cache[level] = values
+                result[name] = values
+            self._levels[level] = result
+        return result
+
+    def level_params(self, level):
+        """get_mapped_params() over the meshes of `level`."""
+        agg = self.aggregate(level)
+        columns = [agg[name].tolist() for name in ("land_price", "population", "acc")]
+        return {code: {"land_price": lp, "population": pop, "acc": acc}
+                for code, lp, pop, acc in zip(agg["codes"].astype(str).tolist(), *columns)}
+
+    def pack_level(self, level, names=("land_price", "population", "acc")):
+        """pack_layers() over the meshes of `level` (order of /api/city/codes?level=)."""
+        agg = self.aggregate(level)
+        for name in names:
+            if name not in LEVEL_REDUCTIONS:
+                raise ValueError(f"Unknown layer: {name}")
+        header = {"dtype": "<f4", "layout": "level", "shape": [len(agg["codes"])], "layers": list(names),
+                  "year": self.year, "level": level, "table_id": f"{self._table_id}-l{level}"}
+        return pack_float32(header, [agg[name] for name in names])
+
+    def stats(self):
+        return {
+            "year": self.year,
+            "max_stats": {
+                "price": float(np.max(self.land_price)) if self.land_price.size else 0.0,
+                "pop": float(np.max(self.population)) if self.population.size else 0.0,
+                "acc": float(np.max(self.acc)) if self.acc.size else 0.0
+            },
+            "total_stats": {
+                "price": float(np.sum(self.land_price)),
+                "pop": float(np.sum(self.population))
+            }
+        }
+
+
+class GridCheckpoint:
+    """
+    All layers, year and mapper codes of a CityGrid at one year.
+    Layers are read-only arrays shared with the grid (copy-on-write, see CityGrid._own), so
+    taking and restoring a checkpoint costs no copy. save() writes a compressed .npz
+    (path ending in .npz) or a directory of .npy files that load() memory-maps.
+    """
+
+    def __init__(self, year, layers, width, height, compact, codes=None):
+        self.year = year
+        self.layers = layers
+        self.width = width
+        self.height = height
+        self.compact = compact
+        self.codes = codes
+
+    @classmethod
+    def from_grid(cls, grid):
+        layers = {}
+        for name in CHECKPOINT_LAYERS:
+            layer = getattr(grid, name)
+            layer.flags.writeable = False
+            layers[name] = layer
+        codes = grid.mapper.codes if grid.mapper else None
+        return cls(grid.current_year, layers, grid.width, grid.height, grid.compact, codes)
+
+    @property
+    def nbytes(self):
+        return sum(layer.nbytes for layer in self.layers.values())
+
+    def _meta(self):
+        return {"year": self.year, "width": self.width, "height": self.height, "compact": self.compact}
+
+    def save(self, path):
+        """Writes the checkpoint to `path` (.npz: compressed single file, else a directory of .npy)."""
+        codes = np.asarray(self.codes if self.codes is not None else np.zeros(0, dtype=np.int64))
+        if path.endswith('.npz'):
+            np.savez_compressed(path, meta=np.array(json.dumps(self._meta())), codes=codes, **self.layers)
+            return path
+        os.makedirs(path, exist_ok=True)
+        for name, layer in self.layers.items():
+            np.save(os.path.join(path, name + '.npy'), layer)
+        np.save(os.path.join(path, 'codes.npy'), codes)
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(self._meta(), f)
+        return path
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Reads a saved checkpoint; .npy directories are memory-mapped read-only unless mmap=False."""
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                meta = json.loads(str(data['meta']))
+                codes = data['codes']
+                layers = {name: data[name] for name in CHECKPOINT_LAYERS}
+        else:
+            with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            codes = np.load(os.path.join(path, 'codes.npy'))
+            layers = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+                      for name in CHECKPOINT_LAYERS}
+        for layer in layers.values():
+            layer.flags.writeable = False
+        return cls(meta["year"], layers, meta["width"], meta["height"], meta["compact"], codes if len(codes) else None)
+
+
 class CityGrid:
-    def __init__(self, width=100, height=100):
+    """
+    Cell-based city model.
+    Layers are dense (height, width) arrays over the mapper's bounding box, or with
+    compact=True 1D arrays over the mapped cells only (cell_index() order). Compact grids
+    keep a cell lookup ((H, W) int32, -1 = no cell) and a neighbor table ((cells, 4)
+    int32: N, S, E, W, -1 = none) for spatial kernels; empty cells take no part in
+    the simulation.
+    """
+
+    def __init__(self, width=100, height=100, compact=False):
         self.width = width
         self.height = height
+        self.compact = compact
+        self.cell_lookup = None
+        self.neighbors = None
+        self._neighbor_table = None
+        self._step_buffers = None
         
         # --- Dynamic Layers (2D Float Arrays) ---
         # 1. Population Layer: Number of people per cell
@@ -26,33 +364,148 @@ class CityGrid:
 
         # Mapping helpers
         self.mapper = None
+        self._cell_index = None
+        self._pyramid = None
+        self._snapshot = None
 
     def reset(self):
         """Resets dynamic layers to initial state."""
-        self.acc.fill(0)
-        self.population.fill(0)
-        self.land_price.fill(0)
-        self.elderly_share.fill(0)
+        # Fresh arrays (not fill) so published snapshots and forks stay untouched
+        self.acc = np.zeros_like(self.acc)
+        self.population = np.zeros_like(self.population)
+        self.land_price = np.zeros_like(self.land_price)
+        self.elderly_share = np.zeros_like(self.elderly_share)
         self.current_year = 0
+        self._snapshot = None
         # Land price might depend on base_land_price, so maybe reset to base?
         # For now, we recalculate it in step_simulation, so initialization here is fine.
         
     def set_mapper(self, mapper):
         """Sets the MeshGridMapper to convert between Mesh Codes and Grid coords."""
         self.mapper = mapper
+        self._cell_index = None
+        self._pyramid = None
+        self._neighbor_table = None
         # Resize grid if mapper dimensions differ?
         # Ideally CityGrid is initialized with mapper.cols/rows.
-        if mapper.cols != self.width or mapper.rows != self.height:
-            print(f"Resize Grid: {self.width}x{self.height} -> {mapper.cols}x{mapper.rows}")
+        if mapper.cols != self.width or mapper.rows != self.height or self.compact:
+            if mapper.cols != self.width or mapper.rows != self.height:
+                print(f"Resize Grid: {self.width}x{self.height} -> {mapper.cols}x{mapper.rows}")
             self.width = mapper.cols
             self.height = mapper.rows
-            self.population = np.zeros((self.height, self.width), dtype=np.float32)
-            self.land_price = np.zeros((self.height, self.width), dtype=np.float32)
-            self.acc = np.zeros((self.height, self.width), dtype=np.float32)
-            self.base_land_price = np.ones((self.height, self.width), dtype=np.float32) * 10.0
-            self.zone_type = np.zeros((self.height, self.width), dtype=np.int32)
-            self.elderly_share = np.zeros((self.height, self.width), dtype=np.float32)
+            if self.compact:
+                self._build_cell_tables()
+            shape = self.layer_shape
+            self.population = np.zeros(shape, dtype=np.float32)
+            self.land_price = np.zeros(shape, dtype=np.float32)
+            self.acc = np.zeros(shape, dtype=np.float32)
+            self.base_land_price = np.ones(shape, dtype=np.float32) * 10.0
+            self.zone_type = np.zeros(shape, dtype=np.int32)
+            self.elderly_share = np.zeros(shape, dtype=np.float32)
         self.current_year = 0
+        self._snapshot = None
+
+    @property
+    def layer_shape(self):
+        """Shape of every layer: (cells,) for compact grids, else (height, width)."""
+        if self.compact:
+            return (len(self.cell_index()["codes"]),) if self.mapper else (0,)
+        return (self.height, self.width)
+
+    def _build_cell_tables(self):
+        """Compact mode: cell lookup (row, col) -> cell and the N/S/E/W neighbor table."""
+        index = self.cell_index()
+        rows, cols = index["rows"], index["cols"]
+        n = len(rows)
+        # Cells are in mapper order, so the mapper's index grid is the lookup
+        lookup = self.mapper.index_grid
+        neighbors = np.full((n, 4), -1, dtype=np.int32)
+        # row 0 is north
+        for k, (dr, dc) in enumerate(((-1, 0), (1, 0), (0, 1), (0, -1))):
+            r, c = rows + dr, cols + dc
+            ok = (r >= 0) & (r < self.height) & (c >= 0) & (c < self.width)
+            neighbors[ok, k] = lookup[r[ok], c[ok]]
+        neighbors.flags.writeable = False
+        self.cell_lookup = lookup
+        self.neighbors = neighbors
+
+    def neighbor_table(self):
+        """
+        (4, cells) N/S/E/W neighbor positions in the flattened layers, with the cell itself
+        where the neighbor is missing (edge, or no mesh in compact mode). Cached.
+        """
+        if self._neighbor_table is None:
+            if self.compact:
+                own = np.arange(len(self.neighbors), dtype=np.intp)
+                table = np.ascontiguousarray(np.where(self.neighbors.T >= 0, self.neighbors.T, own), dtype=np.intp)
+            else:
+                idx = np.arange(self.height * self.width, dtype=np.intp).reshape(self.height, self.width)
+                table = np.repeat(idx[None], 4, axis=0)
+                table[0, 1:] = idx[:-1]       # N (row 0 is north)
+                table[1, :-1] = idx[1:]       # S
+                table[2, :, :-1] = idx[:, 1:]  # E
+                table[3, :, 1:] = idx[:, :-1]  # W
+                table = table.reshape(4, -1)
+            table.flags.writeable = False
+            self._neighbor_table = table
+        return self._neighbor_table
+
+    def step_buffers(self):
+        """
+        Scratch (cells,) float32 buffers for run_years: work, nb_sum, tmp, base_acc, keep and
+        a spare population buffer. Cached per layer_shape, so stepping does not reallocate them.
+        """
+        shape = self.layer_shape
+        if self._step_buffers is None or self._step_buffers["shape"] != shape:
+            size = int(np.prod(shape))
+            self._step_buffers = {"shape": shape}
+            for name in ("work", "nb_sum", "tmp", "base_acc", "keep", "spare"):
+                self._step_buffers[name] = np.empty(size, dtype=np.float32)
+        return self._step_buffers
+
+    def cell_pos(self, x, y):
+        """Layer index of grid cell (x=col, y=row), or None if it is not a cell of this grid."""
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        if self.compact:
+            i = int(self.cell_lookup[y, x])
+            return i if i >= 0 else None
+        return (y, x)
+
+    def to_grid(self, layer, fill=0.0):
+        """Dense (height, width) view of a layer (compact layers are scattered into a new array)."""
+        if not self.compact:
+            return layer
+        index = self.cell_index()
+        dense = np.full((self.height, self.width), fill, dtype=layer.dtype)
+        dense[index["rows"], index["cols"]] = layer
+        return dense
+
+    def fork(self):
+        """
+        Returns a new CityGrid sharing the static layers (acc, base_land_price, zone_type,
+        elderly_share) and the mapper with this one. Shared layers are marked read-only and
+        copied on first write (see _own); population and land_price are copied.
+        """
+        child = CityGrid.__new__(CityGrid)
+        child.__dict__.update(self.__dict__)
+        for name in SHARED_LAYERS:
+            layer = getattr(self, name)
+            layer.flags.writeable = False
+            setattr(child, name, layer)
+        child.population = self.population.copy()
+        child.land_price = self.land_price.copy()
+        child._snapshot = None
+        child._step_buffers = None  # scratch buffers are per grid
+        return child
+
+    def _own(self, name):
+        """Copy-on-write: makes a shared (read-only) layer private before mutating it."""
+        layer = getattr(self, name)
+        if not layer.flags.writeable:
+            layer = layer.copy()
+            setattr(self, name, layer)
+        return layer
 
     def sync_from_geojson(self, geojson_data, mapper=None):
         """
@@ -66,37 +519,11 @@ class CityGrid:
             return
 
         print("Syncing Grid from GeoJSON...")
-        for feature in geojson_data['features']:
-            props = feature.get('properties', {})
-            mesh_code = props.get('KEY_CODE')
-            if not mesh_code: continue
-            
-            coords = self.mapper.get_grid_coords(mesh_code)
-            if not coords: continue
-            
-            x, y = coords
-            
-            # Bounds check
-            if 0 <= x < self.width and 0 <= y < self.height:
-                # 1. Population
-                pop = props.get('POP_TOTAL', 0)
-                try:
-                    pop = float(pop)
-                except:
-                    pop = 0
-                self.population[y, x] = pop
-                
-                # 2. Base Land Price (Mock: Higher if Pop is high initially?)
-                # Or randomize/use property
-                # Let's simple heuristic: Base Price = 10 + (Pop / 100)
-                self.base_land_price[y, x] = 10.0 + (pop / 10.0)
-
-                # 3. Accessibility from property if present
-                if 'benrido' in props:
-                    try:
-                        self.acc[y, x] = float(props.get('benrido', 0))
-                    except Exception:
-                        pass
+        codes, props = feature_columns(geojson_data['features'], ('POP_TOTAL', 'benrido'))
+        pop = np.nan_to_num(props['POP_TOTAL'], nan=0.0)
+        # Base Land Price heuristic: 10 + Pop / 10; acc only where benrido is given
+        self.load_layers(codes, {'population': pop, 'base_land_price': 10.0 + pop / 10.0,
+                                 'acc': props['benrido']})
 
     def add_facility_effect(self, x, y, impact_radius, weight):
         """
@@ -108,26 +535,112 @@ class CityGrid:
         x_end = min(self.width, x + impact_radius + 1)
         y_start = max(0, y - impact_radius)
         y_end = min(self.height, y + impact_radius + 1)
-        
-        # 2. Create the distance kernel (simplified decay)
-        # Using Manhattan distance for performance
-        # ogrid returns open grids which are memory efficient for broadcasting
-        # We need coordinates relative to the center (x, y)
-        ry, rx = np.ogrid[y_start-y:y_end-y, x_start-x:x_end-x]
-        dist = np.abs(rx) + np.abs(ry) # Manhattan distance
-        
-        # 3. Calculate impact (Linear decay: Weight at center, 0 at edge)
-        # impact = weight * (1 - dist / radius)
-        # We add 1.0 to radius divisor to avoid division by zero or immediate zeroing
-        impact = np.maximum(0, weight * (1 - dist / (impact_radius + 1.0)))
-        
-        # 4. Apply stamp to grid
-        self.acc[y_start:y_end, x_start:x_end] += impact
+
+        # 2. Cached linear-decay kernel (Manhattan distance), cropped at the edges
+        square = facility_kernel(impact_radius, weight)[0]
+        impact = square[y_start - y + impact_radius:y_end - y + impact_radius,
+                        x_start - x + impact_radius:x_end - x + impact_radius]
+
+        # 3. Apply stamp to grid (shared acc is copied on first write)
+        self._own('acc')
+        if self.compact:
+            cells = self.cell_lookup[y_start:y_end, x_start:x_end]
+            impact = np.broadcast_to(impact, cells.shape)
+            self.acc[cells[cells >= 0]] += impact[cells >= 0]
+        else:
+            self.acc[y_start:y_end, x_start:x_end] += impact
+
+    def add_facilities(self, xs, ys, impact_radius, weight):
+        """
+        add_facility_effect() for many facilities of the same kind at once: all stamps
+        are accumulated with one bincount and added to acc in a single pass.
+        acc is replaced by a new array, so published snapshots and forks sharing the old
+        one are not affected.
+        """
+        xs = np.asarray(xs, dtype=np.int64).reshape(-1)
+        ys = np.asarray(ys, dtype=np.int64).reshape(-1)
+        _, dy, dx, value = facility_kernel(impact_radius, weight)
+        H, W = self.height, self.width
+        delta = np.zeros(int(np.prod(self.layer_shape)), dtype=np.float64)
+        chunk = max(1, STAMP_CHUNK // max(1, len(value)))
+        for s in range(0, len(xs), chunk):
+            yy = ys[s:s + chunk, None] + dy
+            xx = xs[s:s + chunk, None] + dx
+            inside = (yy >= 0) & (yy < H) & (xx >= 0) & (xx < W)
+            target = (yy * W + xx)[inside]
+            impact = np.broadcast_to(value, yy.shape)[inside]
+            if self.compact:
+                target = self.cell_lookup.reshape(-1)[target]
+                impact = impact[target >= 0]
+                target = target[target >= 0]
+            delta += np.bincount(target, weights=impact, minlength=len(delta))
+        acc = self.acc.astype(np.float32, copy=True)
+        acc += delta.reshape(acc.shape)
+        self.acc = acc
+
+    def facility_gain(self, impact_radius, weight, weights=None):
+        """
+        Population-weighted acc gain of placing one facility on each cell:
+          gain[c] = sum_k kernel[k] * weights[c + k]
+        i.e. sum(weights * delta_acc) of add_facility_effect at c, for every cell at once
+        (one shifted-slice multiply-add per kernel offset). weights defaults to population.
+        Returns a float64 layer (layer_shape).
+        """
+        w = self.population if weights is None else weights
+        w = self.to_grid(np.asarray(w, dtype=np.float64).reshape(self.layer_shape))
+        _, dy, dx, value = facility_kernel(impact_radius, weight)
+        H, W = self.height, self.width
+        gain = np.zeros((H, W), dtype=np.float64)
+        tmp = np.empty((H, W), dtype=np.float64)
+        for oy, ox, v in zip(dy.tolist(), dx.tolist(), value.tolist()):
+            h, wd = H - abs(oy), W - abs(ox)
+            if h <= 0 or wd <= 0:
+                continue
+            src = w[max(0, oy):max(0, oy) + h, max(0, ox):max(0, ox) + wd]
+            dst = gain[max(0, -oy):max(0, -oy) + h, max(0, -ox):max(0, -ox) + wd]
+            np.multiply(src, v, out=tmp[:h, :wd])
+            np.add(dst, tmp[:h, :wd], out=dst)
+        if self.compact:
+            index = self.cell_index()
+            return gain[index["rows"], index["cols"]]
+        return gain
+
+    def rank_facility_sites(self, impact_radius, weight, top_k=10, weights=None, candidates=None):
+        """
+        Top-k candidate cells for a new facility by facility_gain().
+        candidates: layer positions (flat) to consider; default every mapped cell
+        (every grid cell without a mapper).
+        Returns [{"code", "x", "y", "gain"}, ...] sorted by gain (descending).
+        """
+        with METRICS.phase("city.rank_sites"):
+            gain = self.facility_gain(impact_radius, weight, weights=weights).reshape(-1)
+            index = self.cell_index()
+            if candidates is None:
+                candidates = index["layer"] if index is not None else np.arange(gain.size)
+            candidates = np.asarray(candidates, dtype=np.int64).reshape(-1)
+            k = min(int(top_k), len(candidates))
+            if k <= 0:
+                return []
+            scores = gain[candidates]
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.lexsort((candidates[top], -scores[top]))]
+            METRICS.inc("city.sites_ranked", len(candidates))
+
+        if self.compact:
+            cols, rows = index["cols"][candidates[top]], index["rows"][candidates[top]]
+        else:
+            rows, cols = np.divmod(candidates[top], self.width)
+        codes, found = self.mapper.coords_to_codes(cols, rows) if self.mapper else (cols, np.zeros(len(cols), dtype=bool))
+        return [{"code": str(c) if ok else None, "x": int(x), "y": int(y), "gain": float(g)}
+                for c, ok, x, y, g in zip(codes.tolist(), found, cols, rows, scores[top])]
 
     def set_accessibility(self, acc_grid):
-        """Sets the accessibility layer directly from a 2D array."""
-        if acc_grid.shape == (self.height, self.width):
+        """Sets the accessibility layer from a layer-shaped or (height, width) array."""
+        if acc_grid.shape == self.layer_shape:
             self.acc = acc_grid.astype(np.float32)
+        elif acc_grid.shape == (self.height, self.width):
+            index = self.cell_index()
+            self.acc = acc_grid[index["rows"], index["cols"]].astype(np.float32)
         else:
             print(f"Error: Shape mismatch. Grid {self.width}x{self.height} vs Input {acc_grid.shape}")
 
@@ -156,80 +669,64 @@ class CityGrid:
             print("Warning: No benrido codes found in mapping.")
             return None
 
-        # 2) 施設データの読み込み
-        df_fac = pd.read_csv(facility_csv)
+        # 2) 施設データの読み込み (benrido対象列のみ)
+        df_fac = read_stat_columns(facility_csv, list(code_to_benrido))
         if "KEY_CODE" not in df_fac.columns:
             print("Error: facility_csv must contain KEY_CODE column.")
             return None
 
-        acc_grid = np.zeros((self.height, self.width), dtype=np.float32)
+        # 3) セル中心の impact を全コード一括で計算: weight * (1 - exp(-count)), 0 / 秘匿値(NaN) は寄与なし
+        codes = [c for c in code_to_benrido if c in df_fac.columns]
+        counts = df_fac[codes].to_numpy(dtype=np.float64) if codes else np.zeros((len(df_fac), 0))
+        ben = np.array([code_to_benrido[c] for c in codes], dtype=np.float64)
+        active = counts > 0
+        impacts = np.where(active, np.clip((ben / 5.0) * -np.expm1(-np.where(active, counts, 0.0)), 0.0, 1.0), 0.0)
+        # セル内の合成 1 - ∏(1-impact) を対数空間で
+        with np.errstate(divide='ignore'):
+            center_impact = -np.expm1(np.log1p(-impacts).sum(axis=1))
+        max_benrido = np.where(active, ben, 0.0).max(axis=1, initial=0.0)
 
-        for row in df_fac.itertuples(index=False):
-            mesh_code = str(row.KEY_CODE)
-            coords = self.mapper.get_grid_coords(mesh_code)
-            if not coords:
-                continue
-            x, y = coords
-
-            contributions = []
-            max_benrido = 0.0
-            for code, ben in code_to_benrido.items():
-                if code not in df_fac.columns:
-                    continue
-                val = getattr(row, code)
-                try:
-                    count = float(val)
-                except Exception:
-                    continue
-                if count <= 0:
-                    continue
-                weight = ben / 5.0  # 1.0 when benrido=5
-                # 1 - exp(-count) で施設数の逓減効果を入れる
-                impact_center = weight * (1.0 - math.exp(-count))
-                impact_center = max(0.0, min(1.0, impact_center))
-                contributions.append(impact_center)
-                max_benrido = max(max_benrido, ben)
-
-            if not contributions:
-                continue
+        cells, mapped = self.locate_codes(df_fac["KEY_CODE"].to_numpy())
+        keep = mapped & (center_impact > 0)
+        index = self.cell_index()
+        xs = index["cols"][cells[keep]].astype(np.int64)
+        ys = index["rows"][cells[keep]].astype(np.int64)
 
-            # セル内の合成（1 - ∏(1-impact) で上限1に近づく）
-            center_impact = 1.0 - float(np.prod([1.0 - c for c in contributions]))
-            self._stamp_impact(acc_grid, x, y, center_impact, max_benrido, spread)
+        log_keep = np.zeros(int(np.prod(self.layer_shape)), dtype=np.float64)
+        self._accumulate_impacts(log_keep, xs, ys, center_impact[keep], max_benrido[keep], spread)
+        acc_grid = (-np.expm1(log_keep)).astype(np.float32).reshape(self.layer_shape)
 
         self.acc = acc_grid
         return acc_grid
 
-    def _stamp_impact(self, acc_grid, x, y, impact, max_benrido, spread):
+    def _accumulate_impacts(self, log_keep, xs, ys, impacts, max_benrido, spread):
         """
-        1セルもしくは近傍セルにimpactを合成（上限1）。
-        benridoが大きいほど減衰（短距離）。小さいほど広く効く。
+        各セルの impact を近傍へ拡散し、log(1 - attenuated) を log_keep (flat, float64) に加算する。
+        compact グリッドではセルの無い位置への寄与は捨てる。
+        acc = 1 - exp(log_keep) が 1 - ∏(1 - attenuated) の合成 (上限1) になる。
+        benrido クラスごとに benrido_kernel() の減衰カーネルを全セルへまとめて適用する。
         """
-        if impact <= 0:
-            return
-
-        if not spread or max_benrido <= 0:
-            acc_grid[y, x] = 1.0 - (1.0 - acc_grid[y, x]) * (1.0 - impact)
-            return
-
-        # decay: benrido=5 -> 1セル程度, benrido=1 -> 5セル程度
-        decay_cells = 1.0 + (5.0 - max_benrido)
-        radius = max(1, int(math.ceil(decay_cells * 3)))
-
-        x_start = max(0, x - radius)
-        x_end = min(self.width, x + radius + 1)
-        y_start = max(0, y - radius)
-        y_end = min(self.height, y + radius + 1)
-
-        for yy in range(y_start, y_end):
-            for xx in range(x_start, x_end):
-                manhattan = abs(xx - x) + abs(yy - y)
-                if manhattan > radius:
-                    continue
-                attenuated = impact * math.exp(-manhattan / decay_cells)
-                if attenuated <= 0:
-                    continue
-                acc_grid[yy, xx] = 1.0 - (1.0 - acc_grid[yy, xx]) * (1.0 - attenuated)
+        H, W = self.height, self.width
+        lookup = self.cell_lookup.reshape(-1) if self.compact else None
+        spread = bool(spread)
+        for mb in np.unique(max_benrido):
+            sel = max_benrido == mb
+            dy, dx, weight = benrido_kernel(float(mb), spread and mb > 0)
+            x0, y0, imp = xs[sel], ys[sel], impacts[sel]
+            chunk = max(1, STAMP_CHUNK // len(weight))
+            for s in range(0, len(imp), chunk):
+                yy = y0[s:s + chunk, None] + dy
+                xx = x0[s:s + chunk, None] + dx
+                inside = (yy >= 0) & (yy < H) & (xx >= 0) & (xx < W)
+                attenuated = (imp[s:s + chunk, None] * weight)[inside]
+                target = (yy * W + xx)[inside]
+                if lookup is not None:
+                    target = lookup[target]
+                    attenuated = attenuated[target >= 0]
+                    target = target[target >= 0]
+                with np.errstate(divide='ignore'):
+                    log_keep += np.bincount(target, weights=np.log1p(-attenuated), minlength=len(log_keep))
+        return log_keep
 
     def load_population_and_elderly_from_stat(self, pop_csv, elderly_col="T001101022", total_col="T001101001"):
         """
@@ -241,78 +738,167 @@ class CityGrid:
         if not self.mapper:
             print("Error: No mapper set for CityGrid. Call set_mapper() first.")
             return
-        df = pd.read_csv(pop_csv)
+        df = read_stat_columns(pop_csv, [total_col, elderly_col], key_as_str=False)
         if "KEY_CODE" not in df.columns or elderly_col not in df.columns or total_col not in df.columns:
             print("Error: pop_csv missing required columns.")
             return
 
-        self.population.fill(0)
-        self.elderly_share.fill(0)
-        for row in df.itertuples(index=False):
-            code = str(row.KEY_CODE)
-            coords = self.mapper.get_grid_coords(code)
-            if not coords:
-                continue
-            x, y = coords
-            try:
-                total = float(getattr(row, total_col))
-                elderly = float(getattr(row, elderly_col))
-            except Exception:
-                continue
-            if total < 0:
-                total = 0
-            if elderly < 0:
-                elderly = 0
-            self.population[y, x] = total
-            self.elderly_share[y, x] = elderly / total if total > 0 else 0.0
+        total = df[total_col].to_numpy(dtype=np.float64)
+        elderly = df[elderly_col].to_numpy(dtype=np.float64)
+        # 秘匿値 (NaN) の行は人口・高齢者割合とも書かない
+        ok = ~(np.isnan(total) | np.isnan(elderly))
+        total = np.where(ok, np.maximum(total, 0.0), np.nan)
+        elderly = np.maximum(elderly, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(total > 0, elderly / total, np.where(ok, 0.0, np.nan))
+        self.load_layers(df["KEY_CODE"].to_numpy(), {'population': total, 'elderly_share': share}, reset=True)
 
     def step_simulation(self, total_population=None, params=None):
         """
-        Executes one simulation step with Feedback Loop:
-        Pop (t-1) -> Land Price (t) -> Utility (t) -> Pop (t)
-        """
-        if params is None:
-            # beta: Impact of ACC on Utility
-            # inertia: Staying ratio when moving to new distribution
-            # density_penalty: reduce utility by current density (optional)
-            # attrition_base: baseline population decline
-            # attrition_elderly_factor: additional decline proportional to elderly_share
-            params = {
-                'beta': 1.0,
-                'inertia': 0.7,
-                'density_penalty': 0.0,
-                'attrition_base': 0.0,
-                'attrition_elderly_factor': 0.05
-            }
-            
-        # Use current total population if not specified
-        if total_population is None:
-            total_population = np.sum(self.population)
-
-        # Utility from benrido (acc) minus optional density penalty
-        utility = (self.acc * params.get('beta', 1.0)) - (self.population * params.get('density_penalty', 0.0))
-
-        # Softmax redistribution
-        max_util = np.max(utility)
-        exp_utility = np.exp(utility - max_util)
-        sum_exp = np.sum(exp_utility)
-        if sum_exp > 0:
-            prob_distribution = exp_utility / sum_exp
-            target_pop = prob_distribution * total_population
-            inertia = params.get('inertia', 0.7)
-            new_pop = (self.population * inertia) + (target_pop * (1.0 - inertia))
-        else:
-            new_pop = self.population.copy()
+        Executes one simulation step with Feedback Loop (default parameters):
+        Pop (t-1) -> Land Price (t) -> Utility (t) = beta * acc - price_beta * Land Price (t) / mean base price -> Pop (t)
+        """
+        self.run_years(1, params=params, total_population=total_population)
+
+    def run_years(self, years, params=None, record=None, total_population=None):
+        """
+        Runs `years` simulation steps with the cached work buffers (step_buffers(); in-place
+        NumPy ops, no per-year allocations) and publishes one snapshot at the end. Only the
+        new population and land price layers, which the snapshot publishes, are allocated per call.
+        - params: step parameters (missing keys fall back to DEFAULT_STEP_PARAMS)
+        - record: optional path or (years, *layer_shape) float32 array; each year's population is
+          written into it. A path becomes a memory-mapped file (see open_trajectory).
+        - total_population: fixed total for every year (default: current total each year)
+        Returns the trajectory array when recording, else None.
+        """
+        p = dict(DEFAULT_STEP_PARAMS, **(params or {}))
+        beta = p['beta']
+        inertia = p['inertia']
+        density_penalty = p['density_penalty']
+        price_weight = p['price_beta']
+        shape = self.layer_shape
+        size = int(np.prod(shape))
+
+        trajectory = None
+        if isinstance(record, (str, bytes, os.PathLike)):
+            trajectory = create_trajectory(record, years, shape, start_year=self.current_year)
+        elif record is not None:
+            trajectory = record
+            if trajectory.shape[0] < years or trajectory.shape[1:] != shape:
+                raise ValueError(f"record shape {trajectory.shape} does not fit {years} x {shape}")
+
+        # Work on flat (cells,) buffers. Ping-pong buffers: the current population array is
+        # only read (snapshots keep pointing at it), new years are written alternately into
+        # front/back; land price goes into a fresh buffer for the same reason. back is the
+        # cached spare: whichever of front/back is not published is kept for the next call.
+        buffers = self.step_buffers()
+        front = np.empty(size, dtype=np.float32)
+        back = buffers["spare"]
+        price = np.empty(size, dtype=np.float32)
+        work, nb_sum, tmp = buffers["work"], buffers["nb_sum"], buffers["tmp"]
+        acc = self.acc.reshape(-1)
+        base = self.base_land_price.reshape(-1).astype(np.float32, copy=False)
+        # Static layers can change between calls (facilities, restore), so these are refilled
+        base_acc = np.multiply(base, acc, out=buffers["base_acc"])
+        neighbors = self.neighbor_table() if self.compact else tuple(shape)
+        price_scale = price_weight / max(float(np.mean(base)), 1e-6) if size else 0.0
+        # Attrition based on elderly share (static during the run): keep = 1 - clip(rate, 0, 1)
+        keep = np.multiply(self.elderly_share.reshape(-1), p['attrition_elderly_factor'], out=buffers["keep"])
+        np.add(keep, p['attrition_base'], out=keep)
+        np.clip(keep, 0.0, 1.0, out=keep)
+        np.subtract(1.0, keep, out=keep)
+
+        pop = self.population.reshape(-1)
+        price_out = self.land_price
+        with METRICS.phase("city.run_years"):
+            for i in range(years):
+                with METRICS.phase("city.step"):
+                    total = np.sum(pop) if total_population is None else total_population
+
+                    # Land price from last year's population, accessibility and neighbors
+                    land_price_step(pop, base, base_acc, p['price_density'], p['price_acc'],
+                                    p['price_smoothing'], neighbors, price, nb_sum, tmp)
 
-        # Attrition based on elderly share
-        attr_base = params.get('attrition_base', 0.0)
-        attr_elder = params.get('attrition_elderly_factor', 0.05)
-        attrition_rate = attr_base + attr_elder * self.elderly_share
-        attrition_rate = np.clip(attrition_rate, 0.0, 1.0)
-        self.population = new_pop * (1.0 - attrition_rate)
+                    # Utility from benrido (acc) minus optional density / land price penalties
+                    np.multiply(acc, beta, out=work)
+                    if density_penalty:
+                        np.multiply(pop, density_penalty, out=tmp)
+                        np.subtract(work, tmp, out=work)
+                    if price_weight:
+                        np.multiply(price, price_scale, out=tmp)
+                        np.subtract(work, tmp, out=work)
 
-        # Update year counter
-        self.current_year += 1
+                    # Softmax redistribution
+                    np.subtract(work, np.max(work), out=work)
+                    np.exp(work, out=work)
+                    sum_exp = np.sum(work)
+                    if sum_exp > 0:
+                        np.divide(work, sum_exp, out=work)       # prob_distribution
+                        np.multiply(work, total, out=work)       # target_pop
+                        np.multiply(work, 1.0 - inertia, out=work)
+                        np.multiply(pop, inertia, out=front)
+                        np.add(front, work, out=front)
+                    else:
+                        np.copyto(front, pop)
+                    np.multiply(front, keep, out=front)
+
+                    if trajectory is not None:
+                        trajectory[i] = front.reshape(shape)
+                pop = front
+                front, back = back, front
+                price_out = price
+        if trajectory is not None and isinstance(trajectory, np.memmap):
+            trajectory.flush()
+        buffers["spare"] = front
+
+        self.population = pop.reshape(shape)
+        self.land_price = price_out.reshape(shape)
+        self.current_year += years
+        METRICS.inc("city.steps", years)
+        METRICS.inc("city.cells_updated", pop.size * years)
+        self.publish_snapshot()
+        return trajectory
+
+    def checkpoint(self):
+        """Checkpoint of the current state (O(1): layers are shared copy-on-write)."""
+        return GridCheckpoint.from_grid(self)
+
+    def restore(self, checkpoint):
+        """
+        Returns the grid to a checkpoint in O(1): the checkpoint's layers are adopted
+        read-only (copied on first in-place write) and a snapshot is published.
+        """
+        shape = self.layer_shape
+        for name in CHECKPOINT_LAYERS:
+            if checkpoint.layers[name].shape != shape:
+                raise ValueError(f"checkpoint layer {name} {checkpoint.layers[name].shape} does not fit grid {shape}")
+        for name in CHECKPOINT_LAYERS:
+            setattr(self, name, checkpoint.layers[name])
+        self.current_year = checkpoint.year
+        return self.publish_snapshot()
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint):
+        """New grid (mapper refitted from the checkpoint's codes) in the checkpoint's state."""
+        grid = cls(width=checkpoint.width, height=checkpoint.height, compact=checkpoint.compact)
+        if checkpoint.codes is not None:
+            mapper = MeshGridMapper()
+            mapper.fit(checkpoint.codes)
+            grid.set_mapper(mapper)
+        grid.restore(checkpoint)
+        return grid
+
+    def publish_snapshot(self):
+        """Publishes an immutable view of the current state for lock-free readers."""
+        self._snapshot = GridSnapshot(self, self._snapshot)
+        return self._snapshot
+
+    def snapshot(self):
+        """Returns the last published snapshot (publishing one if none exists yet)."""
+        snap = self._snapshot
+        if snap is None:
+            snap = self.publish_snapshot()
+        return snap
             
     def get_mapped_params(self):
         """
@@ -324,15 +910,166 @@ class CityGrid:
         if not self.mapper:
             return {}
             
-        result = {}
-        for mesh_code, (x, y) in self.mapper.mapping.items():
-            if 0 <= x < self.width and 0 <= y < self.height:
-                result[mesh_code] = {
-                    "land_price": float(self.land_price[y, x]),
-                    "population": float(self.population[y, x]),
-                    "acc": float(self.acc[y, x])
-                }
-        return result
+        index = self.cell_index()
+        pos = index["layer"]
+        columns = [layer.reshape(-1)[pos].tolist() for layer in (self.land_price, self.population, self.acc)]
+        return {code: {"land_price": lp, "population": pop, "acc": acc}
+                for code, lp, pop, acc in zip(index["codes"], *columns)}
+
+    def cell_index(self):
+        """
+        Returns the cached cell table of mapped meshes:
+        {"codes": [...], "cols": int32 array, "rows": int32 array, "flat": int64 array,
+         "layer": positions of the cells in the flattened layers, "table_id": str}
+        Layer payloads in 'cells' layout are ordered like this table (so are compact layers).
+        """
+        if self._cell_index is None:
+            if not self.mapper:
+                return None
+            # set_mapper sizes the grid to the mapper, so every mapped mesh is a cell
+            mapper = self.mapper
+            codes, cols, rows = mapper.code_strings(), mapper.code_cols, mapper.code_rows
+            flat = rows.astype(np.int64) * self.width + cols
+            self._cell_index = {
+                "codes": codes,
+                "cols": cols,
+                "rows": rows,
+                "flat": flat,
+                "layer": np.arange(len(codes), dtype=np.int64) if self.compact else flat,
+                "table_id": mapper.table_id,
+            }
+        return self._cell_index
+
+    def pyramid(self):
+        """
+        Cached MeshPyramid over the mapped cells (coarser mesh levels for zoomed-out views).
+        None without a mapper or if the mesh codes are not all of one level.
+        """
+        if self._pyramid is None and self.mapper is not None:
+            try:
+                self._pyramid = MeshPyramid(self.mapper.codes)
+            except ValueError as e:
+                print(f"Warning: no mesh pyramid ({e})")
+                self._pyramid = False
+        return self._pyramid or None
+
+    def locate_codes(self, codes):
+        """
+        Vectorized mesh code -> cell_index() row join (cells are in mapper order, so this is
+        MeshGridMapper.lookup: sorted int64 codes + searchsorted). Returns (rows, found); rows is 0 where found is False (unknown / invalid code).
+        """
+        if not self.mapper:
+            shape = np.shape(codes)
+            return np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=bool)
+        return self.mapper.lookup(codes)
+
+    def load_layers(self, codes, layers, reset=False):
+        """
+        Bulk layer loading: layers = {layer name: values aligned with codes}. Every row with
+        a known code and a finite value is written with one fancy-index assignment per layer;
+        NaN values and unknown codes leave the cell as it is. reset=True starts the named
+        layers from zeros. Shared (read-only) layers are copied first. Returns the number of
+        mapped rows.
+        """
+        cells, found = self.locate_codes(codes)
+        pos = self.cell_index()["layer"][cells] if found.any() else cells
+        for name, values in layers.items():
+            layer = getattr(self, name)
+            if reset:
+                layer = np.zeros_like(layer)
+                setattr(self, name, layer)
+            else:
+                layer = self._own(name)
+            values = np.asarray(values, dtype=np.float64)
+            ok = found & np.isfinite(values)
+            layer.reshape(-1)[pos[ok]] = values[ok]
+        return int(np.count_nonzero(found))
+
+    def pack_layers(self, names=("land_price", "population", "acc"), layout="cells"):
+        """
+        Packs layers as raw little-endian float32 buffers for typed-array consumers.
+        - layout='cells': each layer is a 1D array over cell_index() order (mapped cells only)
+        - layout='grid': each layer is the full (height, width) array in row-major order
+        Format: b'CGLB' + uint32 header_len + JSON header (space padded to 4 bytes) + layer data.
+        """
+        if layout == "cells":
+            index = self.cell_index()
+            if index is None:
+                raise ValueError("No mapper set for CityGrid.")
+            flat = index["layer"]
+            shape = [len(flat)]
+            table_id = index["table_id"]
+        elif layout == "grid":
+            shape = [self.height, self.width]
+            table_id = None
+        else:
+            raise ValueError(f"Unknown layout: {layout}")
+
+        buffers = []
+        for name in names:
+            layer = getattr(self, name, None)
+            if not isinstance(layer, np.ndarray) or layer.shape != self.layer_shape:
+                raise ValueError(f"Unknown layer: {name}")
+            data = layer.reshape(-1)[flat] if layout == "cells" else self.to_grid(layer)
+            buffers.append(data)
+
+        return pack_float32({
+            "dtype": "<f4",
+            "layout": layout,
+            "shape": shape,
+            "layers": list(names),
+            "year": self.current_year,
+            "table_id": table_id,
+        }, buffers)
+
+    def iter_step_frames(self, years, tolerance=0.01, keyframe_interval=10, layers=("population", "acc"), lock=None,
+                         on_step=None):
+        """
+        Runs `years` steps and yields one frame dict per year for streaming.
+        - keyframe: {"type": "key", "year", "<layer>": [values in cell_index() order]}
+        - delta:    {"type": "delta", "year", "idx": [...], "<layer>": [...]}  only cells whose
+          value moved more than `tolerance` since the last value sent for that cell.
+        Year 0 (current state) is always sent as a keyframe. If `lock` is given it is held
+        only while stepping/encoding one year, so readers can interleave.
+        on_step(grid) is called after every step, under the lock (e.g. CityTimeline.record).
+        """
+        from contextlib import nullcontext
+        guard = lock if lock is not None else nullcontext()
+
+        with guard:
+            index = self.cell_index()
+            if index is None:
+                return
+            flat = index["layer"]
+            sent = {name: getattr(self, name).reshape(-1)[flat].astype(np.float32) for name in layers}
+            frame = {"type": "key", "year": self.current_year, "table_id": index["table_id"]}
+            for name in layers:
+                frame[name] = np.round(sent[name].astype(np.float64), 4).tolist()
+        yield frame
+
+        for i in range(1, years + 1):
+            with guard:
+                self.step_simulation()
+                if on_step is not None:
+                    on_step(self)
+                current = {name: getattr(self, name).reshape(-1)[flat] for name in layers}
+                year = self.current_year
+
+            if keyframe_interval and i % keyframe_interval == 0:
+                frame = {"type": "key", "year": year}
+                for name in layers:
+                    sent[name][:] = current[name]
+                    frame[name] = np.round(sent[name].astype(np.float64), 4).tolist()
+            else:
+                changed = np.zeros(len(flat), dtype=bool)
+                for name in layers:
+                    changed |= np.abs(current[name] - sent[name]) > tolerance
+                idx = np.nonzero(changed)[0]
+                frame = {"type": "delta", "year": year, "idx": idx.tolist()}
+                for name in layers:
+                    sent[name][idx] = current[name][idx]
+                    frame[name] = np.round(sent[name][idx].astype(np.float64), 4).tolist()
+            yield frame
 
     def to_json(self):
         """Export current state for frontend visualization."""
@@ -351,9 +1088,9 @@ class CityGrid:
                 "pop": float(np.sum(self.population))
             },
             "layers": {
-                "land_price": self.land_price.tolist(),
-                "population": self.population.tolist(),
-                "acc": self.acc.tolist()
+                "land_price": self.to_grid(self.land_price).tolist(),
+                "population": self.to_grid(self.population).tolist(),
+                "acc": self.to_grid(self.acc).tolist()
             }
         }
 
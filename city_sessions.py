@@ -0,0 +1,139 @@
+import time
+import threading
+import collections
+
+from city_grid import CityGrid
+from city_timeline import CityTimeline
+
+
+class SessionLimitError(RuntimeError):
+    """Every session slot is held by a recently active session."""
+
+
+class CitySession:
+    """One planner's (or scenario's) CityGrid with its own step lock and checkpoint timeline."""
+
+    def __init__(self, session_id, grid, filter_codes=None, checkpoint_interval=5):
+        self.session_id = session_id
+        self.grid = grid
+        self.filter_codes = filter_codes
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+        self.timeline = CityTimeline(interval=checkpoint_interval)
+        self.timeline.reset(grid)
+
+    def snapshot(self):
+        """Immutable state for readers; does not take the step lock."""
+        return self.grid.snapshot()
+
+
+class CitySessionManager:
+    """
+    セッション (またはシナリオ) ごとに独立した CityGrid を管理する。
+    - 全域の初期グリッド (base) を一度だけ構築し、各セッションは base.fork() で
+      静的レイヤ (acc, base_land_price, elderly_share) を共有 (copy-on-write)
+    - 読み取りは snapshot() でロック不要、ステップ実行はセッション単位のロック
+    - 各セッションはチェックポイントのタイムラインを持ち、リセット・年の移動は restore + 再計算
+    - LRU (max_sessions) とアイドルタイムアウトでセッションを破棄。ただし min_idle 秒以内に
+      使われたセッションは追い出さない (新しい ID を大量に送っても利用中のセッションは消えない)
+    - 読み取り専用の API は peek() を使い、セッションを作らない
+    """
+
+    def __init__(self, max_sessions=20, idle_timeout=1800, min_idle=60):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.min_idle = min_idle
+        self.base = None
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_base(self, grid):
+        """Sets the shared year-0 template grid used by unfiltered sessions."""
+        grid.publish_snapshot()
+        with self._lock:
+            self.base = grid
+
+    def _new_grid(self):
+        base = self.base
+        return base.fork() if base is not None else CityGrid()
+
+    def get(self, session_id):
+        """
+        Returns the session, creating it from the base grid if needed.
+        Raises SessionLimitError if a new session would have to evict an active one.
+        """
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                self._evict(now, room=1)
+                if len(self._sessions) >= self.max_sessions:
+                    raise SessionLimitError(f"all {self.max_sessions} city sessions are in use")
+                session = CitySession(session_id, self._new_grid())
+                self._sessions[session_id] = session
+            session.last_access = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+        return session
+
+    def peek(self, session_id):
+        """
+        Read-only access: the existing session (marked as used), else a transient session
+        over the base grid that is not registered, so reads never create or evict sessions.
+        Callers must not step or modify the returned grid.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_access = time.time()
+                self._sessions.move_to_end(session_id)
+                return session
+            base = self.base
+        return CitySession(session_id, base if base is not None else CityGrid())
+
+    def install(self, session_id, grid, filter_codes=None):
+        """Replaces a session's grid (e.g. after a filtered init)."""
+        grid.publish_snapshot()
+        session = self.get(session_id)
+        with session.lock:
+            session.grid = grid
+            session.filter_codes = filter_codes
+            session.timeline.reset(grid)
+        return session
+
+    def reset(self, session_id):
+        """
+        Returns a session to year 0 by restoring the state it was initialized with
+        (a checkpoint restore, no reload). Returns False if the session has no grid yet.
+        """
+        session = self.get(session_id)
+        with session.lock:
+            if session.grid.mapper is None:
+                return False
+            session.timeline.rewind(session.grid)
+        return True
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self, now, room=0):
+        # アイドルタイムアウト
+        for sid in [sid for sid, s in self._sessions.items() if now - s.last_access > self.idle_timeout]:
+            del self._sessions[sid]
+        # LRU (room 個の空きを作る)。min_idle 秒以内に使われたセッションは残す
+        while self._sessions and len(self._sessions) + room > self.max_sessions:
+            sid, session = next(iter(self._sessions.items()))
+            if now - session.last_access < self.min_idle:
+                break
+            del self._sessions[sid]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_timeout": self.idle_timeout,
+                "min_idle": self.min_idle,
+                "base_ready": self.base is not None
+            }
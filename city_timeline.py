@@ -0,0 +1,119 @@
+import os
+import bisect
+import shutil
+
+from city_grid import GridCheckpoint
+
+
+class CityTimeline:
+    """
+    セッションの年次チェックポイント (タイムラインのスクラブ / リセット用)。
+    - interval 年ごとに CityGrid.checkpoint() を保持 (レイヤは copy-on-write 共有なので O(1))
+    - seek(year): year 以下で最も近いチェックポイントを restore し、残りの年だけ再計算
+    - max_checkpoints を超えたら間隔が最も詰まっている所から間引く (year 0 と最新は保持)
+    - spill_dir を指定するとチェックポイントを .npy に書き出し、メモリマップで保持する
+    - origin (reset 時点の状態) は別に保持し、rewind() はその restore だけで済む
+    再計算は既定パラメータの run_years と同じ結果になる前提 (ステップは決定的)。
+    """
+
+    def __init__(self, interval=5, max_checkpoints=64, spill_dir=None):
+        self.interval = max(1, int(interval))
+        self.max_checkpoints = max(2, int(max_checkpoints))
+        self.spill_dir = spill_dir
+        self._years = []
+        self._checkpoints = {}
+        self.origin = None
+
+    def reset(self, grid):
+        """Drops every checkpoint and starts the timeline at the grid's current state."""
+        for year in list(self._years):
+            self._drop(year)
+        self.origin = grid.checkpoint()
+        self.record(grid, force=True)
+
+    def rewind(self, grid):
+        """Returns the grid to the timeline's origin (memory only) and restarts the timeline there."""
+        grid.restore(self.origin)
+        self.reset(grid)
+
+    def record(self, grid, force=False):
+        """Checkpoints the grid if its year is on the interval (or force)."""
+        year = grid.current_year
+        if not force and (year % self.interval or year in self._checkpoints):
+            return None
+        if year in self._checkpoints:
+            self._drop(year)
+        checkpoint = grid.checkpoint()
+        if self.spill_dir:
+            path = os.path.join(self.spill_dir, f"year_{year:06d}")
+            checkpoint = GridCheckpoint.load(checkpoint.save(path), mmap=True)
+        bisect.insort(self._years, year)
+        self._checkpoints[year] = checkpoint
+        self._thin()
+        return checkpoint
+
+    def advance(self, grid, years, params=None):
+        """run_years(years) in segments that end on checkpoint years, recording on the way."""
+        remaining = int(years)
+        while remaining > 0:
+            step = min(remaining, self.interval - grid.current_year % self.interval)
+            grid.run_years(step, params=params)
+            self.record(grid)
+            remaining -= step
+
+    def nearest(self, year):
+        """Latest checkpoint at or before `year` (None if there is none)."""
+        i = bisect.bisect_right(self._years, year)
+        return self._checkpoints[self._years[i - 1]] if i else None
+
+    def seek(self, grid, year):
+        """
+        Moves the grid to `year`: O(1) restore of the nearest earlier checkpoint plus a
+        replay of the remaining years (< interval when moving within recorded history).
+        Returns the number of replayed years.
+        """
+        checkpoint = self.nearest(year)
+        if checkpoint is None:
+            raise ValueError(f"no checkpoint at or before year {year}")
+        if not (checkpoint.year <= grid.current_year <= year):
+            grid.restore(checkpoint)
+        replay = year - grid.current_year
+        self.advance(grid, replay)
+        if replay == 0:
+            grid.publish_snapshot()
+        return replay
+
+    def truncate(self, grid):
+        """
+        The grid's state was changed outside the step (e.g. facilities applied): drops the
+        checkpoints after its year and checkpoints the new state.
+        """
+        for year in [y for y in self._years if y >= grid.current_year]:
+            self._drop(year)
+        self.record(grid, force=True)
+
+    def _drop(self, year):
+        self._years.remove(year)
+        self._checkpoints.pop(year, None)
+        if self.spill_dir:
+            shutil.rmtree(os.path.join(self.spill_dir, f"year_{year:06d}"), ignore_errors=True)
+
+    def _thin(self):
+        while len(self._years) > self.max_checkpoints:
+            # 直前との間隔が最も短いチェックポイントを捨てる (先頭と最新は残す)
+            gaps = [(self._years[i] - self._years[i - 1], self._years[i]) for i in range(1, len(self._years) - 1)]
+            self._drop(min(gaps)[1])
+
+    @property
+    def years(self):
+        return list(self._years)
+
+    def status(self):
+        # 静的レイヤはチェックポイント間で共有されているので配列ごとに1回だけ数える
+        layers = {id(a): a for c in self._checkpoints.values() for a in c.layers.values()}
+        return {
+            "interval": self.interval,
+            "checkpoints": self.years,
+            "max_checkpoints": self.max_checkpoints,
+            "memory_bytes": 0 if self.spill_dir else sum(a.nbytes for a in layers.values())
+        }
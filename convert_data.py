@@ -1,5 +1,6 @@
 import pandas as pd
 import os
+from stat_store import StatStore
 
 files = [
     r'c:\Users\gyoru\Desktop\city_lite\data\statistical\tblT001101H34.txt',
@@ -59,5 +60,9 @@ for file_path in files:
         df_map.to_csv(mapping_csv_path, index=False, encoding='utf-8-sig')
         print(f"  Saved mapping CSV: {mapping_csv_path}")
 
+        # 3. Build Columnar Cache (int64 KEY_CODE + per-column arrays, labels from mapping)
+        table = StatStore.for_csv(clean_csv_path).table(clean_csv_path)
+        print(f"  Built columnar cache: {table.rows} rows, {len(table.columns)} columns")
+
     except Exception as e:
         print(f"  ERROR processing {filename}: {e}")
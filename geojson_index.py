@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import codecs
+import threading
+import numpy as np
+
+INDEX_VERSION = 1
+CHUNK_SIZE = 1 << 20
+_FEATURES_RE = re.compile(r'"features"\s*:\s*\[')
+_WS = ' \t\r\n,'
+
+
+def iter_features(path, chunk_size=CHUNK_SIZE):
+    """
+    FeatureCollection の features 配列をストリーミングで読み、(feature, byte_offset, byte_length) を返す。
+    ファイル全体を一度に読み込まないため、メモリ使用量はフィーチャ1つ分 + チャンク程度。
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as f:
+        txt = ''
+        i = 0  # 読み取り位置 (txt[:i] は処理済み、チャンク追加時にだけ切り詰める)
+        bpos = 0  # byte offset of txt[i]
+        eof = False
+
+        def more():
+            nonlocal txt, i, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                txt = txt[i:] + utf8.decode(b'', final=True)
+                i = 0
+                return False
+            txt = txt[i:] + utf8.decode(chunk)
+            i = 0
+            return True
+
+        # 1. "features": [ を探す
+        while True:
+            m = _FEATURES_RE.search(txt)
+            if m:
+                break
+            if not more():
+                return
+        bpos += len(txt[:m.end()].encode('utf-8'))
+        i = m.end()
+
+        # 2. 各フィーチャを raw_decode
+        while True:
+            while True:
+                j = i
+                while j < len(txt) and txt[j] in _WS:
+                    j += 1
+                if j < len(txt) or eof:
+                    break
+                more()
+            bpos += j - i  # _WS は ASCII のみ
+            i = j
+            if i >= len(txt) or txt[i] == ']':
+                return
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(txt, i)
+                    break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    more()
+            nbytes = len(txt[i:end].encode('utf-8'))
+            yield obj, bpos, nbytes
+            bpos += nbytes
+            i = end
+
+
+def _bbox(geom):
+    pts = []
+    def walk(c):
+        if c and isinstance(c[0], (int, float)):
+            pts.append(c[:2])
+        else:
+            for part in c:
+                walk(part)
+    walk((geom or {}).get('coordinates') or [])
+    if not pts:
+        return (np.nan, np.nan, np.nan, np.nan)
+    a = np.asarray(pts, dtype=np.float64)
+    return (a[:, 0].min(), a[:, 1].min(), a[:, 0].max(), a[:, 1].max())
+
+
+class GeoJSONFeatureIndex:
+    """
+    KEY_CODE -> フィーチャのバイト位置 (offset, length) と bbox の索引。
+    - 初回はストリーミングで走査して <geojson>.keyidx.npz に保存、以後は再利用
+      (GeoJSON の mtime/size が変わった場合のみ再構築)
+    - read_features(codes) は該当フィーチャのバイト範囲だけを seek して読む
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.codes = np.zeros(0, dtype=np.int64)  # sorted
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.bboxes = np.zeros((0, 4), dtype=np.float64)
+
+    @classmethod
+    def for_path(cls, path):
+        """Shared, up-to-date index for a GeoJSON file."""
+        path = os.path.abspath(path)
+        stamp = cls._stamp(path)
+        with cls._shared_lock:
+            cached = cls._shared.get(path)
+            if cached is not None and np.array_equal(cached[0], stamp):
+                return cached[1]
+            index = cls(path)
+            if not index._load(stamp):
+                index.build()
+                index._save(stamp)
+            cls._shared[path] = (stamp, index)
+            return index
+
+    @staticmethod
+    def _stamp(path):
+        st = os.stat(path)
+        return np.array([st.st_mtime_ns, st.st_size], dtype=np.int64)
+
+    @property
+    def index_path(self):
+        return self.path + '.keyidx.npz'
+
+    def build(self, key='KEY_CODE'):
+        print(f"Indexing {os.path.basename(self.path)} by {key}...")
+        codes, offsets, lengths, bboxes = [], [], [], []
+        for feat, off, n in iter_features(self.path):
+            code = (feat.get('properties') or {}).get(key)
+            try:
+                code = int(code)
+            except (TypeError, ValueError):
+                continue
+            codes.append(code)
+            offsets.append(off)
+            lengths.append(n)
+            bboxes.append(_bbox(feat.get('geometry')))
+        order = np.argsort(np.asarray(codes, dtype=np.int64), kind='stable')
+        self.codes = np.asarray(codes, dtype=np.int64)[order]
+        self.offsets = np.asarray(offsets, dtype=np.int64)[order]
+        self.lengths = np.asarray(lengths, dtype=np.int64)[order]
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)[order]
+        print(f"  Indexed {len(self.codes)} features.")
+        return self
+
+    def _save(self, stamp):
+        try:
+            np.savez(self.index_path, version=np.int64(INDEX_VERSION), source=stamp,
+                     codes=self.codes, offsets=self.offsets, lengths=self.lengths, bboxes=self.bboxes)
+        except OSError as e:
+            print(f"Warning: Could not save GeoJSON index: {e}")
+
+    def _load(self, stamp):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with np.load(self.index_path) as z:
+                if int(z['version']) != INDEX_VERSION or not np.array_equal(z['source'], stamp):
+                    return False
+                self.codes = z['codes']
+                self.offsets = z['offsets']
+                self.lengths = z['lengths']
+                self.bboxes = z['bboxes']
+            return True
+        except Exception as e:
+            print(f"Warning: Could not read GeoJSON index {self.index_path}: {e}")
+            return False
+
+    def lookup(self, codes):
+        """
+        Returns positions (into the sorted index) of every feature whose code is in `codes`;
+        a KEY_CODE repeated in the file yields all of its features.
+        """
+        want = []
+        for c in codes:
+            try:
+                want.append(int(c))
+            except (TypeError, ValueError):
+                continue
+        if not want or len(self.codes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        want = np.unique(np.asarray(want, dtype=np.int64))
+        lo = np.searchsorted(self.codes, want, side='left')
+        counts = np.searchsorted(self.codes, want, side='right') - lo
+        # lo[k], lo[k] + 1, ..., lo[k] + counts[k] - 1 for every wanted code
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        return starts + np.arange(int(counts.sum()), dtype=np.int64)
+
+    def read_features(self, codes):
+        """Reads only the features for `codes`, in file order."""
+        pos = self.lookup(codes)
+        pos = pos[np.argsort(self.offsets[pos])]
+        features = []
+        with open(self.path, 'rb') as f:
+            for p in pos:
+                f.seek(int(self.offsets[p]))
+                features.append(json.loads(f.read(int(self.lengths[p]))))
+        return features
+
+    def bbox_of(self, codes):
+        """Combined (min_x, min_y, max_x, max_y) of the given codes, or None."""
+        pos = self.lookup(codes)
+        if len(pos) == 0:
+            return None
+        bb = self.bboxes[pos]
+        return (float(np.nanmin(bb[:, 0])), float(np.nanmin(bb[:, 1])),
+                float(np.nanmax(bb[:, 2])), float(np.nanmax(bb[:, 3])))
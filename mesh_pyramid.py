@@ -0,0 +1,117 @@
+import numpy as np
+
+from mesh_utils import mesh_keys
+
+# 地域メッシュの次数 -> コードの桁数 (1次 80km, 2次 10km, 3次 1km, 4次 (1/2) 500m)
+MESH_LEVELS = {1: 4, 2: 6, 3: 8, 4: 9}
+LEVEL_NAMES = {"80km": 1, "10km": 2, "1km": 3, "500m": 4}
+
+# 各次数のメッシュの大きさ (経度, 緯度) [度]
+_MESH_SIZE = {1: (1.0, 2.0 / 3.0), 2: (7.5 / 60, 5.0 / 60), 3: (45.0 / 3600, 30.0 / 3600), 4: (22.5 / 3600, 15.0 / 3600)}
+
+
+def parse_level(value, default=None):
+    """'3' / 3 / '1km' -> mesh level (1..4); None -> default. ValueError otherwise."""
+    if value is None or value == '':
+        return default
+    if isinstance(value, str) and value in LEVEL_NAMES:
+        return LEVEL_NAMES[value]
+    level = int(value)
+    if level not in MESH_LEVELS:
+        raise ValueError(f"level must be one of 1..4 or {', '.join(LEVEL_NAMES)}")
+    return level
+
+
+def code_level(codes):
+    """Mesh level of int64 codes (all codes must have the same number of digits)."""
+    digits = {len(str(int(c))) for c in (np.min(codes), np.max(codes))} if len(codes) else {9}
+    levels = [level for level, d in MESH_LEVELS.items() if d in digits]
+    if len(digits) != 1 or not levels:
+        raise ValueError(f"mesh codes must all be of one level ({sorted(MESH_LEVELS.values())} digits)")
+    return levels[0]
+
+
+def mesh_bounds(codes, level):
+    """(west, south, east, north) in degrees of the level-`level` meshes `codes`."""
+    k = np.asarray(codes, dtype=np.int64) * 10 ** (9 - MESH_LEVELS[level])
+    south = k // 10 ** 7 / 1.5 + (k // 10 ** 4 % 10) * (5.0 / 60) + (k // 100 % 10) * (30.0 / 3600)
+    west = 100.0 + k // 10 ** 5 % 100 + (k // 10 ** 3 % 10) * (7.5 / 60) + (k // 10 % 10) * (45.0 / 3600)
+    n = k % 10
+    # 4次: 1=SW, 2=SE, 3=NW, 4=NE
+    south = south + ((n == 3) | (n == 4)) * (15.0 / 3600)
+    west = west + ((n == 2) | (n == 4)) * (22.5 / 3600)
+    dx, dy = _MESH_SIZE[level]
+    return west, south, west + dx, south + dy
+
+
+class MeshPyramid:
+    """
+    メッシュ階層の集計ピラミッド (4次 500m -> 3次 1km -> 2次 10km -> 1次 80km)。
+    - コードを数値順に並べると上位メッシュごとにセルが連続するので、各次数は
+      1つ下の次数の結果を np.add.reduceat でブロック集計するだけで得られる (O(cells))
+    - 集計方法は 'sum' (人口・交通量) と 'mean' (地価・acc: 有効セルの平均)
+    構造はコード表だけで決まるので、一度作れば同じメッシュ集合の全レイヤ・全年で使い回せる。
+    """
+
+    def __init__(self, codes):
+        keys, valid = mesh_keys(codes)
+        if not valid.all():
+            raise ValueError("invalid mesh codes")
+        keys = keys.reshape(-1)
+        self.base_level = code_level(keys)
+        # 既に数値順 (MeshGridMapper.codes) なら並べ替えない
+        self.order = None if np.all(keys[1:] >= keys[:-1]) else np.argsort(keys, kind='stable')
+        base = keys if self.order is None else keys[self.order]
+        self.levels = {self.base_level: {"codes": base, "starts": None, "cells": np.ones(len(base), dtype=np.int64)}}
+        child, cells = base, self.levels[self.base_level]["cells"]
+        for level in range(self.base_level - 1, 0, -1):
+            parent = child // 10 ** (MESH_LEVELS[level + 1] - MESH_LEVELS[level])
+            starts = np.flatnonzero(np.r_[True, parent[1:] != parent[:-1]]) if len(parent) else np.zeros(0, dtype=np.int64)
+            cells = np.add.reduceat(cells, starts) if len(starts) else cells[:0]
+            child = parent[starts]
+            self.levels[level] = {"codes": child, "starts": starts, "cells": cells}
+        self._tables = {}
+
+    def codes(self, level):
+        return self._level(level)["codes"]
+
+    def cells(self, level):
+        """Number of base cells in each mesh of `level`."""
+        return self._level(level)["cells"]
+
+    def _level(self, level):
+        if level not in self.levels:
+            raise ValueError(f"level {level} is finer than the base mesh level {self.base_level}")
+        return self.levels[level]
+
+    def reduce(self, values, level, how="sum"):
+        """
+        values: (cells, ...) in input code order -> (meshes of `level`, ...) float64 sums or
+        per-cell means, each level block-reduced from the one below.
+        """
+        self._level(level)
+        values = np.asarray(values, dtype=np.float64)
+        if self.order is not None:
+            values = values[self.order]
+        for lv in range(self.base_level - 1, level - 1, -1):
+            starts = self.levels[lv]["starts"]
+            values = np.add.reduceat(values, starts, axis=0) if len(starts) else values[:0]
+        if how == "mean":
+            cells = self.levels[level]["cells"].reshape((-1,) + (1,) * (values.ndim - 1))
+            values = values / np.maximum(cells, 1)
+        elif how != "sum":
+            raise ValueError(f"Unknown reduction: {how}")
+        return values
+
+    def table(self, level):
+        """Code table of a level for clients: codes, base cell counts and lon/lat bounds (cached)."""
+        if level not in self._tables:
+            codes = self.codes(level)
+            west, south, east, north = mesh_bounds(codes, level)
+            self._tables[level] = {
+                "level": level,
+                "codes": codes.astype(str).tolist(),
+                "cells": self.cells(level).tolist(),
+                "bounds": np.round(np.stack([west, south, east, north], axis=1), 7).tolist()
+            }
+        return self._tables[level]
@@ -1,98 +1,186 @@
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# 10^k (k = 0..18) for digit counts of int64 codes
+_POW10 = 10 ** np.arange(19, dtype=np.int64)
+
+
+def mesh_keys(codes):
+    """
+    Mesh codes (ints or digit strings, any array-like) -> (int64 keys, valid mask).
+    Empty / non-numeric codes are masked out instead of raising.
+    """
+    codes = np.asarray(codes)
+    if codes.dtype.kind in 'iu':
+        return codes.astype(np.int64, copy=False), np.ones(codes.shape, dtype=bool)
+    if codes.dtype.kind in 'US':
+        try:
+            return codes.astype(np.int64), np.ones(codes.shape, dtype=bool)
+        except ValueError:
+            pass
+    values = pd.to_numeric(pd.Series(codes.reshape(-1), dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    valid = np.isfinite(values) & (values == np.floor(values))
+    return np.where(valid, values, 0).astype(np.int64).reshape(codes.shape), valid.reshape(codes.shape)
 
-import math
 
 class MeshGridMapper:
+    """
+    Standard regional mesh codes <-> grid coordinates (col, row), held as parallel arrays:
+    - codes: sorted unique int64 mesh codes
+    - code_cols / code_rows: int32 grid coordinates of each code (row 0 is north)
+    - index_grid: (rows, cols) int32 position in `codes` of every grid cell (-1 = no mesh)
+    Lookups are vectorized (searchsorted on codes / fancy index on index_grid).
+    """
+
     def __init__(self):
         self.min_x = float('inf')
         self.max_x = float('-inf')
         self.min_y = float('inf')
         self.max_y = float('-inf')
-        self.mapping = {} # mesh_code -> (col_x, row_y)
-        self.reverse_mapping = {} # (col_x, row_y) -> mesh_code
         self.cols = 0
         self.rows = 0
+        self.codes = np.zeros(0, dtype=np.int64)
+        self.code_cols = np.zeros(0, dtype=np.int32)
+        self.code_rows = np.zeros(0, dtype=np.int32)
+        self.index_grid = np.full((0, 0), -1, dtype=np.int32)
+        self._strings = None
+        self._table_id = None
+        self._payload = None
 
     def fit(self, mesh_codes):
         """
         Analyzes a list of mesh codes to determine grid bounds and create a mapping.
         Assumes all mesh codes are of the same level (e.g., all 9-digit or all 8-digit).
         """
-        coords = []
-        for code in mesh_codes:
-            code = str(code)
-            # Basic parsing for Standard Mesh
-            # 1st (4): YYXX
-            # 2nd (2): yx
-            # 3rd (2): yx
-            # 4th (1): n (1=SW, 2=SE, 3=NW, 4=NE) -> corresponds to 2x2 subgrid
-            
-            # We will convert everything to a global relative coordinate system based on the smallest unit
-            # For 9-digit (4th mesh), the unit is 1/2 of 3rd mesh.
-            
-            y1 = int(code[0:2])
-            x1 = int(code[2:4])
-            y2 = int(code[4:5])
-            x2 = int(code[5:6])
-            
-            y3 = 0
-            x3 = 0
-            y4 = 0
-            x4 = 0
-            
-            if len(code) >= 8:
-                y3 = int(code[6:7])
-                x3 = int(code[7:8])
-            
-            if len(code) >= 9:
-                n = int(code[8:9])
-                # 1: SW (0,0), 2: SE (1,0), 3: NW (0,1), 4: NE (1,1)
-                if n == 1: y4, x4 = 0, 0
-                elif n == 2: y4, x4 = 0, 1
-                elif n == 3: y4, x4 = 1, 0
-                elif n == 4: y4, x4 = 1, 1
-                
-            # Calculate absolute index factors
-            # Level 1: 80km x 80km roughly. 
-            # Level 2: Divide by 8 -> 10km. (Index 0-7)
-            # Level 3: Divide by 10 -> 1km. (Index 0-9)
-            # Level 4: Divide by 2 -> 500m. (Index 0-1)
-            
-            # Global X index = (x1 * 80 * 10 * 2) + (x2 * 10 * 2) + (x3 * 2) + x4
-            # Global Y index = (y1 * 80 * 10 * 2) + (y2 * 10 * 2) + (y3 * 2) + y4
-            # Wait, 1st mesh isn't 0-based index. It starts from 30 usually. 
-            # We just need relative differences, so this "Global Index" formula works for sorting/bounds.
-            
-            gx = (x1 * 8 * 10 * 2) + (x2 * 10 * 2) + (x3 * 2) + x4
-            gy = (y1 * 8 * 10 * 2) + (y2 * 10 * 2) + (y3 * 2) + y4
-            
-            coords.append((code, gx, gy))
-            
-            if gx < self.min_x: self.min_x = gx
-            if gx > self.max_x: self.max_x = gx
-            if gy < self.min_y: self.min_y = gy
-            if gy > self.max_y: self.max_y = gy
-            
-        # Create normalized mapping (0 to Width-1, 0 to Height-1)
-        self.cols = (self.max_x - self.min_x) + 1
-        self.rows = (self.max_y - self.min_y) + 1
-        
-        for code, gx, gy in coords:
-            # Grid logic usually places (0,0) at Top-Left or Bottom-Left.
-            # Array logic: row 0 is usually top.
-            # Map logic: Y increases North.
-            # Let's align with Array logic: (row, col).
-            # If we want visual consistency, row 0 should be North (Max Y).
-            # let row = self.max_y - gy
-            # let col = gx - self.min_x
-            
-            col = gx - self.min_x
-            row = self.max_y - gy # Invert Y so 0 is top
-            
-            self.mapping[code] = (col, row)
-            self.reverse_mapping[(col, row)] = code
+        keys, valid = mesh_keys(mesh_codes)
+        if not valid.all():
+            raise ValueError(f"invalid mesh codes: {np.asarray(mesh_codes)[~valid][:3].tolist()}")
+        codes = np.unique(keys.reshape(-1))
+        # Basic parsing for Standard Mesh
+        # 1st (4): YYXX
+        # 2nd (2): yx
+        # 3rd (2): yx
+        # 4th (1): n (1=SW, 2=SE, 3=NW, 4=NE) -> corresponds to 2x2 subgrid
+        # Digits beyond the 9th are ignored; 6-digit codes have no 3rd / 4th level.
+        digits = np.searchsorted(_POW10, codes, side='right')
+        scale = np.where(digits >= 9, 1, _POW10[np.clip(9 - digits, 0, 18)])
+        k = np.where(digits > 9, codes // _POW10[np.clip(digits - 9, 0, 18)], codes * scale)
+        y1, x1 = k // 10 ** 7, k // 10 ** 5 % 100
+        y2, x2 = k // 10 ** 4 % 10, k // 10 ** 3 % 10
+        has3 = digits >= 8
+        y3, x3 = np.where(has3, k // 100 % 10, 0), np.where(has3, k // 10 % 10, 0)
+        n = np.where(digits >= 9, k % 10, 0)
+        # 1: SW (0,0), 2: SE (1,0), 3: NW (0,1), 4: NE (1,1); anything else (0,0)
+        x4 = ((n == 2) | (n == 4)).astype(np.int64)
+        y4 = ((n == 3) | (n == 4)).astype(np.int64)
+
+        # Global index in units of the 4th level (500m):
+        # Level 1: 80km (x8 -> Level 2: 10km, x10 -> Level 3: 1km, x2 -> Level 4: 500m)
+        # 1st mesh isn't 0-based, but only relative differences are used.
+        gx = x1 * 8 * 10 * 2 + x2 * 10 * 2 + x3 * 2 + x4
+        gy = y1 * 8 * 10 * 2 + y2 * 10 * 2 + y3 * 2 + y4
+
+        self.__init__()
+        if not len(codes):
+            return
+        self.min_x, self.max_x = int(gx.min()), int(gx.max())
+        self.min_y, self.max_y = int(gy.min()), int(gy.max())
+        # Create normalized mapping (0 to Width-1, 0 to Height-1), row 0 = north (max Y)
+        self._set_arrays(codes, (gx - self.min_x).astype(np.int32), (self.max_y - gy).astype(np.int32),
+                         self.max_x - self.min_x + 1, self.max_y - self.min_y + 1)
+
+    def _set_arrays(self, codes, cols, rows, width, height):
+        self.cols, self.rows = int(width), int(height)
+        grid = np.full((self.rows, self.cols), -1, dtype=np.int32)
+        grid[rows, cols] = np.arange(len(codes), dtype=np.int32)
+        for a in (codes, cols, rows, grid):
+            a.flags.writeable = False
+        self.codes, self.code_cols, self.code_rows, self.index_grid = codes, cols, rows, grid
+
+    def __len__(self):
+        return len(self.codes)
+
+    # --- Vectorized lookups ---
+
+    def lookup(self, mesh_codes):
+        """Codes -> (positions in self.codes, found mask); positions are 0 where not found."""
+        keys, valid = mesh_keys(mesh_codes)
+        if not len(self.codes):
+            return np.zeros(keys.shape, dtype=np.int64), np.zeros(keys.shape, dtype=bool)
+        at = np.minimum(np.searchsorted(self.codes, keys), len(self.codes) - 1)
+        found = valid & (self.codes[at] == keys)
+        return np.where(found, at, 0), found
+
+    def codes_to_coords(self, mesh_codes):
+        """Codes -> (cols, rows, found); cols / rows are -1 for unknown codes."""
+        at, found = self.lookup(mesh_codes)
+        cols = np.where(found, self.code_cols[at] if len(self.codes) else -1, -1).astype(np.int32)
+        rows = np.where(found, self.code_rows[at] if len(self.codes) else -1, -1).astype(np.int32)
+        return cols, rows, found
+
+    def coords_to_codes(self, cols, rows):
+        """Grid coordinates -> (int64 codes, found); codes are 0 where there is no mesh."""
+        cols, rows = np.asarray(cols, dtype=np.int64), np.asarray(rows, dtype=np.int64)
+        inside = (cols >= 0) & (cols < self.cols) & (rows >= 0) & (rows < self.rows)
+        at = np.where(inside, self.index_grid[np.where(inside, rows, 0), np.where(inside, cols, 0)]
+                      if self.index_grid.size else -1, -1)
+        found = at >= 0
+        return np.where(found, self.codes[np.maximum(at, 0)] if len(self.codes) else 0, 0), found
 
     def get_grid_coords(self, mesh_code):
-        return self.mapping.get(str(mesh_code))
-        
+        cols, rows, found = self.codes_to_coords([mesh_code])
+        return (int(cols[0]), int(rows[0])) if found[0] else None
+
     def get_mesh_code(self, col, row):
-        return self.reverse_mapping.get((col, row))
+        codes, found = self.coords_to_codes([col], [row])
+        return str(codes[0]) if found[0] else None
+
+    # --- Cached serialisation ---
+
+    def code_strings(self):
+        """Codes as a list of str (cached)."""
+        if self._strings is None:
+            self._strings = self.codes.astype(str).tolist()
+        return self._strings
+
+    @property
+    def table_id(self):
+        """Short content hash of the code table (stable across processes)."""
+        if self._table_id is None:
+            self._table_id = hashlib.sha1(','.join(self.code_strings()).encode('utf-8')).hexdigest()[:16]
+        return self._table_id
+
+    def payload(self):
+        """The code table as JSON bytes {"table_id", "width", "height", "codes", "cols", "rows"} (cached)."""
+        if self._payload is None:
+            self._payload = json.dumps({
+                "table_id": self.table_id,
+                "width": self.cols,
+                "height": self.rows,
+                "codes": self.code_strings(),
+                "cols": self.code_cols.tolist(),
+                "rows": self.code_rows.tolist()
+            }, separators=(',', ':')).encode('utf-8')
+        return self._payload
+
+    def save(self, path):
+        """Writes the fitted arrays to an .npz file."""
+        # 空の mapper の範囲は ±inf なので 0 で書く (load は codes が空なら範囲を読まない)
+        bounds = [self.min_x, self.max_x, self.min_y, self.max_y] if len(self.codes) else [0, 0, 0, 0]
+        np.savez(path, codes=self.codes, cols=self.code_cols, rows=self.code_rows,
+                 bounds=np.array(bounds, dtype=np.int64))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Mapper from a file written by save() (no refit)."""
+        mapper = cls()
+        with np.load(path) as data:
+            if len(data['codes']):
+                mapper.min_x, mapper.max_x, mapper.min_y, mapper.max_y = (int(v) for v in data['bounds'])
+                mapper._set_arrays(data['codes'], data['cols'], data['rows'],
+                                   mapper.max_x - mapper.min_x + 1, mapper.max_y - mapper.min_y + 1)
+        return mapper
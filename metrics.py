@@ -0,0 +1,204 @@
+import os
+import time
+import threading
+import tracemalloc
+import collections
+from contextlib import contextmanager
+
+
+class _NullPhase:
+    """Shared no-op context used when metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class RunMetrics:
+    """Per-job collection of phase timings, peak memory and counters (e.g. one /api/simulate run)."""
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+
+    def add_phase(self, name, seconds, peak_bytes=None):
+        p = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+        p["seconds"] += seconds
+        p["calls"] += 1
+        if peak_bytes is not None:
+            p["peak_bytes"] = max(p.get("peak_bytes", 0), peak_bytes)
+
+    def add_counter(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            "phases": {k: dict(v, seconds=round(v["seconds"], 6)) for k, v in self.phases.items()},
+            "counters": dict(self.counters)
+        }
+
+
+class _Phase:
+    __slots__ = ("metrics", "name", "start", "mem_start", "child_peak")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.child_peak = 0
+
+    def __enter__(self):
+        m = self.metrics
+        if m.track_memory:
+            self.mem_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            m._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        m = self.metrics
+        peak = None
+        if m.track_memory:
+            stack = m._stack()
+            if stack and stack[-1] is self:
+                stack.pop()
+            abs_peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            peak = max(0, abs_peak - self.mem_start)
+            # 内側のフェーズで reset_peak されるため、絶対ピークを外側へ伝える
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, abs_peak)
+        m.observe(self.name, elapsed, peak)
+        return False
+
+
+class Metrics:
+    """
+    軽量な計測レイヤ (フェーズ時間・カウンタ・フェーズ内ピークメモリ)。
+    - phase(name): with 文で時間を計測 (無効時は共有の no-op を返すだけ)
+    - inc(name, n): カウンタ加算
+    - capture(): このスレッドで実行中のジョブ単位の集計 (RunMetrics) を取る
+    - render_prometheus(): /api/metrics 用の Prometheus テキスト形式
+    ピークメモリは track_memory=True (tracemalloc) の場合のみ記録する。
+    """
+
+    def __init__(self, enabled=True, track_memory=False, prefix="city_lite"):
+        self.enabled = enabled
+        self.track_memory = False
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._phase_seconds = collections.defaultdict(float)
+        self._phase_calls = collections.defaultdict(int)
+        self._phase_last = {}
+        self._phase_peak = {}
+        self._counters = collections.defaultdict(int)
+        if track_memory:
+            self.set_track_memory(True)
+
+    def set_track_memory(self, on):
+        if on and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.track_memory = bool(on) and self.enabled
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _runs(self):
+        runs = getattr(self._local, "runs", None)
+        if runs is None:
+            runs = self._local.runs = []
+        return runs
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def observe(self, name, seconds, peak_bytes=None):
+        """Records an externally measured phase duration."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._phase_seconds[name] += seconds
+            self._phase_calls[name] += 1
+            self._phase_last[name] = seconds
+            if peak_bytes is not None:
+                self._phase_peak[name] = max(self._phase_peak.get(name, 0), peak_bytes)
+        for run in self._runs():
+            run.add_phase(name, seconds, peak_bytes)
+
+    def inc(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] += value
+        for run in self._runs():
+            run.add_counter(name, value)
+
+    @contextmanager
+    def capture(self):
+        """Collects everything recorded by this thread inside the block into a RunMetrics."""
+        run = RunMetrics()
+        if not self.enabled:
+            yield run
+            return
+        runs = self._runs()
+        runs.append(run)
+        try:
+            yield run
+        finally:
+            runs.remove(run)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "phases": {
+                    name: {
+                        "seconds_total": round(self._phase_seconds[name], 6),
+                        "calls": self._phase_calls[name],
+                        "last_seconds": round(self._phase_last.get(name, 0.0), 6),
+                        "peak_bytes": self._phase_peak.get(name)
+                    } for name in self._phase_seconds
+                },
+                "counters": dict(self._counters)
+            }
+
+    def render_prometheus(self):
+        snap = self.snapshot()
+        p = self.prefix
+        lines = []
+
+        def metric(name, mtype, help_text, samples):
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {mtype}")
+            for label, value in samples:
+                lines.append(f'{p}_{name}{{{label}}} {value}')
+
+        phases = sorted(snap["phases"].items())
+        metric("phase_seconds_total", "counter", "Total wall time spent in a phase.",
+               [(f'phase="{n}"', v["seconds_total"]) for n, v in phases])
+        metric("phase_calls_total", "counter", "Number of times a phase ran.",
+               [(f'phase="{n}"', v["calls"]) for n, v in phases])
+        metric("phase_last_seconds", "gauge", "Wall time of the most recent run of a phase.",
+               [(f'phase="{n}"', v["last_seconds"]) for n, v in phases])
+        metric("phase_peak_bytes", "gauge", "Peak traced memory above the phase start (tracemalloc).",
+               [(f'phase="{n}"', v["peak_bytes"]) for n, v in phases if v["peak_bytes"] is not None])
+        metric("events_total", "counter", "Work counters (paths searched, cells updated, ...).",
+               [(f'name="{n}"', v) for n, v in sorted(snap["counters"].items())])
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide instance. CITY_LITE_METRICS=0 disables, CITY_LITE_METRICS_MEMORY=1 adds peak memory.
+METRICS = Metrics(
+    enabled=os.environ.get("CITY_LITE_METRICS", "1") != "0",
+    track_memory=os.environ.get("CITY_LITE_METRICS_MEMORY") == "1"
+)
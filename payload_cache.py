@@ -0,0 +1,116 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+
+
+def source_stamps(paths):
+    """Returns [[path, mtime_ns, size], ...] for the given source files (missing files -> None)."""
+    stamps = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            stamps.append([os.path.basename(p), st.st_mtime_ns, st.st_size])
+        except OSError:
+            stamps.append([os.path.basename(p), None, None])
+    return stamps
+
+
+class CachedPayload:
+    """
+    入力ファイルから生成するJSONレスポンスのキャッシュ。
+    - 生成結果は gzip 済みバイト列としてメモリとディスクに保持
+    - 入力ファイルの mtime/size が変わった場合のみ再生成
+    - ETag (内容のハッシュ) を持ち、If-None-Match / Accept-Encoding に応じた応答を作る
+    """
+
+    def __init__(self, name, source_paths, build_fn, cache_dir):
+        self.name = name
+        self.source_paths = list(source_paths)
+        self.build_fn = build_fn
+        self.gz_path = os.path.join(cache_dir, f"{name}.json.gz")
+        self.meta_path = os.path.join(cache_dir, f"{name}.meta.json")
+        self._lock = threading.Lock()
+        self._stamps = None
+        self._gz = None
+        self._raw = None
+        self.etag = None
+
+    def _load_from_disk(self, stamps):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('sources') != stamps:
+                return False
+            with open(self.gz_path, 'rb') as f:
+                self._gz = f.read()
+            self.etag = meta['etag']
+            self._raw = None
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _store(self, raw, stamps):
+        self._raw = raw
+        self._gz = gzip.compress(raw, compresslevel=6)
+        self.etag = hashlib.sha1(raw).hexdigest()[:20]
+        try:
+            os.makedirs(os.path.dirname(self.gz_path), exist_ok=True)
+            tmp = self.gz_path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(self._gz)
+            os.replace(tmp, self.gz_path)
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'sources': stamps, 'etag': self.etag}, f)
+        except OSError as e:
+            print(f"Warning: Could not write cache for {self.name}: {e}")
+
+    def ensure(self):
+        """Builds (or reloads) the payload if the source files changed. Returns the ETag."""
+        stamps = source_stamps(self.source_paths)
+        if self._gz is not None and stamps == self._stamps:
+            return self.etag
+        with self._lock:
+            if self._gz is not None and stamps == self._stamps:
+                return self.etag
+            if not self._load_from_disk(stamps):
+                print(f"Building cached payload '{self.name}'...")
+                data = self.build_fn()
+                raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                self._store(raw, stamps)
+            self._stamps = stamps
+        return self.etag
+
+    def invalidate(self):
+        with self._lock:
+            self._stamps = None
+            self._gz = None
+            self._raw = None
+
+    @property
+    def gzipped(self):
+        return self._gz
+
+    @property
+    def raw(self):
+        if self._raw is None and self._gz is not None:
+            self._raw = gzip.decompress(self._gz)
+        return self._raw
+
+    def make_response(self, request, response_class):
+        """Builds a Flask response honouring If-None-Match and Accept-Encoding."""
+        etag = self.ensure()
+        quoted = f'"{etag}"'
+        if_none_match = request.headers.get('If-None-Match', '')
+        if quoted in [t.strip() for t in if_none_match.split(',')] or if_none_match.strip() == '*':
+            resp = response_class(status=304)
+        elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+            resp = response_class(self.gzipped, mimetype='application/json')
+            resp.headers['Content-Encoding'] = 'gzip'
+        else:
+            resp = response_class(self.raw, mimetype='application/json')
+        resp.headers['ETag'] = quoted
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
@@ -0,0 +1,134 @@
+import io
+import os
+import re
+import time
+import random
+import pstats
+import cProfile
+import threading
+
+from flask import g, request
+
+
+class RequestProfiler:
+    """
+    オンデマンドのリクエストプロファイラ (cProfile)。
+    - 既定は無効。管理エンドポイントで有効化 (sample_rate で抽出率を指定) するか、
+      管理トークン付きの X-Profile: 1 ヘッダで個別リクエストを計測
+    - 対象ルートのみ計測し、.prof を profile_dir にリングバッファとして保存 (max_profiles 件)
+    - 無効時の before_request は属性参照とヘッダ確認のみ
+    """
+
+    HEADER = 'X-Profile'
+    SORT_KEYS = tuple(key.value for key in pstats.SortKey)
+
+    def __init__(self, profile_dir, routes, max_profiles=50):
+        self.profile_dir = profile_dir
+        self.routes = set(routes)
+        self.max_profiles = max_profiles
+        self.enabled = False
+        self.sample_rate = 1.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app, is_admin):
+        """Registers request hooks. `is_admin()` decides whether the caller may force profiling."""
+        self.is_admin = is_admin
+
+        @app.before_request
+        def _start_profile():
+            if not self.enabled and self.HEADER not in request.headers:
+                return
+            rule = request.url_rule.rule if request.url_rule else None
+            if rule not in self.routes:
+                return
+            forced = request.headers.get(self.HEADER) == '1' and self.is_admin()
+            if not forced and not (self.enabled and random.random() < self.sample_rate):
+                return
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:
+                # 別のプロファイラが動作中 (Python 3.12+ はプロセスで1つ)
+                return
+            g._profile = (prof, time.perf_counter(), rule)
+
+        @app.teardown_request
+        def _stop_profile(exc):
+            state = g.pop('_profile', None)
+            if state is None:
+                return
+            prof, start, rule = state
+            prof.disable()
+            self._store(prof, rule, time.perf_counter() - start)
+
+    def configure(self, enabled=None, sample_rate=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        return self.status()
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "routes": sorted(self.routes),
+            "max_profiles": self.max_profiles,
+            "stored": len(self._files())
+        }
+
+    # --- Storage (ring buffer on disk) ---
+
+    def _files(self):
+        try:
+            names = [n for n in os.listdir(self.profile_dir) if n.endswith('.prof')]
+        except OSError:
+            return []
+        return sorted(names)
+
+    def _store(self, prof, rule, seconds):
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', rule).strip('_') or 'root'
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}_{slug}_{int(seconds * 1000)}ms"
+        with self._lock:
+            try:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                prof.dump_stats(os.path.join(self.profile_dir, profile_id + '.prof'))
+                files = self._files()
+                for old in files[:max(0, len(files) - self.max_profiles)]:
+                    os.remove(os.path.join(self.profile_dir, old))
+            except OSError as e:
+                print(f"Warning: Could not store profile: {e}")
+
+    def list_profiles(self):
+        result = []
+        for name in reversed(self._files()):
+            path = os.path.join(self.profile_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result.append({
+                "id": name[:-len('.prof')],
+                "size": st.st_size,
+                "created": st.st_mtime
+            })
+        return result
+
+    def profile_path(self, profile_id):
+        """Path of a stored profile, or None for unknown / malformed ids."""
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+', profile_id or ''):
+            return None
+        path = os.path.join(self.profile_dir, profile_id + '.prof')
+        return path if os.path.exists(path) else None
+
+    def profile_text(self, profile_id, sort='cumulative', limit=50):
+        """Top functions as text, or None for unknown ids. Raises ValueError for a sort key outside SORT_KEYS."""
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        path = self.profile_path(profile_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
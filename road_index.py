@@ -0,0 +1,226 @@
+import os
+import json
+import numpy as np
+
+
+def _iter_coords(geom):
+    """Yields [lon, lat] points of a (Multi)LineString / (Multi)Polygon geometry."""
+    g_type = geom.get('type')
+    coords = geom.get('coordinates') or []
+    if g_type == 'Point':
+        yield coords
+    elif g_type in ('LineString', 'MultiPoint'):
+        yield from coords
+    elif g_type in ('MultiLineString', 'Polygon'):
+        for part in coords:
+            yield from part
+    elif g_type == 'MultiPolygon':
+        for poly in coords:
+            for ring in poly:
+                yield from ring
+
+
+def feature_bbox(feature):
+    """Returns (min_x, min_y, max_x, max_y) of a feature, or None if it has no points."""
+    geom = feature.get('geometry')
+    if not geom:
+        return None
+    pts = [p[:2] for p in _iter_coords(geom)]
+    if not pts:
+        return None
+    arr = np.asarray(pts, dtype=np.float64)
+    return (arr[:, 0].min(), arr[:, 1].min(), arr[:, 0].max(), arr[:, 1].max())
+
+
+class RoadIndex:
+    """
+    道路GeoJSONの空間インデックス (Uniform Grid Bucket)。
+    - 各フィーチャのbboxを (N, 4) のNumPy配列として事前計算
+    - 一様グリッドのセルごとにフィーチャ番号をCSR形式 (cell_start, cell_items) で保持
+    - bboxクエリは該当セルの候補のみをベクトル演算で判定 (全件走査なし)
+    - インデックスはGeoJSONの隣に .idx.npz として保存し、次回起動時は再計算しない
+    """
+
+    INDEX_VERSION = 1
+    # 1セル当たりの目標フィーチャ数 (グリッド解像度の決定に使用)
+    TARGET_PER_CELL = 8
+
+    def __init__(self):
+        self.features = []
+        self.bboxes = np.zeros((0, 4), dtype=np.float64)  # min_x, min_y, max_x, max_y
+        self.origin = (0.0, 0.0)
+        self.cell_size = (1.0, 1.0)
+        self.nx = 0
+        self.ny = 0
+        self.cell_start = np.zeros(1, dtype=np.int64)
+        self.cell_items = np.zeros(0, dtype=np.int32)
+        self.source_path = None
+        self.source_stamp = None
+
+    # --- Build ---
+
+    def build(self, features):
+        """Precompute bboxes and the grid buckets for a list of GeoJSON features."""
+        self.features = features
+        n = len(features)
+        bboxes = np.full((n, 4), np.nan, dtype=np.float64)
+        for i, feat in enumerate(features):
+            bb = feature_bbox(feat)
+            if bb is not None:
+                bboxes[i] = bb
+        self.bboxes = bboxes
+        self._build_grid()
+        return self
+
+    def _build_grid(self):
+        valid = ~np.isnan(self.bboxes[:, 0])
+        if not valid.any():
+            self.nx = self.ny = 0
+            self.cell_start = np.zeros(1, dtype=np.int64)
+            self.cell_items = np.zeros(0, dtype=np.int32)
+            return
+
+        bb = self.bboxes[valid]
+        min_x, min_y = bb[:, 0].min(), bb[:, 1].min()
+        max_x, max_y = bb[:, 2].max(), bb[:, 3].max()
+        span_x = max(max_x - min_x, 1e-9)
+        span_y = max(max_y - min_y, 1e-9)
+
+        # セル数 ≒ N / TARGET_PER_CELL となるよう正方に近い分割を選ぶ
+        n_cells = max(1, int(len(bb) / self.TARGET_PER_CELL))
+        side = np.sqrt(span_x * span_y / n_cells)
+        self.nx = int(min(max(1, np.ceil(span_x / side)), 4096))
+        self.ny = int(min(max(1, np.ceil(span_y / side)), 4096))
+        self.origin = (float(min_x), float(min_y))
+        self.cell_size = (span_x / self.nx, span_y / self.ny)
+
+        # 各フィーチャが跨ぐセル範囲
+        idx = np.nonzero(valid)[0].astype(np.int32)
+        cx0, cy0 = self._cell_of(bb[:, 0], bb[:, 1])
+        cx1, cy1 = self._cell_of(bb[:, 2], bb[:, 3])
+        counts = (cx1 - cx0 + 1) * (cy1 - cy0 + 1)
+
+        # (feature, cell) ペアを展開
+        owner = np.repeat(np.arange(len(idx)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        w = (cx1 - cx0 + 1)[owner]
+        cell_x = cx0[owner] + offset % w
+        cell_y = cy0[owner] + offset // w
+        cell_id = cell_y * self.nx + cell_x
+
+        order = np.argsort(cell_id, kind='stable')
+        self.cell_items = idx[owner[order]]
+        per_cell = np.bincount(cell_id, minlength=self.nx * self.ny)
+        self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(per_cell, out=self.cell_start[1:])
+
+    def _cell_of(self, x, y):
+        cx = np.floor((np.asarray(x) - self.origin[0]) / self.cell_size[0]).astype(np.int64)
+        cy = np.floor((np.asarray(y) - self.origin[1]) / self.cell_size[1]).astype(np.int64)
+        return np.clip(cx, 0, self.nx - 1), np.clip(cy, 0, self.ny - 1)
+
+    # --- Query ---
+
+    def query(self, west, south, east, north):
+        """Returns sorted indices of features whose bbox overlaps the given bbox."""
+        if self.nx == 0 or len(self.bboxes) == 0:
+            return np.zeros(0, dtype=np.int32)
+
+        ox, oy = self.origin
+        if (east < ox or north < oy or
+                west > ox + self.cell_size[0] * self.nx or
+                south > oy + self.cell_size[1] * self.ny):
+            return np.zeros(0, dtype=np.int32)
+
+        cx0, cy0 = self._cell_of(west, south)
+        cx1, cy1 = self._cell_of(east, north)
+        parts = []
+        for cy in range(int(cy0), int(cy1) + 1):
+            row = cy * self.nx
+            a = self.cell_start[row + int(cx0)]
+            b = self.cell_start[row + int(cx1) + 1]
+            if b > a:
+                parts.append(self.cell_items[a:b])
+        if not parts:
+            return np.zeros(0, dtype=np.int32)
+
+        cand = np.unique(np.concatenate(parts))
+        bb = self.bboxes[cand]
+        hit = (bb[:, 0] <= east) & (bb[:, 2] >= west) & (bb[:, 1] <= north) & (bb[:, 3] >= south)
+        return cand[hit]
+
+    def query_features(self, west, south, east, north):
+        return [self.features[i] for i in self.query(west, south, east, north)]
+
+    # --- Persistence ---
+
+    @staticmethod
+    def index_path(geojson_path):
+        return geojson_path + '.idx.npz'
+
+    @staticmethod
+    def _source_stamp(geojson_path):
+        st = os.stat(geojson_path)
+        return np.array([st.st_mtime_ns, st.st_size], dtype=np.int64)
+
+    def save(self, path, source_stamp):
+        np.savez(
+            path,
+            version=np.int64(self.INDEX_VERSION),
+            source=source_stamp,
+            bboxes=self.bboxes,
+            grid=np.array([self.origin[0], self.origin[1], self.cell_size[0], self.cell_size[1]]),
+            shape=np.array([self.nx, self.ny], dtype=np.int64),
+            cell_start=self.cell_start,
+            cell_items=self.cell_items,
+        )
+
+    def _load_arrays(self, path, source_stamp):
+        """Loads a persisted index. Returns False if it is missing or stale."""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as z:
+                if int(z['version']) != self.INDEX_VERSION:
+                    return False
+                if not np.array_equal(z['source'], source_stamp):
+                    return False
+                self.bboxes = z['bboxes']
+                ox, oy, sx, sy = z['grid']
+                self.origin = (float(ox), float(oy))
+                self.cell_size = (float(sx), float(sy))
+                self.nx, self.ny = (int(v) for v in z['shape'])
+                self.cell_start = z['cell_start']
+                self.cell_items = z['cell_items']
+            return True
+        except Exception as e:
+            print(f"Warning: Could not read road index {path}: {e}")
+            return False
+
+    @classmethod
+    def from_geojson(cls, geojson_path):
+        """
+        Loads roads GeoJSON and its spatial index.
+        The index is reused if the persisted file matches the GeoJSON's mtime/size,
+        otherwise it is rebuilt and written next to the GeoJSON.
+        """
+        index = cls()
+        with open(geojson_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index.features = data.get('features', [])
+
+        stamp = cls._source_stamp(geojson_path)
+        index.source_path = geojson_path
+        index.source_stamp = stamp
+        idx_path = cls.index_path(geojson_path)
+        if index._load_arrays(idx_path, stamp) and len(index.bboxes) == len(index.features):
+            print(f"Road index loaded from {idx_path}")
+            return index
+
+        index.build(index.features)
+        try:
+            index.save(idx_path, stamp)
+            print(f"Road index built and saved to {idx_path}")
+        except OSError as e:
+            print(f"Warning: Could not save road index: {e}")
+        return index
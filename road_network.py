@@ -0,0 +1,336 @@
+"""
+区画の道路種別テーブルから交通ネットワークを組み立てる (NetworkBuilder の置き換え)。
+
+入力 (data/compute_data, いずれも utf-8-sig):
+  区画ネットワーク.csv                  ゾーンごとの Nat / Pref / Muni / Other の本数・延長
+  registry_boundary_directions.csv      ゾーン境界 (N/E/S/W) ごとの幹線 / 支道の有無
+                                        (length_total_m はゾーン全体の延長の写しで境界ごとの値ではないので使わない)
+  nodes_with_geom.csv                   重心・境界ノードの経緯度
+  line_type_params.csv                  (時間帯, 道路種別, 車線数) ごとの速度・容量・信号遅れ
+
+ノード / リンクの命名と種別 ({z}_C, {z}_N.., internal_out / internal_in / passing / connector) は
+NetworkBuilder と同じ。テーブルにあるゾーンだけ道路種別つきのリンクになり、道路のない
+境界にはリンクを張らない。テーブルにないゾーンは従来どおりの固定値のリンク。
+表の結合とリンクの生成はゾーン x 境界の配列演算で行い、RoadNetwork (リンクの配列) を
+経由して nx.DiGraph を一括で作る。
+"""
+import gc
+import os
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from metrics import METRICS
+from mesh_utils import MeshGridMapper
+
+NETWORK_TABLE = "区画ネットワーク.csv"
+BOUNDARY_TABLE = "registry_boundary_directions.csv"
+NODE_TABLE = "nodes_with_geom.csv"
+LINE_PARAMS_TABLE = "line_type_params.csv"
+
+ROAD_CLASSES = ("Nat", "Pref", "Muni", "Other")
+SIDES = ("N", "S", "E", "W")
+EDGE_TYPES = ("internal_out", "internal_in", "passing", "connector")
+MAX_LANES = 4
+
+# NetworkBuilder の固定値 (length km, capacity, free_speed km/h); テーブルにないゾーンと接続リンクに使う
+DEFAULT_EDGE = {
+    "internal_out": (0.25, 500, 30),
+    "internal_in": (0.25, 500, 30),
+    "passing": (0.5, 1000, 40),
+    "connector": (0.01, 9999, 60),
+}
+# 車線数の目安: 種別の延長がセル一辺 (4次メッシュ 約500m) の何本分か
+CELL_SIDE_M = 500.0
+# 座標から求めるリンク長の範囲 (km): 重なっているノードは下限に丸め、セルの対角線
+# (約0.71km) を超えるもの (座標の誤り) は固定値を使う
+MIN_LINK_KM = 0.05
+MAX_LINK_KM = 0.75
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    """Great-circle distance in km (element-wise; NaN where a coordinate is missing)."""
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lon1, lat1, lon2, lat2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def has_road_tables(table_dir):
+    return all(os.path.exists(os.path.join(table_dir, name))
+               for name in (NETWORK_TABLE, BOUNDARY_TABLE, LINE_PARAMS_TABLE))
+
+
+def line_params(path, period):
+    """
+    line_type_params.csv -> {"free_speed", "capacity", "alpha", "beta"}: (classes, MAX_LANES) float64
+    tables for one period. free_speed folds the base time multiplier and the signal delay
+    (signals/km x sec/signal x period multiplier) into an effective km/h.
+    """
+    df = pd.read_csv(path, encoding="utf-8-sig")
+    df = df[df["period"] == period]
+    if df.empty:
+        raise ValueError(f"no line type parameters for period {period}")
+    cls = df["road_class"].map({c: i for i, c in enumerate(ROAD_CLASSES)})
+    lanes = df["lanes"].astype(int)
+    ok = cls.notna() & lanes.between(1, MAX_LANES)
+    df, cls, lanes = df[ok], cls[ok].astype(int).to_numpy(), lanes[ok].to_numpy() - 1
+
+    minutes_per_km = (60.0 * df["base_time_multiplier"] / df["base_speed_kmh"]
+                      + df["signal_density_per_km"] * df["stop_delay_sec_per_signal"]
+                      * df["period_delay_multiplier"] / 60.0).to_numpy(dtype=np.float64)
+    columns = {
+        "free_speed": 60.0 / minutes_per_km,
+        "capacity": (df["capacity_per_lane_vph"] * (lanes + 1)).to_numpy(dtype=np.float64),
+        "alpha": df["alpha"].to_numpy(dtype=np.float64),
+        "beta": df["beta"].to_numpy(dtype=np.float64),
+    }
+    tables = {}
+    for name, values in columns.items():
+        table = np.full((len(ROAD_CLASSES), MAX_LANES), np.nan)
+        table[cls, lanes] = values
+        tables[name] = table
+    missing = np.isnan(tables["free_speed"])
+    if missing.any():
+        raise ValueError(f"line type parameters for period {period} miss "
+                         f"{[(ROAD_CLASSES[c], l + 1) for c, l in zip(*np.nonzero(missing))]}")
+    return tables
+
+
+class RoadNetwork:
+    """
+    リンクの配列表現 (並行配列, 1要素 = 1リンク)。
+    - nodes: ノード名 / src, dst: nodes の位置
+    - length (km), capacity, free_speed (km/h), lanes, road_class (ROAD_CLASSES の位置, -1 = 固定値のリンク),
+      alpha / beta (道路種別の BPR 係数, 固定値のリンクは NaN = 設定の bpr), edge_type (EDGE_TYPES の位置)
+    """
+
+    def __init__(self, zones, nodes, src, dst, edge_type, length, capacity, free_speed,
+                 road_class, lanes, alpha, beta, lon=None, lat=None):
+        self.zones = zones
+        self.nodes = nodes
+        self.src, self.dst, self.edge_type = src, dst, edge_type
+        self.length, self.capacity, self.free_speed = length, capacity, free_speed
+        self.road_class, self.lanes, self.alpha, self.beta = road_class, lanes, alpha, beta
+        self.lon, self.lat = lon, lat
+
+    def __len__(self):
+        return len(self.src)
+
+    def to_graph(self):
+        """nx.DiGraph with NetworkBuilder's node and edge attributes (+ road class attributes where known)."""
+        # 数十万個の属性 dict を作る間は循環 GC を止める (何度も走って構築時間の半分を占める)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._graph()
+        finally:
+            if enabled:
+                gc.enable()
+
+    def _graph(self):
+        G = nx.DiGraph()
+        attrs = [{"type": "centroid"}] + [{"type": "boundary", "direction": d.lower()} for d in SIDES]
+        lon = self.lon.tolist() if self.lon is not None else [float('nan')] * len(self.nodes)
+        lat = self.lat.tolist() if self.lat is not None else lon
+        nodes = []
+        for i, name in enumerate(self.nodes):
+            zone, k = divmod(i, len(attrs))
+            node = dict(attrs[k], zone=self.zones[zone])
+            if lon[i] == lon[i]:
+                node["lon"], node["lat"] = lon[i], lat[i]
+            nodes.append((name, node))
+        G.add_nodes_from(nodes)
+
+        names = self.nodes
+        length, capacity, speed = self.length.tolist(), self.capacity.tolist(), self.free_speed.tolist()
+        types = [EDGE_TYPES[t] for t in self.edge_type.tolist()]
+        road_class, lanes = self.road_class.tolist(), self.lanes.tolist()
+        alpha, beta = self.alpha.tolist(), self.beta.tolist()
+        edges = []
+        for e, (u, v) in enumerate(zip(self.src.tolist(), self.dst.tolist())):
+            attrs = {"length": length[e], "capacity": capacity[e], "free_speed": speed[e], "type": types[e]}
+            if road_class[e] >= 0:
+                attrs.update(road_class=ROAD_CLASSES[road_class[e]], lanes=lanes[e], alpha=alpha[e], beta=beta[e])
+            edges.append((names[u], names[v], attrs))
+        G.add_edges_from(edges)
+        return G
+
+
+class RoadNetworkBuilder:
+    """
+    NetworkBuilder と同じ形のネットワークを区画の道路種別テーブルから作る。
+    - 境界の道路種別: 幹線があればゾーンの幹線種別 (Nat > Pref > Muni > Other のうち延長のある最上位)、
+      支道のみならゾーンの生活道路種別 (Muni, なければ Other)、どちらもなければその境界は道路なし
+    - 車線数: 種別の延長 / セル一辺 を 1..4 に丸めた値 (並行する道路もまとめた目安);
+      容量 = 車線あたり容量 x 車線数
+    - 長さ: ノードの経緯度から (重心 - 境界, 境界 - 境界)。座標がない / セルに収まらなければ固定値
+    - 通過リンクは両端の境界とも幹線なら幹線種別、それ以外は生活道路種別
+    - 接続リンク (隣接ゾーンの境界どうし) は仮想リンクのまま。両側に道路がある境界だけ接続する
+    道路のある境界が1つもないゾーンとテーブルにないゾーンは固定値のリンクになる。
+    """
+
+    def __init__(self, zones, table_dir, period="AM_PEAK"):
+        self.zones = zones
+        self.table_dir = table_dir
+        self.period = period
+
+    def build(self):
+        with METRICS.phase("network.build"):
+            G = self.build_arrays().to_graph()
+        METRICS.inc("network.nodes", G.number_of_nodes())
+        METRICS.inc("network.edges", G.number_of_edges())
+        return G
+
+    def _table(self, name):
+        path = os.path.join(self.table_dir, name)
+        return pd.read_csv(path, encoding="utf-8-sig") if os.path.exists(path) else None
+
+    def build_arrays(self):
+        """The network as a RoadNetwork (edge arrays, no graph)."""
+        print("Building Road-Class Graph...")
+        mapper = MeshGridMapper()
+        mapper.fit(self.zones)
+        zones = mapper.code_strings()
+        Z, S = len(zones), len(SIDES)
+        side_index = {s: k for k, s in enumerate(SIDES)}
+
+        # 1. ゾーン表: 種別ごとの延長 -> 幹線 / 生活道路の種別と車線数
+        known = np.zeros(Z, dtype=bool)
+        class_len = np.zeros((Z, len(ROAD_CLASSES)))
+        network = self._table(NETWORK_TABLE)
+        if network is not None:
+            at, found = mapper.lookup(network["zone_id"].to_numpy())
+            lens = network[[f"len_{c}_m" for c in ROAD_CLASSES]].fillna(0).to_numpy(dtype=np.float64)
+            class_len[at[found]] = lens[found]
+            known[at[found]] = True
+        has_len = class_len > 0
+        # 最上位の種別 (延長がなければ Other)
+        trunk = np.where(has_len.any(axis=1), np.argmax(has_len, axis=1), len(ROAD_CLASSES) - 1)
+        muni, other = ROAD_CLASSES.index("Muni"), ROAD_CLASSES.index("Other")
+        local = np.where(has_len[:, muni], muni, np.where(has_len[:, other], other, trunk))
+        lanes_by_class = np.clip(np.rint(class_len / CELL_SIDE_M), 1, MAX_LANES).astype(np.int64)
+
+        # 2. 境界表: 幹線 / 支道の有無
+        kansen = np.zeros((Z, S), dtype=bool)
+        sidou = np.zeros((Z, S), dtype=bool)
+        boundary = self._table(BOUNDARY_TABLE)
+        if boundary is not None:
+            boundary = boundary[boundary["is_present"].fillna(0).astype(float) > 0]
+            at, found = mapper.lookup(boundary["zone_id"].to_numpy())
+            side = boundary["side"].map(side_index)
+            found &= side.notna().to_numpy()
+            side = side.fillna(0).astype(int).to_numpy()
+            for kind, flags in (("kansen", kansen), ("sidouseikatudou", sidou)):
+                rows = found & (boundary["boundary_type"] == kind).to_numpy()
+                flags[at[rows], side[rows]] = True
+        kansen &= known[:, None]
+        sidou &= known[:, None]
+        # 道路のある境界が1つもないゾーンは固定値のリンクで扱う
+        classed = known & (kansen | sidou).any(axis=1)
+        present = np.where(classed[:, None], kansen | sidou, True)
+        side_class = np.where(kansen, trunk[:, None], local[:, None])
+        side_class = np.where(classed[:, None] & present, side_class, -1)
+
+        # 3. ノード座標 (重心 = 0, 境界 = 1..4)
+        lon = np.full((Z, 1 + S), np.nan)
+        lat = np.full((Z, 1 + S), np.nan)
+        nodes = self._table(NODE_TABLE)
+        if nodes is not None:
+            at, found = mapper.lookup(nodes["zone_id"].to_numpy())
+            slot = np.where(nodes["node_type"].astype(str).str.upper() == "CENTROID", 0,
+                            nodes["side"].map(side_index).fillna(-2).to_numpy() + 1).astype(int)
+            found &= slot >= 0
+            lon[at[found], slot[found]] = nodes["lon"].to_numpy(dtype=np.float64)[found]
+            lat[at[found], slot[found]] = nodes["lat"].to_numpy(dtype=np.float64)[found]
+
+        params = line_params(os.path.join(self.table_dir, LINE_PARAMS_TABLE), self.period) \
+            if classed.any() else None
+        zone_ids = np.arange(Z)
+
+        def node(z, k):
+            return z * (1 + S) + k
+
+        parts = []
+
+        def add(src, dst, kind, cls, zone, distance_km):
+            """Edges of one type; cls -1 -> NetworkBuilder's fixed values."""
+            length0, capacity0, speed0 = DEFAULT_EDGE[kind]
+            if distance_km is None:
+                length = np.full(len(src), length0, dtype=np.float64)
+            else:
+                usable = (cls >= 0) & np.isfinite(distance_km) & (distance_km <= MAX_LINK_KM)
+                length = np.where(usable, np.maximum(distance_km, MIN_LINK_KM), length0)
+            lanes = np.where(cls >= 0, lanes_by_class[zone, np.maximum(cls, 0)], 0)
+            if params is not None:
+                c, l = np.maximum(cls, 0), np.maximum(lanes, 1) - 1
+                capacity = np.where(cls >= 0, params["capacity"][c, l], capacity0)
+                speed = np.where(cls >= 0, params["free_speed"][c, l], speed0)
+                alpha = np.where(cls >= 0, params["alpha"][c, l], np.nan)
+                beta = np.where(cls >= 0, params["beta"][c, l], np.nan)
+            else:
+                capacity = np.full(len(src), capacity0, dtype=np.float64)
+                speed = np.full(len(src), speed0, dtype=np.float64)
+                alpha = beta = np.full(len(src), np.nan)
+            parts.append((src, dst, np.full(len(src), EDGE_TYPES.index(kind)), length, capacity, speed, cls, lanes, alpha, beta))
+
+        # 4. ゾーン内リンク (重心 <-> 境界)
+        z, k = np.nonzero(present)
+        dist = haversine_km(lon[z, 0], lat[z, 0], lon[z, k + 1], lat[z, k + 1])
+        cls = side_class[z, k]
+        add(node(z, 0), node(z, k + 1), "internal_out", cls, z, dist)
+        add(node(z, k + 1), node(z, 0), "internal_in", cls, z, dist)
+
+        # 5. 通過リンク (同じゾーンの境界 -> 境界, 全結合)
+        a, b = np.nonzero(~np.eye(S, dtype=bool))
+        both = present[:, a] & present[:, b]
+        z, p = np.nonzero(both)
+        a, b = a[p], b[p]
+        through = kansen[z, a] & kansen[z, b]
+        cls = np.where(classed[z], np.where(through, trunk[z], local[z]), -1)
+        dist = haversine_km(lon[z, a + 1], lat[z, a + 1], lon[z, b + 1], lat[z, b + 1])
+        add(node(z, a + 1), node(z, b + 1), "passing", cls, z, dist)
+
+        # 6. 接続リンク (N - 北隣の S, E - 東隣の W; 格子上の隣接は mapper の index_grid から)
+        rows, cols = mapper.code_rows.astype(np.int64), mapper.code_cols.astype(np.int64)
+        src_z, dst_z, src_k, dst_k = [], [], [], []
+        for side, opposite, dy, dx in (("N", "S", -1, 0), ("E", "W", 0, 1)):
+            r, c = rows + dy, cols + dx
+            inside = (r >= 0) & (r < mapper.rows) & (c >= 0) & (c < mapper.cols)
+            nb = np.full(Z, -1, dtype=np.int64)
+            nb[inside] = mapper.index_grid[r[inside], c[inside]]
+            s, o = side_index[side], side_index[opposite]
+            ok = (nb >= 0) & present[zone_ids, s] & present[np.maximum(nb, 0), o]
+            zz, nn = zone_ids[ok], nb[ok]
+            src_z += [zz, nn]
+            dst_z += [nn, zz]
+            src_k += [np.full(len(zz), s), np.full(len(zz), o)]
+            dst_k += [np.full(len(zz), o), np.full(len(zz), s)]
+        src_z, dst_z = np.concatenate(src_z), np.concatenate(dst_z)
+        add(node(src_z, np.concatenate(src_k) + 1), node(dst_z, np.concatenate(dst_k) + 1), "connector",
+            np.full(len(src_z), -1), src_z, None)
+        print(f"  Added {len(src_z) // 2} inter-zone connections.")
+
+        columns = [np.concatenate(c) for c in zip(*parts)]
+        src, dst, edge_type, length, capacity, speed, cls, lanes, alpha, beta = columns
+        names = [f"{zone}_{suffix}" for zone in zones for suffix in ("C",) + SIDES]
+        METRICS.inc("network.classed_zones", int(classed.sum()))
+        return RoadNetwork(zones, names, src.astype(np.int64), dst.astype(np.int64), edge_type.astype(np.int8),
+                           length, capacity, speed, cls.astype(np.int8), lanes.astype(np.int8), alpha, beta,
+                           lon=lon.reshape(-1), lat=lat.reshape(-1))
+
+
+def build_network(zones, data_dir, config=None):
+    """
+    The simulation graph: RoadNetworkBuilder when data_dir/compute_data has the road tables,
+    NetworkBuilder's fixed-value network otherwise.
+    """
+    import advanced_city_simulator as acs
+
+    config = config or acs.DEFAULT_CONFIG
+    table_dir = os.path.join(data_dir, "compute_data")
+    if not has_road_tables(table_dir):
+        return acs.NetworkBuilder(zones).build()
+    period = config.get("periods", [{}])[0].get("key", "AM_PEAK")
+    return RoadNetworkBuilder(zones, table_dir, period=period).build()
@@ -0,0 +1,238 @@
+import os
+import json
+import math
+import shutil
+import threading
+import collections
+import numpy as np
+
+# タイル内の量子化解像度 (Mapbox Vector Tile と同じ 4096 単位)
+TILE_EXTENT = 4096
+# 画面上1ピクセル相当 (256px タイル) をDouglas–Peuckerの許容誤差とする
+TILE_PIXELS = 256
+MIN_ZOOM = 8
+MAX_ZOOM = 18
+
+
+def tile_bounds(z, x, y):
+    """Returns (west, south, east, north) in degrees of a slippy-map (XYZ) tile."""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+
+def simplify_line(points, tolerance):
+    """
+    Douglas–Peucker simplification of an (N, 2) array.
+    Iterative (stack) version; perpendicular distances are computed with NumPy per segment.
+    """
+    n = len(points)
+    if n <= 2 or tolerance <= 0:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = points[a + 1:b]
+        p0, p1 = points[a], points[b]
+        d = p1 - p0
+        norm = math.hypot(d[0], d[1])
+        if norm == 0:
+            dist = np.hypot(seg[:, 0] - p0[0], seg[:, 1] - p0[1])
+        else:
+            dist = np.abs(d[0] * (seg[:, 1] - p0[1]) - d[1] * (seg[:, 0] - p0[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            m = a + 1 + i
+            keep[m] = True
+            stack.append((a, m))
+            stack.append((m, b))
+    return points[keep]
+
+
+class RoadTileCache:
+    """
+    道路GeoJSONのXYZタイル配信 (/api/roads/tiles/{z}/{x}/{y})。
+    - RoadIndex で候補フィーチャを抽出し、ズームごとに Douglas–Peucker で簡略化
+    - 座標はタイル内 4096 単位のグリッドに量子化 (小数桁も zoom に応じて削減)
+    - 1ピクセル未満のフィーチャは低ズームで除外
+    - 生成したタイルはメモリ (LRU) とディスク (LRU, ファイル数上限) にキャッシュ
+    """
+
+    def __init__(self, road_index, cache_dir, max_memory_tiles=256, max_disk_tiles=20000):
+        self.index = road_index
+        self.cache_dir = cache_dir
+        self.max_memory_tiles = max_memory_tiles
+        self.max_disk_tiles = max_disk_tiles
+        self._memory = collections.OrderedDict()  # (z, x, y) -> bytes
+        self._disk = collections.OrderedDict()  # (z, x, y) -> path (アクセス順)
+        self._lock = threading.Lock()
+        self._prepare_cache_dir()
+
+    # --- Disk cache bookkeeping ---
+
+    def _stamp_text(self):
+        stamp = getattr(self.index, 'source_stamp', None)
+        return '' if stamp is None else '-'.join(str(int(v)) for v in stamp)
+
+    def _prepare_cache_dir(self):
+        """Clears the disk cache if it was built from another version of the GeoJSON."""
+        meta_path = os.path.join(self.cache_dir, 'meta.json')
+        stamp = self._stamp_text()
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                valid = json.load(f).get('source') == stamp
+        except (OSError, ValueError):
+            valid = False
+
+        if not valid:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'source': stamp}, f)
+            return
+
+        # 既存タイルを古い順に登録
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json') or name == 'meta.json':
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    rel = os.path.relpath(path, self.cache_dir).replace('\\', '/')
+                    z, x, y = rel[:-len('.json')].split('/')
+                    found.append((os.path.getmtime(path), (int(z), int(x), int(y)), path))
+                except (ValueError, OSError):
+                    continue
+        for _, key, path in sorted(found):
+            self._disk[key] = path
+
+    def _tile_path(self, z, x, y):
+        return os.path.join(self.cache_dir, str(z), str(x), f"{y}.json")
+
+    def _remember(self, key, payload, path):
+        self._memory[key] = payload
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_tiles:
+            self._memory.popitem(last=False)
+
+        self._disk[key] = path
+        self._disk.move_to_end(key)
+        while len(self._disk) > self.max_disk_tiles:
+            _, old_path = self._disk.popitem(last=False)
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    # --- Tile generation ---
+
+    def get_tile(self, z, x, y):
+        """Returns the tile as UTF-8 JSON bytes (memory -> disk -> build)."""
+        key = (z, x, y)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._disk.move_to_end(key)
+                return self._memory[key]
+
+            path = self._tile_path(z, x, y)
+            if key in self._disk and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    payload = f.read()
+                self._remember(key, payload, path)
+                return payload
+
+        payload = json.dumps(self.build_tile(z, x, y), separators=(',', ':')).encode('utf-8')
+
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = path + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"Warning: Could not write road tile {key}: {e}")
+            self._remember(key, payload, path)
+        return payload
+
+    def build_tile(self, z, x, y):
+        """Builds a simplified, quantized GeoJSON FeatureCollection for one tile."""
+        west, south, east, north = tile_bounds(z, x, y)
+        empty = {'type': 'FeatureCollection', 'features': []}
+        if z < MIN_ZOOM or self.index is None:
+            return empty
+
+        # 量子化グリッド / 簡略化許容誤差 (度単位)
+        qx = (east - west) / TILE_EXTENT
+        qy = (north - south) / TILE_EXTENT
+        tol = min(east - west, north - south) / TILE_PIXELS
+        # 量子化後に意味のある小数桁のみ出力する
+        digits = max(0, int(math.ceil(-math.log10(min(qx, qy)))))
+
+        ids = self.index.query(west, south, east, north)
+        if len(ids) == 0:
+            return empty
+
+        # 1ピクセル未満のフィーチャを除外 (最大ズームでは全件)
+        bb = self.index.bboxes[ids]
+        if z < MAX_ZOOM:
+            size = np.maximum(bb[:, 2] - bb[:, 0], bb[:, 3] - bb[:, 1])
+            ids = ids[size >= tol]
+
+        def quantize(part):
+            # 空のパートでも (0, 2) にして列アクセスで落ちないようにする
+            pts = np.asarray([p[:2] for p in part], dtype=np.float64).reshape(-1, 2)
+            pts = simplify_line(pts, tol)
+            pts[:, 0] = np.round((pts[:, 0] - west) / qx) * qx + west
+            pts[:, 1] = np.round((pts[:, 1] - south) / qy) * qy + south
+            pts = np.round(pts, digits)
+            # 量子化で重複した連続点を除去
+            if len(pts) > 1:
+                dup = np.all(pts[1:] == pts[:-1], axis=1)
+                pts = pts[np.concatenate(([True], ~dup))]
+            return pts.tolist()
+
+        features = []
+        for i in ids:
+            feat = self.index.features[i]
+            geom = feat.get('geometry') or {}
+            g_type = geom.get('type')
+            coords = geom.get('coordinates') or []
+            if g_type == 'LineString':
+                new_coords = quantize(coords)
+                if len(new_coords) < 2:
+                    continue
+            elif g_type == 'MultiLineString':
+                new_coords = [c for c in (quantize(part) for part in coords) if len(c) >= 2]
+                if not new_coords:
+                    continue
+            elif g_type == 'Polygon':
+                new_coords = [c for c in (quantize(ring) for ring in coords) if len(c) >= 4]
+                if not new_coords:
+                    continue
+            elif g_type == 'MultiPolygon':
+                new_coords = []
+                for poly in coords:
+                    rings = [c for c in (quantize(ring) for ring in poly) if len(c) >= 4]
+                    if rings:
+                        new_coords.append(rings)
+                if not new_coords:
+                    continue
+            else:
+                continue
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': g_type, 'coordinates': new_coords},
+                'properties': feat.get('properties') or {}
+            })
+
+        return {'type': 'FeatureCollection', 'features': features}
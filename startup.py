@@ -0,0 +1,140 @@
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Component:
+    """A named startup stage with dependencies and recorded state/timing."""
+
+    def __init__(self, name, fn, deps=(), eager=True):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.eager = eager
+        self.state = "pending"  # pending -> loading -> ready | failed
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.done = threading.Event()
+
+    @property
+    def load_seconds(self):
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.time()
+        return round(end - self.started_at, 4)
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "eager": self.eager,
+            "deps": list(self.deps),
+            "load_seconds": self.load_seconds,
+            "error": self.error
+        }
+
+
+class StartupOrchestrator:
+    """
+    起動処理の依存グラフ。
+    - 各コンポーネントは依存先の完了を待ってからスレッドプールで並列実行
+    - eager=False のコンポーネントは初回 ensure() 時に読み込む (lazy)
+    - 同じコンポーネントが二重に実行されることはない (single-flight)
+    - 状態と読み込み時間を status() で公開 (/api/health/ready)
+
+    NumPy/pandas の読み込みは GIL を解放する区間が長く、結果 (グラフ、配列) は
+    このプロセス内で使うため、プロセスプールではなくスレッドプールを使う。
+    """
+
+    def __init__(self, max_workers=4):
+        self.created_at = time.time()
+        self.components = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="startup")
+        self.started = False
+
+    def register(self, name, fn, deps=(), eager=True):
+        self.components[name] = Component(name, fn, deps, eager)
+        return self.components[name]
+
+    def _claim(self, comp):
+        """Marks the component as loading. Returns False if someone else already did."""
+        with self._lock:
+            if comp.state != "pending":
+                return False
+            comp.state = "loading"
+            comp.started_at = time.time()
+            return True
+
+    def _run(self, comp):
+        for dep in comp.deps:
+            self.ensure(dep)
+        # 依存先の待ち時間は含めない
+        comp.started_at = time.time()
+        print(f"[startup] {comp.name}: loading...")
+        state = "failed"
+        try:
+            comp.result = comp.fn()
+            state = "ready"
+        except Exception as e:
+            comp.error = str(e)
+            print(f"[startup] {comp.name}: failed: {e}")
+            traceback.print_exc()
+        finally:
+            comp.finished_at = time.time()
+            comp.state = state
+            comp.done.set()
+        if comp.state == "ready":
+            print(f"[startup] {comp.name}: ready in {comp.load_seconds:.2f}s")
+        return comp.result
+
+    def start(self):
+        """Starts all eager components in parallel (non-blocking)."""
+        self.started = True
+        for comp in self.components.values():
+            if comp.eager and self._claim(comp):
+                self._executor.submit(self._run, comp)
+
+    def ensure(self, name, timeout=None, retry_failed=False):
+        """
+        Returns once the component is ready or failed, loading it in the calling
+        thread if nobody has started it yet. Returns True if it is ready.
+        """
+        comp = self.components[name]
+        if retry_failed and comp.state == "failed":
+            self.reset(name)
+        if comp.state not in ("ready", "failed"):
+            if self._claim(comp):
+                self._run(comp)
+            else:
+                comp.done.wait(timeout)
+        return comp.state == "ready"
+
+    def reset(self, name):
+        """Marks a component as pending so the next ensure() reloads it."""
+        comp = self.components[name]
+        with self._lock:
+            if comp.state in ("ready", "failed"):
+                comp.state = "pending"
+                comp.error = None
+                comp.started_at = comp.finished_at = None
+                comp.done.clear()
+
+    def is_ready(self, eager_only=True):
+        return all(c.state == "ready" for c in self.components.values() if c.eager or not eager_only)
+
+    def status(self):
+        comps = {name: c.to_dict() for name, c in self.components.items()}
+        eager = [c for c in self.components.values() if c.eager]
+        cold_start = None
+        if eager and all(c.state in ("ready", "failed") for c in eager):
+            cold_start = round(max(c.finished_at for c in eager) - self.created_at, 4)
+        return {
+            "ready": self.is_ready(),
+            "started": self.started,
+            "uptime_seconds": round(time.time() - self.created_at, 2),
+            "cold_start_seconds": cold_start,
+            "components": comps
+        }
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+KEY_COL = "KEY_CODE"
+
+
+def _read_csv_any(path, **kwargs):
+    """pd.read_csv with the UTF-8 -> CP932 fallback used for e-Stat downloads."""
+    try:
+        return pd.read_csv(path, encoding="utf-8", **kwargs)
+    except UnicodeDecodeError:
+        return pd.read_csv(path, encoding="cp932", **kwargs)
+
+
+class StatTable:
+    """
+    列指向キャッシュ上の統計表1つ分。
+    - keys: KEY_CODE (int64, 行順)
+    - column(name): 数値列 (float64, 秘匿値 '*' などは NaN)。np.load(mmap_mode='r') で必要な列だけ読む
+    - labels: _mapping.csv の code -> label
+    """
+
+    def __init__(self, table_dir, meta):
+        self.table_dir = table_dir
+        self.name = meta["table"]
+        self.columns = meta["columns"]
+        self.labels = meta.get("labels", {})
+        self.rows = meta["rows"]
+        self._keys = None
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            self._keys = np.load(os.path.join(self.table_dir, f"{KEY_COL}.npy"), mmap_mode="r")
+        return self._keys
+
+    def key_strings(self):
+        return self.keys.astype(str)
+
+    def column(self, name):
+        if name not in self.columns:
+            raise KeyError(f"{self.name}: no column {name}")
+        return np.load(os.path.join(self.table_dir, f"{name}.npy"), mmap_mode="r")
+
+    def get(self, columns):
+        """Returns {column: array} for the columns that exist in this table."""
+        return {c: self.column(c) for c in columns if c in self.columns}
+
+    def frame(self, columns, key_as_str=True):
+        """DataFrame with KEY_CODE plus the requested (existing) columns."""
+        data = {KEY_COL: self.key_strings() if key_as_str else np.asarray(self.keys)}
+        for c, arr in self.get(columns).items():
+            data[c] = np.asarray(arr)
+        return pd.DataFrame(data)
+
+
+class StatStore:
+    """
+    e-Statメッシュ統計CSVの列指向キャッシュ。
+    CSVごとに一度だけ pandas で読み込み、列ごとの .npy (KEY_CODE は int64) と
+    meta.json (元ファイルの mtime/size, 列名, ラベル) に変換する。
+    元ファイルが変わった場合のみ再変換する。convert_data.py が作る clean CSV /
+    _mapping.csv をそのまま入力にできる。
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_csv(cls, csv_path):
+        """Shared store whose cache lives in '.columnar' next to the CSV."""
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(csv_path)), ".columnar")
+        with cls._shared_lock:
+            store = cls._shared.get(cache_dir)
+            if store is None:
+                store = cls._shared[cache_dir] = cls(cache_dir)
+        return store
+
+    @staticmethod
+    def _stamp(path):
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+
+    def _table_dir(self, csv_path):
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        return name, os.path.join(self.cache_dir, name)
+
+    def table(self, csv_path):
+        """Returns the StatTable for a CSV, converting it first if the cache is missing or stale."""
+        csv_path = os.path.abspath(csv_path)
+        stamp = self._stamp(csv_path)
+        cached = self._tables.get(csv_path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        with self._lock:
+            cached = self._tables.get(csv_path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            name, table_dir = self._table_dir(csv_path)
+            meta = self._read_meta(table_dir)
+            if meta is None or meta.get("source") != stamp or meta.get("version") != STORE_VERSION:
+                meta = self.convert(csv_path, stamp)
+            table = StatTable(table_dir, meta)
+            self._tables[csv_path] = (stamp, table)
+            return table
+
+    @staticmethod
+    def _read_meta(table_dir):
+        try:
+            with open(os.path.join(table_dir, "meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def convert(self, csv_path, stamp=None):
+        """Converts one CSV into the columnar layout. Returns its meta dict."""
+        name, table_dir = self._table_dir(csv_path)
+        print(f"Converting {os.path.basename(csv_path)} to columnar cache...")
+        df = _read_csv_any(csv_path, dtype=str)
+        if KEY_COL not in df.columns:
+            raise ValueError(f"{csv_path}: missing {KEY_COL} column")
+
+        keys = pd.to_numeric(df[KEY_COL], errors="coerce")
+        valid = keys.notna().to_numpy()
+        df = df[valid]
+        keys = keys[valid].astype(np.int64).to_numpy()
+
+        tmp_dir = table_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, f"{KEY_COL}.npy"), keys)
+        columns = []
+        for col in df.columns:
+            if col == KEY_COL:
+                continue
+            values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64)
+            np.save(os.path.join(tmp_dir, f"{col}.npy"), values)
+            columns.append(col)
+
+        meta = {
+            "version": STORE_VERSION,
+            "table": name,
+            "source": stamp if stamp is not None else self._stamp(csv_path),
+            "rows": int(len(keys)),
+            "columns": columns,
+            "labels": self._load_labels(csv_path),
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        shutil.rmtree(table_dir, ignore_errors=True)
+        os.replace(tmp_dir, table_dir)
+        return meta
+
+    @staticmethod
+    def _load_labels(csv_path):
+        mapping_path = os.path.splitext(csv_path)[0] + "_mapping.csv"
+        if not os.path.exists(mapping_path):
+            return {}
+        try:
+            df_map = pd.read_csv(mapping_path, encoding="utf-8-sig", dtype=str)
+            return {c: ("" if pd.isna(l) else l) for c, l in zip(df_map["code"], df_map["label"])}
+        except Exception as e:
+            print(f"Warning: Could not read labels {mapping_path}: {e}")
+            return {}
+
+
+def read_stat_columns(csv_path, columns, key_as_str=True):
+    """
+    Shortcut for consumers: DataFrame of KEY_CODE + requested numeric columns from the
+    columnar cache of `csv_path` (missing columns are omitted, suppressed values are NaN).
+    """
+    return StatStore.for_csv(csv_path).table(csv_path).frame(columns, key_as_str=key_as_str)
+
+
+if __name__ == "__main__":
+    # Usage: python stat_store.py [csv ...]  (default: every CSV in data/statistical)
+    paths = sys.argv[1:]
+    if not paths:
+        stat_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "statistical")
+        paths = [os.path.join(stat_dir, f) for f in sorted(os.listdir(stat_dir))
+                 if f.endswith(".csv") and not f.endswith("_mapping.csv") and "_mapping_" not in f]
+    for p in paths:
+        t = StatStore.for_csv(p).table(p)
+        print(f"  {t.name}: {t.rows} rows, {len(t.columns)} columns")
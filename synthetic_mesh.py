@@ -0,0 +1,147 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+# 4次メッシュ (1/2地域メッシュ) の全国通し座標: 1次メッシュ1つ = 8 * 10 * 2 = 160 セル
+CELLS_PER_1ST = 160
+
+# 合成テーブルで使う e-Stat 列
+POP_TOTAL_COL = "T001101001"
+POP_ELDERLY_COL = "T001101022"
+EMP_TOTAL_COL = "T001108001"
+
+
+def global_to_code(gy, gx):
+    """Global half-mesh indices (south->north, west->east) -> 9-digit mesh codes (vectorized)."""
+    gy = np.asarray(gy, dtype=np.int64)
+    gx = np.asarray(gx, dtype=np.int64)
+    y1, ry = np.divmod(gy, CELLS_PER_1ST)
+    x1, rx = np.divmod(gx, CELLS_PER_1ST)
+    y2, ry = np.divmod(ry, 20)
+    x2, rx = np.divmod(rx, 20)
+    y3, sy = np.divmod(ry, 2)
+    x3, sx = np.divmod(rx, 2)
+    sub = 1 + sx + 2 * sy  # 1=SW, 2=SE, 3=NW, 4=NE
+    codes = (((((y1 * 100 + x1) * 10 + y2) * 10 + x2) * 10 + y3) * 10 + x3) * 10 + sub
+    return codes.astype(np.int64)
+
+
+def code_to_lonlat(codes):
+    """South-west corner (lon, lat) of 9-digit mesh codes (vectorized)."""
+    c = np.asarray(codes, dtype=np.int64)
+    digits = [(c // 10 ** k) % 10 for k in range(8, -1, -1)]
+    y1 = digits[0] * 10 + digits[1]
+    x1 = digits[2] * 10 + digits[3]
+    y2, x2, y3, x3, sub = digits[4], digits[5], digits[6], digits[7], digits[8]
+    sy = (sub - 1) // 2
+    sx = (sub - 1) % 2
+    lat = y1 / 1.5 + y2 * (5.0 / 60) + y3 * (30.0 / 3600) + sy * (15.0 / 3600)
+    lon = x1 + 100 + x2 * (7.5 / 60) + x3 * (45.0 / 3600) + sx * (22.5 / 3600)
+    return lon, lat
+
+
+class SyntheticRegion:
+    """
+    合成メッシュ地域 (ベンチマーク・回帰テスト用)。
+    - 指定ゾーン数の 9桁 4次メッシュを、ほぼ正方形のブロックとして生成
+    - fill < 1.0 で海岸線のような欠け (空セル) を作る
+    - 人口・従業者・高齢者・施設数を乱数 (seed 固定) で付与
+    """
+
+    def __init__(self, n_zones, seed=0, fill=1.0, origin=(51 * CELLS_PER_1ST + 60, 32 * CELLS_PER_1ST + 60)):
+        rng = np.random.default_rng(seed)
+        self.n_zones = n_zones
+        self.seed = seed
+
+        side = int(np.ceil(np.sqrt(n_zones / max(fill, 1e-3))))
+        gy, gx = np.divmod(np.arange(side * side, dtype=np.int64), side)
+        if fill < 1.0:
+            # 中心からの距離にノイズを足して欠けを作る (連結した塊になりやすい)
+            cy, cx = (side - 1) / 2.0, (side - 1) / 2.0
+            score = np.hypot(gy - cy, gx - cx) + rng.normal(0, side * 0.08, len(gy))
+            keep = np.argsort(score, kind="stable")[:n_zones]
+        else:
+            keep = np.arange(n_zones)
+        keep = np.sort(keep)
+        self.gy = gy[keep] + origin[0]
+        self.gx = gx[keep] + origin[1]
+        self.codes = global_to_code(self.gy, self.gx)
+
+        # 都心 (ブロック中心) ほど人口・従業者が多い分布
+        cy, cx = self.gy.mean(), self.gx.mean()
+        dist = np.hypot(self.gy - cy, self.gx - cx) / max(side, 1)
+        self.population = np.round(rng.lognormal(5.0, 1.0, n_zones) * np.exp(-2.0 * dist)).astype(np.int64)
+        self.employment = np.round(rng.lognormal(4.0, 1.4, n_zones) * np.exp(-4.0 * dist)).astype(np.int64)
+        self.elderly = np.round(self.population * rng.uniform(0.05, 0.35, n_zones)).astype(np.int64)
+        self.benrido = np.clip(np.exp(-3.0 * dist) + rng.normal(0, 0.05, n_zones), 0, 1).round(3)
+        # 秘匿値 '*' を一部に入れる (実データと同様)
+        self.suppressed = rng.random(n_zones) < 0.02
+
+    @property
+    def code_strings(self):
+        return self.codes.astype(str).tolist()
+
+    def pop_frame(self):
+        df = pd.DataFrame({
+            "KEY_CODE": self.codes,
+            POP_TOTAL_COL: self.population.astype(object),
+            POP_ELDERLY_COL: self.elderly.astype(object),
+        })
+        df.loc[self.suppressed, [POP_TOTAL_COL, POP_ELDERLY_COL]] = "*"
+        return df
+
+    def emp_frame(self):
+        return pd.DataFrame({"KEY_CODE": self.codes, EMP_TOTAL_COL: self.employment})
+
+    def facility_frame(self, benrido_codes, seed=None):
+        """Facility counts per zone for the given tblT001164 codes (more facilities downtown)."""
+        rng = np.random.default_rng(self.seed + 1 if seed is None else seed)
+        lam = 0.05 + 0.6 * self.benrido
+        data = {"KEY_CODE": self.codes}
+        for code in benrido_codes:
+            data[code] = rng.poisson(lam)
+        return pd.DataFrame(data)
+
+    def geojson(self):
+        """FeatureCollection of the zones as polygons with KEY_CODE / benrido properties."""
+        lon, lat = code_to_lonlat(self.codes)
+        dlon, dlat = 22.5 / 3600, 15.0 / 3600
+        features = []
+        for code, x, y, ben in zip(self.code_strings, lon, lat, self.benrido):
+            x, y = round(float(x), 7), round(float(y), 7)
+            ring = [[x, y], [x + dlon, y], [x + dlon, y + dlat], [x, y + dlat], [x, y]]
+            features.append({
+                "type": "Feature",
+                "properties": {"KEY_CODE": code, "benrido": float(ben)},
+                "geometry": {"type": "Polygon", "coordinates": [ring]}
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+    def write_data_dir(self, data_dir, repo_data_dir=None):
+        """
+        Writes a data directory laid out like ./data (statistical CSVs, hinagata.csv,
+        facility table) so SimulationData / CityGrid loaders can run on it unchanged.
+        """
+        stat_dir = os.path.join(data_dir, "statistical")
+        os.makedirs(stat_dir, exist_ok=True)
+        self.pop_frame().to_csv(os.path.join(stat_dir, "tblT001101H34.csv"), index=False)
+        self.emp_frame().to_csv(os.path.join(stat_dir, "tblT001108H34.csv"), index=False)
+
+        repo_data_dir = repo_data_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+        for rel in ("hinagata.csv", os.path.join("statistical", "tblT001164H34_mapping_with_benrido.csv")):
+            src = os.path.join(repo_data_dir, rel)
+            if os.path.exists(src):
+                shutil.copy(src, os.path.join(data_dir, rel))
+
+        mapping = os.path.join(stat_dir, "tblT001164H34_mapping_with_benrido.csv")
+        if os.path.exists(mapping):
+            df_map = pd.read_csv(mapping)
+            codes = [c for c, b in zip(df_map["code"].astype(str), pd.to_numeric(df_map["benrido"], errors="coerce"))
+                     if c.startswith("T") and b > 0]
+            self.facility_frame(codes).to_csv(os.path.join(stat_dir, "tblT001164H34.csv"), index=False)
+
+        with open(os.path.join(data_dir, "synthetic.geojson"), "w", encoding="utf-8") as f:
+            json.dump(self.geojson(), f)
+        return data_dir
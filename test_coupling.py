@@ -0,0 +1,96 @@
+"""
+ZoneSkim (窓内のラベル修正スキャン) を networkx の Dijkstra と比較するテスト。
+
+合成メッシュ地域 (空セルあり) の NetworkBuilder ネットワークに乱数の混雑コストを与え、
+窓が地域全体を覆う場合は最短時間が一致し、狭い窓では Dijkstra 以上になることを確認する。
+
+Usage:
+  python -m pytest -q test_coupling.py
+"""
+import networkx as nx
+import numpy as np
+import pytest
+
+import advanced_city_simulator as acs
+from synthetic_mesh import SyntheticRegion
+from traffic_coupling import ZoneSkim
+
+RTOL = 1e-5
+
+
+def make_skim(radius, n_zones=90, seed=4, drop=0.0):
+    region = SyntheticRegion(n_zones, seed=seed, fill=0.8)
+    zones = region.code_strings
+    G = acs.NetworkBuilder(zones).build()
+    rng = np.random.default_rng(seed)
+    if drop:
+        # 道路のない境界 (RoadNetworkBuilder) のように一部の通過リンクを外す
+        passing = [(u, v) for u, v, d in G.edges(data=True) if d["type"] == "passing"]
+        G.remove_edges_from([passing[i] for i in rng.choice(len(passing), int(len(passing) * drop), replace=False)])
+    for _, _, d in G.edges(data=True):
+        d["flow"] = float(rng.uniform(0, 2.0 * d["capacity"]))
+    skim = ZoneSkim(G, zones, radius=radius)
+    return skim, skim.costs()
+
+
+def dijkstra_times(skim, costs, origin):
+    H = nx.DiGraph()
+    H.add_weighted_edges_from((u, v, c) for (u, v), c in zip(skim.edges, costs.tolist()))
+    return nx.single_source_dijkstra_path_length(H, f"{skim.zones[origin]}_C")
+
+
+def window_pairs(times, cell, k):
+    """(zone, skim time) for every zone inside the window of the k-th origin."""
+    dy, dx = np.nonzero(cell[:, :, k] >= 0)
+    for y, x in zip(dy, dx):
+        yield int(cell[y, x, k]), float(times[y, x, k])
+
+
+@pytest.mark.parametrize("drop", [0.0, 0.3])
+def test_full_window_matches_dijkstra(drop):
+    skim, costs = make_skim(radius=12, drop=drop)
+    origins = np.arange(len(skim.zones))
+    times, cell = skim.times(costs, origins)
+    assert (cell >= 0).sum() == len(skim.zones) ** 2
+
+    worst = 0.0
+    for o in origins:
+        expected = dijkstra_times(skim, costs, o)
+        for z, t in window_pairs(times, cell, o):
+            ref = expected.get(f"{skim.zones[z]}_C", np.inf)
+            if np.isinf(ref):
+                assert np.isinf(t)
+            else:
+                worst = max(worst, abs(t - ref) / max(ref, 1e-9))
+    assert worst < RTOL
+
+
+def test_small_window_is_an_upper_bound():
+    skim, costs = make_skim(radius=2)
+    origins = np.arange(len(skim.zones))
+    times, cell = skim.times(costs, origins)
+    exact = reachable = 0
+    for o in origins:
+        expected = dijkstra_times(skim, costs, o)
+        for z, t in window_pairs(times, cell, o):
+            ref = expected.get(f"{skim.zones[z]}_C", np.inf)
+            if np.isinf(ref):
+                assert np.isinf(t)
+                continue
+            assert t >= ref * (1 - RTOL)
+            reachable += 1
+            exact += abs(t - ref) <= ref * RTOL
+    # 近くのゾーンはほとんど窓内の経路が最短
+    assert exact > 0.9 * reachable
+
+
+def test_logsum_matches_dijkstra():
+    skim, costs = make_skim(radius=12)
+    weights = np.random.default_rng(0).uniform(0, 50, len(skim.zones))
+    theta = 0.2
+    result = skim.logsum(costs, weights, theta=theta)
+    index = {f"{z}_C": i for i, z in enumerate(skim.zones)}
+    for o in range(len(skim.zones)):
+        times = dijkstra_times(skim, costs, o)
+        total = sum(weights[index[n]] * np.exp(-theta * t) for n, t in times.items() if n in index)
+        assert result[o] == pytest.approx(np.log1p(total), rel=1e-5)
@@ -0,0 +1,104 @@
+"""
+施設スタンプ (add_facilities / facility_gain / rank_facility_sites) のテスト。
+
+- facility_gain が、各セルに add_facility_effect を1つずつ置いて重み付き acc 増分を
+  数える総当たりと一致すること (dense / compact)
+- add_facilities の一括スタンプが add_facility_effect の繰り返しと一致し、fork 元を変えないこと
+- rank_facility_sites の順位・コード・候補の絞り込み
+
+Usage:
+  python -m pytest -q test_facilities.py
+"""
+import numpy as np
+import pytest
+
+from city_grid import CityGrid
+from mesh_utils import MeshGridMapper
+from synthetic_mesh import SyntheticRegion
+
+
+def make_grid(compact=False, n_zones=70, seed=3):
+    region = SyntheticRegion(n_zones, seed=seed, fill=0.8)
+    mapper = MeshGridMapper()
+    mapper.fit(region.code_strings)
+    grid = CityGrid(width=mapper.cols, height=mapper.rows, compact=compact)
+    grid.set_mapper(mapper)
+    pop = region.population.astype(np.float64)
+    grid.load_layers(region.codes, {
+        "population": pop,
+        "elderly_share": region.elderly / np.maximum(pop, 1.0),
+        "acc": region.benrido,
+        "base_land_price": 10.0 + pop / 10.0,
+    })
+    return grid
+
+
+def sites(grid):
+    """(x, y, layer position) of every cell a facility can be placed on."""
+    if grid.compact:
+        index = grid.cell_index()
+        return zip(index["cols"].tolist(), index["rows"].tolist(), index["layer"].tolist())
+    ys, xs = np.divmod(np.arange(grid.width * grid.height), grid.width)
+    return zip(xs.tolist(), ys.tolist(), range(len(xs)))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("radius, weight", [(0, 1.0), (2, 0.5), (6, 2.0)])
+def test_gain_matches_brute_force(compact, radius, weight):
+    grid = make_grid(compact)
+    # acc = 0 so the stamped acc is the kernel itself (rounded to float32)
+    grid.acc = np.zeros(grid.layer_shape, dtype=np.float32)
+    weights = np.random.default_rng(radius).uniform(0, 10, grid.layer_shape)
+
+    for w in (None, weights):
+        gain = grid.facility_gain(radius, weight, weights=w)
+        assert gain.shape == grid.layer_shape
+        layer_w = (grid.population if w is None else w).astype(np.float64).reshape(-1)
+        gain = gain.reshape(-1)
+        for x, y, at in sites(grid):
+            city = grid.fork()
+            city.add_facility_effect(x, y, radius, weight)
+            expected = float(np.dot(layer_w, city.acc.reshape(-1).astype(np.float64)))
+            assert gain[at] == pytest.approx(expected, rel=1e-6, abs=1e-9)
+        assert not grid.acc.any()
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_add_facilities_matches_single_stamps(compact):
+    grid = make_grid(compact)
+    before = grid.acc.copy()
+    rng = np.random.default_rng(0)
+    # 端をはみ出すもの・同じセルに重なるものを含める
+    xs = np.concatenate((rng.integers(0, grid.width, 40), [0, grid.width - 1, 3, 3]))
+    ys = np.concatenate((rng.integers(0, grid.height, 40), [0, grid.height - 1, 2, 2]))
+
+    expected = grid.fork()
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        expected.add_facility_effect(x, y, 4, 0.8)
+    city = grid.fork()
+    city.add_facilities(xs, ys, 4, 0.8)
+
+    assert city.acc.dtype == np.float32
+    np.testing.assert_allclose(city.acc, expected.acc, rtol=1e-6, atol=1e-6)
+    assert np.array_equal(grid.acc, before)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_rank_sites_follows_gain(compact):
+    grid = make_grid(compact)
+    gain = grid.facility_gain(3, 1.0).reshape(-1)
+    index = grid.cell_index()
+    layer = index["layer"]
+
+    top = grid.rank_facility_sites(3, 1.0, top_k=8)
+    order = layer[np.lexsort((layer, -gain[layer]))][:8]
+    assert [t["gain"] for t in top] == gain[order].tolist()
+    for t in top:
+        assert t["code"] == grid.mapper.get_mesh_code(t["x"], t["y"])
+    assert [t["gain"] for t in top] == sorted((t["gain"] for t in top), reverse=True)
+
+    subset = layer[::5]
+    top = grid.rank_facility_sites(3, 1.0, top_k=len(subset) + 10, candidates=subset)
+    assert len(top) == len(subset)
+    assert top[0]["gain"] == gain[subset].max()
+    assert grid.rank_facility_sites(3, 1.0, top_k=0) == []
@@ -0,0 +1,82 @@
+"""
+geojson_index (iter_features のストリーミング読み取りと GeoJSONFeatureIndex) のテスト。
+
+マルチバイト文字のプロパティ・重複 KEY_CODE・数値でない KEY_CODE を含む小さな GeoJSON を
+索引化し、バイト位置から読んだ部分集合が json.load + 絞り込みの結果と一致することを確認する。
+
+Usage:
+  python -m pytest -q test_geojson_index.py
+"""
+import json
+
+import numpy as np
+import pytest
+
+from geojson_index import GeoJSONFeatureIndex, iter_features
+
+
+def make_features():
+    features = []
+    for i in range(60):
+        code = 513243250 + i % 50  # 10 codes appear twice
+        features.append({
+            "type": "Feature",
+            "properties": {"KEY_CODE": code if i % 3 else str(code), "name": "広島市" * (i % 4),
+                           "note": "é€😀" if i % 7 == 0 else ""},
+            "geometry": {"type": "Polygon", "coordinates": [[[132.0 + i * 0.01, 34.0], [132.01 + i * 0.01, 34.0],
+                                                             [132.01 + i * 0.01, 34.01], [132.0 + i * 0.01, 34.0]]]},
+        })
+    features.insert(5, {"type": "Feature", "properties": {"KEY_CODE": "n/a", "name": "秘匿"}, "geometry": None})
+    return features
+
+
+@pytest.fixture
+def geojson_path(tmp_path):
+    path = tmp_path / "grid.geojson"
+    body = ",\r\n  ".join(json.dumps(f, ensure_ascii=False) for f in make_features())
+    path.write_text('{"type": "FeatureCollection", "name": "テスト",\r\n "features" : [\r\n  '
+                    + body + "\r\n]}\n", encoding="utf-8")
+    return str(path)
+
+
+def filtered(path, codes):
+    """The plain way: json.load and keep features whose KEY_CODE is in codes (file order)."""
+    wanted = set(str(c) for c in codes)
+    with open(path, "r", encoding="utf-8") as f:
+        return [f for f in json.load(f)["features"] if str(f["properties"].get("KEY_CODE")) in wanted]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_iter_features_byte_ranges(geojson_path, chunk_size):
+    with open(geojson_path, "rb") as f:
+        raw = f.read()
+    with open(geojson_path, "r", encoding="utf-8") as f:
+        expected = json.load(f)["features"]
+    found = list(iter_features(geojson_path, chunk_size=chunk_size))
+    assert [feat for feat, _, _ in found] == expected
+    for feat, offset, length in found:
+        assert json.loads(raw[offset:offset + length].decode("utf-8")) == feat
+
+
+def test_read_features_matches_filter(geojson_path):
+    index = GeoJSONFeatureIndex.for_path(geojson_path)
+    assert len(index.codes) == 60  # "n/a" is not indexed
+    for codes in ([513243251, "513243260", 513243299], ["513243255"], list(range(513243240, 513243300, 3)), []):
+        assert index.read_features(codes) == filtered(geojson_path, codes)
+
+    # repeated KEY_CODEs return every feature
+    assert len(index.lookup(["513243251"])) == 2
+    assert len(index.lookup(["513243251", 513243251, "513243265"])) == 3
+    assert len(index.lookup(["abc", None])) == 0
+
+
+def test_index_file_is_reused(geojson_path):
+    first = GeoJSONFeatureIndex.for_path(geojson_path)
+    GeoJSONFeatureIndex._shared.clear()
+    second = GeoJSONFeatureIndex.for_path(geojson_path)
+    assert second is not first
+    for name in ("codes", "offsets", "lengths", "bboxes"):
+        assert np.array_equal(getattr(first, name), getattr(second, name), equal_nan=True)
+    assert second.read_features([513243252]) == filtered(geojson_path, [513243252])
+    assert second.bbox_of([513243250]) == pytest.approx((132.0, 34.0, 132.51, 34.01))
+    assert second.bbox_of(["513243999"]) is None
@@ -0,0 +1,337 @@
+"""
+ゴールデン出力による回帰テスト + ステージ別の性能予算。
+
+固定の小さな合成メッシュ地域 (synthetic_mesh.SyntheticRegion) で
+  - リンクフロー (TrafficSimulator)
+  - 雛形形式の集計値 (juusinkukaku_kansen_* / kyoukaikukaku_kansen_*)
+  - CityGrid の軌跡 (benrido acc + 各年の人口・地価)
+を計算し、data/golden/pipeline_small.json と許容誤差つきで比較する。
+同じハーネスで各ステージの時間 (best of N) とピークメモリ (tracemalloc) が
+予算 (ゴールデン記録値 * (1 + slack)) を超えていないかも確認する。
+数 ms のステージも揺らぎに埋もれないよう、時間は MIN_STAGE_SECONDS を超えるまで
+繰り返した1回あたりの値で比べる (絶対値の下限で予算の割合を緩めない)。
+同じ実行の中で固定の較正処理 (calibrate) も計り、記録時との速度比で予算を補正する
+(マシンの混み具合や CPU の違いで一律に遅い / 速い分は予算超過とみなさない)。
+
+Usage:
+  python test_golden.py            # 比較 (失敗時は終了コード 1)
+  python test_golden.py --update   # 最適化で結果が意図的に変わった場合のみ再生成
+  python -m pytest -q test_golden.py
+
+Env:
+  CITY_LITE_BUDGET_SLACK   許容する悪化率 (既定 0.5 = +50%)
+  CITY_LITE_SKIP_BUDGETS=1 性能予算のチェックを省略 (遅い CI など)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from metrics import METRICS
+from mesh_utils import MeshGridMapper
+from city_grid import CityGrid
+from synthetic_mesh import SyntheticRegion
+import advanced_city_simulator as acs
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_PATH = os.path.join(BASE_DIR, "data", "golden", "pipeline_small.json")
+
+GOLDEN_ZONES = 60
+GOLDEN_SEED = 7
+GOLDEN_YEARS = 10
+
+# 許容誤差 (float32 の CityGrid と float64 の交通量で共通)
+RTOL = 1e-4
+ATOL = 1e-4
+
+# 時間予算: 各ステージを最低この時間繰り返して1回あたりを計る (timeit の autorange と同様)
+MIN_STAGE_SECONDS = 0.1
+TIMING_REPEATS = 5
+
+STAGES = ("load", "network_build", "assignment", "aggregation", "benrido", "city_steps")
+CALIBRATION = "calibration"
+
+_CALIBRATION_DATA = np.random.default_rng(0).random(50_000)
+
+
+def calibrate():
+    """Fixed NumPy + pure-Python workload; its time tracks the machine's current speed."""
+    np.sort(_CALIBRATION_DATA)
+    counts = {}
+    for i in range(20_000):
+        counts[i % 997] = counts.get(i % 997, 0) + 1
+    return counts
+
+
+class GoldenRun:
+    """Runs the fixed pipeline once and keeps the outputs and per-stage timings."""
+
+    def __init__(self, work_dir):
+        region = SyntheticRegion(GOLDEN_ZONES, seed=GOLDEN_SEED, fill=0.85)
+        self.region = region
+        self.data_dir = region.write_data_dir(os.path.join(work_dir, "golden"))
+        self.stat_dir = os.path.join(self.data_dir, "statistical")
+
+    def run(self, track_memory=False):
+        """Returns (outputs, {stage: seconds per call or peak bytes})."""
+        measures = {}
+        state = {}
+
+        def stage(name, fn):
+            if track_memory:
+                tracemalloc.start()
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                fn()
+                measures[name] = max(0, tracemalloc.get_traced_memory()[1] - base)
+                tracemalloc.stop()
+            else:
+                calls = 0
+                t0 = time.perf_counter()
+                while True:
+                    fn()
+                    calls += 1
+                    elapsed = time.perf_counter() - t0
+                    if elapsed >= MIN_STAGE_SECONDS:
+                        break
+                measures[name] = elapsed / calls
+
+        def load():
+            state["data"] = acs.SimulationData(self.data_dir)
+            state["data"].load()
+
+        def network_build():
+            state["graph"] = acs.NetworkBuilder(state["data"].zones).build()
+
+        def assignment():
+            acs.TrafficSimulator(state["graph"], acs.DEFAULT_CONFIG).run(state["data"].demand)
+
+        def aggregation():
+            state["result"] = acs.ResultAggregator(state["graph"], state["data"].hinagata_cols).aggregate()
+
+        def benrido():
+            mapper = MeshGridMapper()
+            mapper.fit(self.region.code_strings)
+            grid = CityGrid(width=mapper.cols, height=mapper.rows)
+            grid.set_mapper(mapper)
+            grid.load_population_and_elderly_from_stat(os.path.join(self.stat_dir, "tblT001101H34.csv"))
+            grid.compute_benrido_from_statistical(
+                os.path.join(self.stat_dir, "tblT001164H34.csv"),
+                os.path.join(self.stat_dir, "tblT001164H34_mapping_with_benrido.csv"))
+            state["grid"] = grid
+            state["acc"] = grid.acc.copy()
+
+        def city_steps():
+            # 繰り返し計測できるよう benrido 直後の状態の fork を進める
+            grid = state["grid"].fork()
+            trajectory = {"population_total": [], "land_price_total": [], "population": []}
+            for _ in range(GOLDEN_YEARS):
+                grid.step_simulation()
+                trajectory["population_total"].append(float(np.sum(grid.population, dtype=np.float64)))
+                trajectory["land_price_total"].append(float(np.sum(grid.land_price, dtype=np.float64)))
+                trajectory["population"].append(grid.population.astype(np.float64).ravel().tolist())
+            state["trajectory"] = trajectory
+
+        if not track_memory:
+            stage(CALIBRATION, calibrate)
+        for name in STAGES:
+            stage(name, locals()[name])
+
+        G = state["graph"]
+        flows = {f"{u}->{v}": round(float(d["flow"]), 6)
+                 for u, v, d in sorted(G.edges(data=True), key=lambda e: (e[0], e[1])) if d["flow"] > 0}
+        df = state["result"].sort_values("key_code").reset_index(drop=True)
+        outputs = {
+            "link_flows": flows,
+            "aggregated": {
+                "columns": [c for c in df.columns if c != "key_code"],
+                "rows": {str(r["key_code"]): [float(r[c]) for c in df.columns if c != "key_code"]
+                         for r in df.to_dict("records")}
+            },
+            "city": {
+                "shape": list(state["acc"].shape),
+                "acc": state["acc"].astype(np.float64).ravel().tolist(),
+                "trajectory": state["trajectory"]
+            }
+        }
+        return outputs, measures
+
+
+def measure(work_dir):
+    """Outputs plus best-of-N stage times and per-stage peak memory."""
+    METRICS.enabled = False  # 計測オーバーヘッドを除く
+    try:
+        runner = GoldenRun(work_dir)
+        outputs, best = runner.run()
+        for _ in range(TIMING_REPEATS - 1):
+            _, t = runner.run()
+            best = {k: min(best[k], t[k]) for k in best}
+        _, memory = runner.run(track_memory=True)
+    finally:
+        METRICS.enabled = os.environ.get("CITY_LITE_METRICS", "1") != "0"
+    return outputs, {"seconds": best, "peak_bytes": memory}
+
+
+# --- Comparisons (each returns a list of failure messages) ---
+
+def _close(a, b):
+    return np.allclose(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64),
+                       rtol=RTOL, atol=ATOL, equal_nan=True)
+
+
+def compare_link_flows(golden, current):
+    errors = []
+    g, c = golden["link_flows"], current["link_flows"]
+    missing = sorted(set(g) - set(c))
+    extra = sorted(set(c) - set(g))
+    if missing:
+        errors.append(f"link flows missing on {len(missing)} links (e.g. {missing[:3]})")
+    if extra:
+        errors.append(f"link flows appeared on {len(extra)} new links (e.g. {extra[:3]})")
+    drift = [k for k in set(g) & set(c) if not _close(g[k], c[k])]
+    if drift:
+        k = sorted(drift)[0]
+        errors.append(f"link flows differ on {len(drift)} links (e.g. {k}: {g[k]} -> {c[k]})")
+    return errors
+
+
+def compare_aggregated(golden, current):
+    g, c = golden["aggregated"], current["aggregated"]
+    if g["columns"] != c["columns"]:
+        return [f"hinagata columns changed: {g['columns']} -> {c['columns']}"]
+    errors = []
+    if set(g["rows"]) != set(c["rows"]):
+        errors.append(f"aggregated zones changed ({len(g['rows'])} -> {len(c['rows'])})")
+    for zone in sorted(set(g["rows"]) & set(c["rows"])):
+        if not _close(g["rows"][zone], c["rows"][zone]):
+            diff = [col for col, a, b in zip(g["columns"], g["rows"][zone], c["rows"][zone]) if not _close(a, b)]
+            errors.append(f"zone {zone}: {', '.join(diff[:4])} differ")
+    return errors
+
+
+def compare_city(golden, current):
+    g, c = golden["city"], current["city"]
+    if g["shape"] != c["shape"]:
+        return [f"grid shape changed: {g['shape']} -> {c['shape']}"]
+    errors = []
+    if not _close(g["acc"], c["acc"]):
+        errors.append("benrido acc layer differs")
+    for key in ("population_total", "land_price_total"):
+        if not _close(g["trajectory"][key], c["trajectory"][key]):
+            errors.append(f"{key} trajectory differs: {g['trajectory'][key][-1]} -> {c['trajectory'][key][-1]}")
+    for year, (a, b) in enumerate(zip(g["trajectory"]["population"], c["trajectory"]["population"]), 1):
+        if not _close(a, b):
+            errors.append(f"population layer differs from year {year}")
+            break
+    return errors
+
+
+def machine_speed(budgets, perf):
+    """Calibration time now / when the budgets were recorded (1.0 if either is missing)."""
+    ref = budgets.get("seconds", {}).get(CALIBRATION)
+    now = perf["seconds"].get(CALIBRATION)
+    return now / ref if ref and now else 1.0
+
+
+def check_budgets(golden, perf, slack=None):
+    if os.environ.get("CITY_LITE_SKIP_BUDGETS") == "1":
+        return []
+    if slack is None:
+        slack = float(os.environ.get("CITY_LITE_BUDGET_SLACK", "0.5"))
+    errors = []
+    budgets = golden.get("budgets", {})
+    speed = machine_speed(budgets, perf)
+    for name in STAGES:
+        t_ref = budgets.get("seconds", {}).get(name)
+        t = perf["seconds"].get(name)
+        if t_ref is not None and t is not None and t > t_ref * speed * (1 + slack):
+            errors.append(f"stage {name}: {t:.4f}s exceeds budget {t_ref * speed:.4f}s "
+                          f"(+{slack:.0%}, recorded {t_ref:.4f}s x{speed:.2f} machine speed)")
+        m_ref = budgets.get("peak_bytes", {}).get(name)
+        m = perf["peak_bytes"].get(name)
+        if m_ref is not None and m is not None and m > m_ref * (1 + slack) + 64 * 1024:
+            errors.append(f"stage {name}: peak {m / 1e6:.2f} MB exceeds budget {m_ref / 1e6:.2f} MB (+{slack:.0%})")
+    return errors
+
+
+# --- pytest entry points (one shared pipeline run) ---
+
+_CACHE = {}
+
+
+def _current():
+    if "result" not in _CACHE:
+        work_dir = tempfile.mkdtemp(prefix="city_golden_")
+        try:
+            _CACHE["result"] = measure(work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return _CACHE["result"]
+
+
+def _golden():
+    with open(GOLDEN_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_link_flows():
+    errors = compare_link_flows(_golden(), _current()[0])
+    assert not errors, "\n".join(errors)
+
+
+def test_aggregated_output():
+    errors = compare_aggregated(_golden(), _current()[0])
+    assert not errors, "\n".join(errors)
+
+
+def test_city_trajectory():
+    errors = compare_city(_golden(), _current()[0])
+    assert not errors, "\n".join(errors)
+
+
+def test_stage_budgets():
+    errors = check_budgets(_golden(), _current()[1])
+    assert not errors, "\n".join(errors)
+
+
+def main(argv):
+    outputs, perf = _current()
+    if "--update" in argv:
+        golden = dict(outputs)
+        golden["meta"] = {"zones": GOLDEN_ZONES, "seed": GOLDEN_SEED, "years": GOLDEN_YEARS}
+        golden["budgets"] = {
+            "seconds": {k: round(v, 6) for k, v in perf["seconds"].items()},
+            "peak_bytes": perf["peak_bytes"]
+        }
+        os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+        with open(GOLDEN_PATH, "w", encoding="utf-8") as f:
+            json.dump(golden, f, separators=(",", ":"))
+        print(f"Updated {GOLDEN_PATH}")
+        return 0
+
+    golden = _golden()
+    failed = False
+    for label, errors in (("link flows", compare_link_flows(golden, outputs)),
+                          ("aggregated output", compare_aggregated(golden, outputs)),
+                          ("city trajectory", compare_city(golden, outputs)),
+                          ("stage budgets", check_budgets(golden, perf))):
+        print(f"{'FAIL' if errors else 'OK  '} {label}")
+        for e in errors[:20]:
+            print(f"     {e}")
+        failed = failed or bool(errors)
+    budgets = golden.get("budgets", {})
+    print(f"\nMachine speed vs recorded budgets: x{machine_speed(budgets, perf):.2f} (time budgets are scaled by it)")
+    print("Stage      seconds (budget)      peak MB (budget)")
+    for name in STAGES:
+        print(f"  {name:<14} {perf['seconds'][name]:8.4f} ({budgets.get('seconds', {}).get(name, float('nan')):8.4f})"
+              f"   {perf['peak_bytes'][name] / 1e6:7.2f} ({budgets.get('peak_bytes', {}).get(name, 0) / 1e6:7.2f})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
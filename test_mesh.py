@@ -1,29 +1,188 @@
+"""
+MeshGridMapper の回帰テスト。
 
-import json
+配列化した fit / lookup / codes_to_coords / coords_to_codes / save / load を、元の
+1コードずつ文字列を切り出す実装 (reference_fit) と比較する。
+
+Usage:
+  python -m pytest -q test_mesh.py
+"""
 import os
-from mesh_utils import MeshGridMapper
+import json
+import random
+
+import numpy as np
+import pytest
+
+from mesh_utils import MeshGridMapper, mesh_keys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GRID_PATH = os.path.join(BASE_DIR, "grid", "messyude-ta001.geojson")
+
+
+def reference_fit(mesh_codes):
+    """The original digit-string parse: {code: (col, row)} and (cols, rows)."""
+    coords = []
+    for code in mesh_codes:
+        code = str(code)
+        y1, x1, y2, x2 = int(code[0:2]), int(code[2:4]), int(code[4:5]), int(code[5:6])
+        y3 = x3 = y4 = x4 = 0
+        if len(code) >= 8:
+            y3, x3 = int(code[6:7]), int(code[7:8])
+        if len(code) >= 9:
+            y4, x4 = {1: (0, 0), 2: (0, 1), 3: (1, 0), 4: (1, 1)}.get(int(code[8:9]), (0, 0))
+        coords.append((code, x1 * 160 + x2 * 20 + x3 * 2 + x4, y1 * 160 + y2 * 20 + y3 * 2 + y4))
+    min_x, max_x = min(c[1] for c in coords), max(c[1] for c in coords)
+    min_y, max_y = min(c[2] for c in coords), max(c[2] for c in coords)
+    mapping = {code: (gx - min_x, max_y - gy) for code, gx, gy in coords}
+    return mapping, (max_x - min_x + 1, max_y - min_y + 1)
+
+
+def random_codes(digits, n=200, seed=0):
+    """n distinct mesh codes of one level in 4 neighboring 1st-level meshes (6 digits: at most 256)."""
+    rng = random.Random(seed)
+    codes = set()
+    while len(codes) < n:
+        code = f"{rng.choice((51, 52))}{rng.choice((32, 33))}{rng.randrange(8)}{rng.randrange(8)}"
+        if digits >= 8:
+            code += f"{rng.randrange(10)}{rng.randrange(10)}"
+        if digits >= 9:
+            code += str(rng.randint(1, 4))
+        if digits >= 10:
+            code += str(rng.randint(1, 4))
+        codes.add(code)
+    codes = sorted(codes)
+    if digits >= 10:
+        # 9桁目までが同じコードは同じセルになるので1つだけ残す
+        codes = list({c[:9]: c for c in codes}.values())
+    return codes
+
+
+@pytest.mark.parametrize("digits", [6, 8, 9, 10])
+def test_fit_matches_reference(digits):
+    codes = random_codes(digits, seed=digits)
+    mapping, (cols, rows) = reference_fit(codes)
+    mapper = MeshGridMapper()
+    mapper.fit(codes)
+    assert (mapper.cols, mapper.rows) == (cols, rows)
+    assert len(mapper) == len(codes)
+
+    for code, coords in mapping.items():
+        assert mapper.get_grid_coords(code) == coords
+        assert mapper.get_grid_coords(int(code)) == coords
+    got_cols, got_rows, found = mapper.codes_to_coords(list(mapping))
+    assert found.all()
+    assert got_cols.tolist() == [c for c, _ in mapping.values()]
+    assert got_rows.tolist() == [r for _, r in mapping.values()]
+
+
+@pytest.mark.parametrize("digits", [6, 8, 9, 10])
+def test_grid_coords_round_trip(digits):
+    codes = random_codes(digits, seed=100 + digits)
+    mapping, _ = reference_fit(codes)
+    reverse = {coords: code for code, coords in mapping.items()}
+    mapper = MeshGridMapper()
+    mapper.fit(codes)
+
+    for code in codes:
+        assert mapper.get_mesh_code(*mapper.get_grid_coords(code)) == code
+    rng = random.Random(digits)
+    for _ in range(500):
+        col, row = rng.randrange(mapper.cols), rng.randrange(mapper.rows)
+        assert mapper.get_mesh_code(col, row) == reverse.get((col, row))
+
+    # every grid cell, including the empty ones
+    cols, rows = np.meshgrid(np.arange(mapper.cols), np.arange(mapper.rows))
+    got, found = mapper.coords_to_codes(cols.ravel(), rows.ravel())
+    expected = [reverse.get((c, r)) for c, r in zip(cols.ravel().tolist(), rows.ravel().tolist())]
+    assert found.tolist() == [e is not None for e in expected]
+    assert got[found].astype(str).tolist() == [e for e in expected if e is not None]
+
+
+def test_coords_outside_grid():
+    mapper = MeshGridMapper()
+    mapper.fit(random_codes(9, n=50))
+    codes, found = mapper.coords_to_codes([-1, 0, mapper.cols, 0], [0, -1, 0, mapper.rows])
+    assert not found.any()
+    assert codes.tolist() == [0, 0, 0, 0]
+    assert mapper.get_mesh_code(-1, 0) is None
+    assert mapper.get_mesh_code(mapper.cols, mapper.rows) is None
+
+
+def test_lookup_unknown_and_invalid_codes():
+    codes = random_codes(9, n=50)
+    mapper = MeshGridMapper()
+    mapper.fit(codes)
+    unknown = "999999999"
+    queries = np.array([codes[3], unknown, "", "abc", None, "5132.5", float("nan"), int(codes[7])], dtype=object)
+    at, found = mapper.lookup(queries)
+    assert found.tolist() == [True, False, False, False, False, False, False, True]
+    assert at[0] == codes.index(codes[3]) and at[-1] == codes.index(codes[7])
+    assert (at[~found] == 0).all()
+
+    cols, rows, found = mapper.codes_to_coords(queries)
+    assert (cols[~found] == -1).all() and (rows[~found] == -1).all()
+    assert mapper.get_grid_coords(unknown) is None
+    assert mapper.get_grid_coords("") is None
+
+    keys, valid = mesh_keys(queries)
+    assert valid.tolist() == [True, True, False, False, False, False, False, True]
+
+
+def test_fit_rejects_invalid_codes():
+    with pytest.raises(ValueError):
+        MeshGridMapper().fit(["513243254", "abc"])
+
+
+def test_empty_mapper():
+    mapper = MeshGridMapper()
+    mapper.fit([])
+    assert (mapper.cols, mapper.rows, len(mapper)) == (0, 0, 0)
+    at, found = mapper.lookup(["513243254"])
+    assert not found.any()
+    assert mapper.get_grid_coords("513243254") is None
+    assert mapper.get_mesh_code(0, 0) is None
+
+
+def test_save_load_round_trip(tmp_path):
+    codes = random_codes(9, n=200, seed=5)
+    mapper = MeshGridMapper()
+    mapper.fit(codes)
+    loaded = MeshGridMapper.load(mapper.save(str(tmp_path / "mapper.npz")))
 
-# Load GeoJSON
-path = 'grid/messyude-ta001.geojson'
-if not os.path.exists(path):
-    print("File not found.")
-    exit()
+    assert (loaded.cols, loaded.rows) == (mapper.cols, mapper.rows)
+    assert (loaded.min_x, loaded.max_x, loaded.min_y, loaded.max_y) == \
+        (mapper.min_x, mapper.max_x, mapper.min_y, mapper.max_y)
+    for name in ("codes", "code_cols", "code_rows", "index_grid"):
+        assert np.array_equal(getattr(loaded, name), getattr(mapper, name))
+        assert not getattr(loaded, name).flags.writeable
+    assert loaded.table_id == mapper.table_id
+    assert loaded.payload() == mapper.payload()
+    assert all(loaded.get_grid_coords(c) == mapper.get_grid_coords(c) for c in codes)
 
-with open(path, 'r', encoding='utf-8') as f:
-    data = json.load(f)
+    empty = MeshGridMapper.load(MeshGridMapper().save(str(tmp_path / "empty.npz")))
+    assert len(empty) == 0 and (empty.cols, empty.rows) == (0, 0)
 
-print(f"Loaded {len(data['features'])} features.")
 
-mapper = MeshGridMapper()
-codes = [f['properties']['KEY_CODE'] for f in data['features']]
-mapper.fit(codes)
+def test_payload_matches_arrays():
+    codes = random_codes(8, n=80, seed=3)
+    mapper = MeshGridMapper()
+    mapper.fit(codes)
+    payload = json.loads(mapper.payload())
+    assert payload["codes"] == sorted(codes)
+    assert (payload["width"], payload["height"]) == (mapper.cols, mapper.rows)
+    mapping, _ = reference_fit(codes)
+    assert [(c, r) for c, r in zip(payload["cols"], payload["rows"])] == [mapping[c] for c in payload["codes"]]
 
-print(f"Grid Size: {mapper.cols} x {mapper.rows}")
-print(f"X Range: {mapper.min_x} - {mapper.max_x}")
-print(f"Y Range: {mapper.min_y} - {mapper.max_y}")
 
-# Test a few corners
-first = codes[0]
-print(f"First ({first}): {mapper.get_grid_coords(first)}")
-last = codes[-1]
-print(f"Last ({last}): {mapper.get_grid_coords(last)}")
+@pytest.mark.skipif(not os.path.exists(GRID_PATH), reason="grid GeoJSON not available")
+def test_bundled_grid_matches_reference():
+    with open(GRID_PATH, "r", encoding="utf-8") as f:
+        codes = [str(feat["properties"]["KEY_CODE"]) for feat in json.load(f)["features"]]
+    mapping, size = reference_fit(codes)
+    mapper = MeshGridMapper()
+    mapper.fit(codes)
+    assert (mapper.cols, mapper.rows) == size
+    cols, rows, found = mapper.codes_to_coords(list(mapping))
+    assert found.all()
+    assert list(zip(cols.tolist(), rows.tolist())) == list(mapping.values())
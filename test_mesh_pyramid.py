@@ -0,0 +1,100 @@
+"""
+mesh_pyramid (parse_level / mesh_bounds / MeshPyramid) のテスト。
+
+- mesh_bounds が JIS X 0410 の既知のメッシュ (1次〜4次) の範囲と一致すること
+- MeshPyramid.reduce (sum / mean) と cells が pandas の groupby と一致すること
+  (数値順の入力と、並べ替え (order) が必要な入力の両方)
+
+Usage:
+  python -m pytest -q test_mesh_pyramid.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from mesh_pyramid import MESH_LEVELS, MeshPyramid, mesh_bounds, parse_level
+from synthetic_mesh import CELLS_PER_1ST, SyntheticRegion, code_to_lonlat
+
+
+def dms(d, m=0, s=0.0):
+    return d + m / 60 + s / 3600
+
+
+# (code, level, (west, south, east, north))
+KNOWN_BOUNDS = [
+    (5339, 1, (dms(139), dms(35, 20), dms(140), dms(36))),
+    (533945, 2, (dms(139, 37, 30), dms(35, 40), dms(139, 45), dms(35, 45))),
+    (53394599, 3, (dms(139, 44, 15), dms(35, 44, 30), dms(139, 45), dms(35, 45))),
+    (533945991, 4, (dms(139, 44, 15), dms(35, 44, 30), dms(139, 44, 37.5), dms(35, 44, 45))),
+    (533945992, 4, (dms(139, 44, 37.5), dms(35, 44, 30), dms(139, 45), dms(35, 44, 45))),
+    (533945993, 4, (dms(139, 44, 15), dms(35, 44, 45), dms(139, 44, 37.5), dms(35, 45))),
+    (533945994, 4, (dms(139, 44, 37.5), dms(35, 44, 45), dms(139, 45), dms(35, 45))),
+    (5133, 1, (dms(133), dms(34), dms(134), dms(34, 40))),
+    (51324560, 3, (dms(132, 37, 30), dms(34, 23), dms(132, 38, 15), dms(34, 23, 30))),
+]
+
+
+@pytest.mark.parametrize("code, level, expected", KNOWN_BOUNDS)
+def test_mesh_bounds_known_codes(code, level, expected):
+    bounds = [float(v[0]) for v in mesh_bounds([code], level)]
+    assert bounds == pytest.approx(expected, abs=1e-9)
+
+
+def test_mesh_bounds_match_half_mesh_corners():
+    codes = SyntheticRegion(300, seed=1).codes
+    west, south, _, _ = mesh_bounds(codes, 4)
+    lon, lat = code_to_lonlat(codes)
+    np.testing.assert_allclose(west, lon, atol=1e-9)
+    np.testing.assert_allclose(south, lat, atol=1e-9)
+
+
+def test_parse_level():
+    assert parse_level(None) is None
+    assert parse_level("", default=4) == 4
+    assert [parse_level(v) for v in (1, "2", "3", 4)] == [1, 2, 3, 4]
+    assert [parse_level(v) for v in ("80km", "10km", "1km", "500m")] == [1, 2, 3, 4]
+    for bad in (0, "5", "250m", "abc"):
+        with pytest.raises(ValueError):
+            parse_level(bad)
+
+
+def groupby(codes, values, level, how):
+    digits = len(str(int(codes[0])))
+    key = np.asarray(codes, dtype=np.int64) // 10 ** (digits - MESH_LEVELS[level])
+    frame = pd.DataFrame(values).groupby(key)
+    return frame.agg(how) if how != "size" else frame.size()
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+@pytest.mark.parametrize("base", [4, 3])
+def test_reduce_matches_groupby(shuffle, base):
+    # 1次メッシュの角をまたぎ、欠けのある地域
+    region = SyntheticRegion(900, seed=5, fill=0.7, origin=(51 * CELLS_PER_1ST + 140, 32 * CELLS_PER_1ST + 145))
+    codes = np.unique(region.codes // 10 ** (MESH_LEVELS[4] - MESH_LEVELS[base]))
+    rng = np.random.default_rng(base)
+    if shuffle:
+        codes = rng.permutation(codes)
+    values = rng.uniform(0, 100, (len(codes), 3))
+
+    pyramid = MeshPyramid(codes.astype(str))
+    assert pyramid.base_level == base
+    assert (pyramid.order is None) != shuffle
+    for level in range(base, 0, -1):
+        sums = groupby(codes, values, level, "sum")
+        assert np.array_equal(pyramid.codes(level), sums.index.to_numpy())
+        np.testing.assert_allclose(pyramid.reduce(values, level), sums.to_numpy(), rtol=1e-12)
+        np.testing.assert_allclose(pyramid.reduce(values, level, how="mean"),
+                                   groupby(codes, values, level, "mean").to_numpy(), rtol=1e-12)
+        np.testing.assert_allclose(pyramid.reduce(values[:, 0], level), sums[0].to_numpy(), rtol=1e-12)
+        assert pyramid.cells(level).tolist() == groupby(codes, values, level, "size").tolist()
+    assert len(pyramid.codes(1)) > 1 and len(pyramid.codes(2)) > len(pyramid.codes(1))
+
+    with pytest.raises(ValueError):
+        pyramid.reduce(values, base + 1)
+    with pytest.raises(ValueError):
+        pyramid.reduce(values, 1, how="max")
+
+
+def test_mixed_levels_are_rejected():
+    with pytest.raises(ValueError):
+        MeshPyramid(["51324560", "513245601"])
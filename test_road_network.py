@@ -0,0 +1,167 @@
+"""
+road_network (RoadNetworkBuilder / build_network) のテスト。
+
+- 道路種別テーブルがない場合に NetworkBuilder と同じグラフ (ノード・リンク・属性) になること
+  (1次メッシュの境界をまたぐ、欠けのある合成地域で確認)
+- 4つの CSV の小さなフィクスチャで、種別・車線数・容量・BPR 係数・座標からの長さ・
+  道路のない境界のリンクを張らないことを確認する
+
+Usage:
+  python -m pytest -q test_road_network.py
+"""
+import pandas as pd
+import pytest
+
+import advanced_city_simulator as acs
+from road_network import (BOUNDARY_TABLE, LINE_PARAMS_TABLE, NETWORK_TABLE, NODE_TABLE, RoadNetworkBuilder,
+                          build_network, haversine_km)
+from synthetic_mesh import CELLS_PER_1ST, SyntheticRegion, global_to_code
+
+# (base_speed_kmh, capacity_per_lane_vph, alpha, beta) per road class
+CLASS_PARAMS = {"Nat": (50, 1800, 0.12, 4.0), "Pref": (40, 1500, 0.15, 4.0),
+                "Muni": (30, 900, 0.3, 3.0), "Other": (20, 600, 0.5, 2.0)}
+SIGNALS = (0.6, 30, 1.2)  # signal_density_per_km, stop_delay_sec_per_signal, period_delay_multiplier
+
+
+def graph_items(G):
+    nodes = {n: dict(d) for n, d in G.nodes(data=True)}
+    edges = {(u, v): dict(d) for u, v, d in G.edges(data=True)}
+    return nodes, edges
+
+
+def test_without_tables_matches_network_builder(tmp_path):
+    # 1次メッシュの角をまたぐ位置に置き、繰り上がりのある隣接も確認する
+    region = SyntheticRegion(120, seed=2, fill=0.8, origin=(51 * CELLS_PER_1ST + 154, 32 * CELLS_PER_1ST + 154))
+    zones = region.code_strings
+    expected = graph_items(acs.NetworkBuilder(zones).build())
+
+    assert graph_items(RoadNetworkBuilder(zones, str(tmp_path)).build()) == expected
+    # compute_data がなければ build_network は NetworkBuilder を使う
+    assert graph_items(build_network(zones, str(tmp_path))) == expected
+
+
+def free_speed(road_class):
+    base, _, _, _ = CLASS_PARAMS[road_class]
+    density, delay, multiplier = SIGNALS
+    return 60.0 / (60.0 / base + density * delay * multiplier / 60.0)
+
+
+def capacity(road_class, lanes):
+    return CLASS_PARAMS[road_class][1] * lanes
+
+
+@pytest.fixture
+def road_tables(tmp_path):
+    """
+    4 zones on a 2x2 block (A, B on the south row):
+      A (SW): Nat 1000m, Muni 300m; kansen N/E, sidou S, no road W
+      B (SE): Other 200m; sidou W only
+      C (NW): in the network table but no boundary present -> fixed values
+      D (NE): in no table -> fixed values
+    """
+    gy, gx = 51 * CELLS_PER_1ST + 40, 32 * CELLS_PER_1ST + 40
+    A, B, C, D = (str(c) for c in global_to_code([gy, gy, gy + 1, gy + 1], [gx, gx + 1, gx, gx + 1]))
+    table_dir = tmp_path / "compute_data"
+    table_dir.mkdir()
+
+    def write(name, rows):
+        pd.DataFrame(rows).to_csv(table_dir / name, index=False, encoding="utf-8-sig")
+
+    write(NETWORK_TABLE, [
+        {"zone_id": A, "len_Nat_m": 1000, "len_Pref_m": 0, "len_Muni_m": 300, "len_Other_m": 0, "length_total_m": 1300},
+        {"zone_id": B, "len_Nat_m": 0, "len_Pref_m": 0, "len_Muni_m": 0, "len_Other_m": 200, "length_total_m": 200},
+        {"zone_id": C, "len_Nat_m": 500, "len_Pref_m": 0, "len_Muni_m": 0, "len_Other_m": 0, "length_total_m": 500},
+    ])
+    boundary = []
+    for zone, side, kind, present in ((A, "N", "kansen", 1), (A, "E", "kansen", 1), (A, "S", "sidouseikatudou", 1),
+                                      (A, "W", "kansen", 0), (B, "W", "sidouseikatudou", 1), (B, "N", "kansen", 0),
+                                      (C, "E", "kansen", 0)):
+        boundary.append({"zone_id": zone, "boundary_type": kind, "side": side, "is_present": present,
+                         "length_total_m": 0})
+    write(BOUNDARY_TABLE, boundary)
+    # A: centroid and N about 0.25 km apart; E far away (bad coordinate -> fixed length)
+    write(NODE_TABLE, [
+        {"zone_id": A, "node_type": "CENTROID", "side": "", "lon": 132.45, "lat": 34.35},
+        {"zone_id": A, "node_type": "BOUNDARY", "side": "N", "lon": 132.45, "lat": 34.35225},
+        {"zone_id": A, "node_type": "BOUNDARY", "side": "E", "lon": 132.55, "lat": 34.35},
+    ])
+    params = []
+    for period in ("AM_PEAK", "MIDDAY"):
+        for road_class, (base, cap, alpha, beta) in CLASS_PARAMS.items():
+            for lanes in range(1, 5):
+                params.append({"period": period, "road_class": road_class, "lanes": lanes,
+                               "base_speed_kmh": base if period == "AM_PEAK" else base * 2,
+                               "base_time_multiplier": 1.0, "alpha": alpha, "beta": beta,
+                               "capacity_per_lane_vph": cap, "signal_density_per_km": SIGNALS[0],
+                               "stop_delay_sec_per_signal": SIGNALS[1], "period_delay_multiplier": SIGNALS[2]})
+    write(LINE_PARAMS_TABLE, params)
+    return {"A": A, "B": B, "C": C, "D": D, "data_dir": str(tmp_path), "table_dir": str(table_dir)}
+
+
+def assert_classed(d, road_class, lanes):
+    assert (d["road_class"], d["lanes"]) == (road_class, lanes)
+    assert d["capacity"] == pytest.approx(capacity(road_class, lanes))
+    assert d["free_speed"] == pytest.approx(free_speed(road_class))
+    assert (d["alpha"], d["beta"]) == CLASS_PARAMS[road_class][2:]
+
+
+def assert_fixed(d):
+    fixed = {"internal_out": (0.25, 500, 30), "internal_in": (0.25, 500, 30), "passing": (0.5, 1000, 40),
+             "connector": (0.01, 9999, 60)}[d["type"]]
+    assert (d["length"], d["capacity"], d["free_speed"]) == fixed
+    assert "road_class" not in d and "alpha" not in d
+
+
+def test_road_classes_from_tables(road_tables):
+    t = road_tables
+    A, B, C, D = t["A"], t["B"], t["C"], t["D"]
+    G = RoadNetworkBuilder([A, B, C, D], t["table_dir"]).build()
+    edge = G.get_edge_data
+
+    # A: trunk = Nat (1000m -> 2 lanes), local = Muni (300m -> 1 lane)
+    for u, v in ((f"{A}_C", f"{A}_N"), (f"{A}_E", f"{A}_C"), (f"{A}_N", f"{A}_E")):
+        assert_classed(edge(u, v), "Nat", 2)
+    for u, v in ((f"{A}_C", f"{A}_S"), (f"{A}_N", f"{A}_S"), (f"{A}_S", f"{A}_E")):
+        assert_classed(edge(u, v), "Muni", 1)
+    # B: only Other, sidou on W
+    assert_classed(edge(f"{B}_C", f"{B}_W"), "Other", 1)
+
+    # lengths from coordinates, the out-of-cell coordinate falls back to the fixed length
+    assert edge(f"{A}_C", f"{A}_N")["length"] == pytest.approx(haversine_km(132.45, 34.35, 132.45, 34.35225))
+    assert edge(f"{A}_N", f"{A}_C")["length"] == edge(f"{A}_C", f"{A}_N")["length"]
+    assert edge(f"{A}_C", f"{A}_E")["length"] == 0.25
+    assert G.nodes[f"{A}_C"]["lon"] == 132.45 and "lon" not in G.nodes[f"{B}_C"]
+
+    # sides without roads get no links at all (the nodes stay)
+    for zone, side in ((A, "W"), (B, "N"), (B, "S"), (B, "E")):
+        node = f"{zone}_{side}"
+        assert node in G and G.degree(node) == 0
+    assert not G.has_edge(f"{B}_N", f"{D}_S")
+
+    # C (no boundary present) and D (no tables) keep NetworkBuilder's fixed links on every side
+    for zone in (C, D):
+        for side in "NSEW":
+            assert_fixed(edge(f"{zone}_C", f"{zone}_{side}"))
+            assert_fixed(edge(f"{zone}_{side}", f"{zone}_C"))
+
+    # connectors only where both sides have a road
+    for u, v in ((f"{A}_E", f"{B}_W"), (f"{A}_N", f"{C}_S"), (f"{C}_E", f"{D}_W")):
+        assert_fixed(edge(u, v))
+        assert_fixed(edge(v, u))
+    assert sum(1 for _, _, d in G.edges(data=True) if d["type"] == "connector") == 6
+
+
+def test_build_network_uses_tables_and_period(road_tables):
+    t = road_tables
+    zones = [t["A"], t["B"], t["C"], t["D"]]
+    G = build_network(zones, t["data_dir"])
+    assert G.edges[f"{t['A']}_C", f"{t['A']}_N"]["road_class"] == "Nat"
+
+    config = dict(acs.DEFAULT_CONFIG, periods=[{"key": "MIDDAY"}])
+    midday = build_network(zones, t["data_dir"], config=config)
+    fast, slow = midday.edges[f"{t['A']}_C", f"{t['A']}_N"], G.edges[f"{t['A']}_C", f"{t['A']}_N"]
+    assert fast["free_speed"] > slow["free_speed"]
+    assert fast["capacity"] == slow["capacity"]
+
+    with pytest.raises(ValueError):
+        RoadNetworkBuilder(zones, t["table_dir"], period="NIGHT").build()
@@ -0,0 +1,67 @@
+"""
+CitySessionManager のテスト。
+
+- peek() はセッションを作らず、未知の ID には base グリッドの一時ビューを返すこと
+- 新しい ID が続いても min_idle 秒以内に使われたセッションは追い出されないこと
+- アイドルになったセッションは LRU / idle_timeout で破棄されること
+
+Usage:
+  python -m pytest -q test_sessions.py
+"""
+import pytest
+
+from city_grid import CityGrid
+from city_sessions import CitySessionManager, SessionLimitError
+
+
+def make_manager(**kwargs):
+    manager = CitySessionManager(**kwargs)
+    manager.set_base(CityGrid(width=4, height=3))
+    return manager
+
+
+def age(manager, session_id, seconds):
+    manager._sessions[session_id].last_access -= seconds
+
+
+def test_peek_does_not_create_sessions():
+    manager = make_manager(max_sessions=2)
+    planner = manager.get("planner")
+    for i in range(10):
+        view = manager.peek(f"reader{i}")
+        assert view.grid is manager.base
+        assert view.timeline.years == [0]
+    assert manager.peek("planner") is planner
+    assert manager.stats()["sessions"] == 1
+
+    empty = CitySessionManager()
+    assert empty.peek("x").grid.mapper is None
+    assert empty.stats()["sessions"] == 0
+
+
+def test_new_ids_cannot_evict_active_sessions():
+    manager = make_manager(max_sessions=3, min_idle=60)
+    for sid in ("a", "b", "c"):
+        manager.get(sid)
+    with pytest.raises(SessionLimitError):
+        manager.get("intruder")
+    assert sorted(manager._sessions) == ["a", "b", "c"]
+    # 既存セッションの利用は上限に関係なく続けられる
+    assert manager.get("a").session_id == "a"
+
+
+def test_idle_sessions_are_evicted():
+    manager = make_manager(max_sessions=3, idle_timeout=1800, min_idle=60)
+    for sid in ("a", "b", "c"):
+        manager.get(sid)
+    age(manager, "a", 120)
+    manager.get("d")
+    assert sorted(manager._sessions) == ["b", "c", "d"]
+
+    age(manager, "b", 3600)
+    manager.get("c")
+    assert sorted(manager._sessions) == ["c", "d"]
+    # 期限切れでも、アクセスしたセッションは残る
+    age(manager, "d", 3600)
+    manager.get("d")
+    assert "d" in manager._sessions
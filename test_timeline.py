@@ -0,0 +1,174 @@
+"""
+CityGrid のチェックポイントとセッションタイムライン (CityTimeline) のテスト。
+
+- restore + 再計算 (seek) が、途中で止めずに run_years した結果とビット単位で一致すること
+- 1年ずつの step_simulation (作業バッファを使い回す) が公開済みの層を書き換えないこと
+- GridCheckpoint.save / load (.npz と .npy ディレクトリ) の往復
+- 施設を置いた後の truncate と、間引き (_thin) で先頭・最新が残ること
+
+Usage:
+  python -m pytest -q test_timeline.py
+"""
+import os
+
+import numpy as np
+import pytest
+
+from city_grid import CityGrid, GridCheckpoint, CHECKPOINT_LAYERS
+from city_timeline import CityTimeline
+from mesh_utils import MeshGridMapper
+from synthetic_mesh import SyntheticRegion
+
+
+def make_grid(compact=False, n_zones=150, seed=11):
+    region = SyntheticRegion(n_zones, seed=seed, fill=0.85)
+    mapper = MeshGridMapper()
+    mapper.fit(region.code_strings)
+    grid = CityGrid(width=mapper.cols, height=mapper.rows, compact=compact)
+    grid.set_mapper(mapper)
+    pop = region.population.astype(np.float64)
+    grid.load_layers(region.codes, {
+        "population": pop,
+        "elderly_share": region.elderly / np.maximum(pop, 1.0),
+        "acc": region.benrido,
+        "base_land_price": 10.0 + pop / 10.0,
+    })
+    return grid
+
+
+def straight(compact, years):
+    grid = make_grid(compact)
+    grid.run_years(years)
+    return grid
+
+
+def assert_same_state(grid, expected):
+    assert grid.current_year == expected.current_year
+    for name in CHECKPOINT_LAYERS:
+        assert np.array_equal(getattr(grid, name), getattr(expected, name)), name
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_seek_matches_straight_run(compact):
+    grid = make_grid(compact)
+    timeline = CityTimeline(interval=5)
+    timeline.reset(grid)
+    timeline.advance(grid, 23)
+    assert timeline.years == [0, 5, 10, 15, 20]
+
+    for year, replay in ((7, 2), (18, 3), (3, 3), (23, 3), (31, 8)):
+        assert timeline.seek(grid, year) == replay
+        assert_same_state(grid, straight(compact, year))
+    # 今より先 (記録のない年) に進んだ分もチェックポイントされる
+    assert timeline.years == [0, 5, 10, 15, 20, 25, 30]
+
+
+def test_seek_restore_does_not_touch_checkpoints():
+    grid = make_grid()
+    timeline = CityTimeline(interval=5)
+    timeline.reset(grid)
+    timeline.advance(grid, 10)
+    before = {name: timeline.nearest(5).layers[name].copy() for name in CHECKPOINT_LAYERS}
+    timeline.seek(grid, 6)
+    grid.run_years(3)
+    for name in CHECKPOINT_LAYERS:
+        assert np.array_equal(timeline.nearest(5).layers[name], before[name])
+    with pytest.raises(ValueError):
+        timeline.seek(grid, -1)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_single_steps_reuse_buffers_safely(compact):
+    grid = make_grid(compact)
+    published = []
+    for _ in range(6):
+        grid.step_simulation()
+        published.append((grid.checkpoint(), grid.population.copy(), grid.land_price.copy()))
+    # 作業バッファを使い回しても、公開済みの層 (チェックポイント・スナップショット) は変わらない
+    for checkpoint, population, land_price in published:
+        assert np.array_equal(checkpoint.layers["population"], population)
+        assert np.array_equal(checkpoint.layers["land_price"], land_price)
+    assert_same_state(grid, straight(compact, 6))
+    assert grid.fork().step_buffers() is not grid.step_buffers()
+
+
+@pytest.mark.parametrize("suffix", [".npz", ""])
+def test_checkpoint_save_load_round_trip(tmp_path, suffix):
+    grid = make_grid(compact=True)
+    grid.run_years(4)
+    checkpoint = grid.checkpoint()
+    path = checkpoint.save(str(tmp_path / ("year_4" + suffix)))
+    loaded = GridCheckpoint.load(path)
+
+    assert loaded.year == 4
+    assert (loaded.width, loaded.height, loaded.compact) == (grid.width, grid.height, True)
+    assert np.array_equal(loaded.codes, grid.mapper.codes)
+    for name in CHECKPOINT_LAYERS:
+        assert np.array_equal(loaded.layers[name], checkpoint.layers[name])
+        assert loaded.layers[name].dtype == checkpoint.layers[name].dtype
+        assert not loaded.layers[name].flags.writeable
+        if not suffix:
+            assert isinstance(loaded.layers[name], np.memmap)
+
+    # 読み込んだチェックポイントからの続きも同じ
+    restored = CityGrid.from_checkpoint(loaded)
+    restored.run_years(3)
+    grid.run_years(3)
+    assert_same_state(restored, grid)
+
+
+def test_truncate_after_facilities():
+    grid = make_grid()
+    timeline = CityTimeline(interval=5)
+    timeline.reset(grid)
+    timeline.advance(grid, 12)
+    timeline.seek(grid, 7)
+    acc_at_5 = timeline.nearest(5).layers["acc"].copy()
+
+    cols, rows = grid.mapper.code_cols[:3], grid.mapper.code_rows[:3]
+    grid.add_facilities(cols, rows, 3, 1.0)
+    timeline.truncate(grid)
+    assert timeline.years == [0, 5, 7]
+    assert np.array_equal(timeline.nearest(5).layers["acc"], acc_at_5)
+
+    expected = make_grid()
+    expected.run_years(7)
+    expected.add_facilities(cols, rows, 3, 1.0)
+    expected.run_years(4)
+    timeline.advance(grid, 5)
+    assert timeline.years == [0, 5, 7, 10]
+    assert timeline.seek(grid, 11) == 1
+    assert_same_state(grid, expected)
+    # 施設より前へ戻ると施設のない状態
+    timeline.seek(grid, 6)
+    assert_same_state(grid, straight(False, 6))
+
+
+@pytest.mark.parametrize("spill", [False, True])
+def test_thin_keeps_origin_and_latest(tmp_path, spill):
+    spill_dir = str(tmp_path) if spill else None
+    grid = make_grid()
+    timeline = CityTimeline(interval=1, max_checkpoints=4, spill_dir=spill_dir)
+    timeline.reset(grid)
+    timeline.advance(grid, 20)
+
+    years = timeline.years
+    assert len(years) == 4
+    assert years[0] == 0 and years[-1] == 20
+    if spill:
+        assert sorted(os.listdir(spill_dir)) == [f"year_{y:06d}" for y in years]
+    timeline.seek(grid, 9)
+    assert_same_state(grid, straight(False, 9))
+
+
+def test_rewind_returns_to_origin():
+    grid = make_grid()
+    grid.run_years(2)
+    origin = grid.population.copy()
+    timeline = CityTimeline(interval=5)
+    timeline.reset(grid)
+    timeline.advance(grid, 8)
+    timeline.rewind(grid)
+    assert grid.current_year == 2
+    assert np.array_equal(grid.population, origin)
+    assert timeline.years == [2]
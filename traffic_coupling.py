@@ -0,0 +1,360 @@
+"""
+交通 → 土地利用の連成 (traffic-to-land-use coupling)。
+
+配分後の混雑旅行時間からゾーン間スキムを作り、ログサム型のアクセシビリティ
+  A_i = log(1 + sum_j W_j * exp(-theta * t_ij))     (W_j: attraction = 人口・従業者の重み付き)
+を CityGrid.acc に反映する。スキムの再計算は refresh_years 年ごと、またはリンクコストが
+cost_threshold 以上変化したときのみ行い、間の年はキャッシュしたレイヤを使う。
+
+Usage:
+  python traffic_coupling.py --years 30 --refresh-years 5 --cost-threshold 0.05
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from metrics import METRICS
+from mesh_utils import MeshGridMapper
+from road_network import build_network
+import advanced_city_simulator as acs
+
+SIDES = ('N', 'S', 'E', 'W')
+OPPOSITE = (1, 0, 3, 2)
+# (dy, dx) of the neighbor behind each side; row 0 is north (MeshGridMapper)
+SIDE_OFFSETS = ((-1, 0), (1, 0), (0, 1), (0, -1))
+
+# 1チャンクの作業配列 (ラベル + 通過コスト: 20 x offsets x origins float32) の上限
+MAX_CHUNK_BYTES = 32 * 1024 * 1024
+
+
+def link_costs(G, edges, config=acs.DEFAULT_CONFIG):
+    """
+    Congested (BPR) cost of `edges` from the current flows on G, as a float64 array.
+    Per-link alpha / beta (road classes from RoadNetworkBuilder) override config["bpr"].
+    """
+    data = [G[u][v] for u, v in edges]
+    alpha = np.array([d.get('alpha', config["bpr"]["alpha"]) for d in data], dtype=np.float64)
+    beta = np.array([d.get('beta', config["bpr"]["beta"]) for d in data], dtype=np.float64)
+    free_time = np.array([(d['length'] / d['free_speed']) * 60 for d in data], dtype=np.float64)
+    flow = np.array([d.get('flow', 0.0) for d in data], dtype=np.float64)
+    capacity = np.array([d['capacity'] for d in data], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = free_time * (1.0 + alpha * (flow / capacity) ** beta)
+    return np.where(capacity > 0, cost, np.inf)
+
+
+class ZoneSkim:
+    """
+    Zone-to-zone travel times on the abstract mesh network (NetworkBuilder or
+    RoadNetworkBuilder) and the logsum accessibility over them.
+    - リンク表 (centroid <-> 境界, 通過, 接続) を一度だけ配列化し、コストは配列で差し替える
+    - 各ゾーンからの one-to-all 探索を、起点を中心とする (2r+1) x (2r+1) セルの窓内で
+      複数起点まとめて行う (窓内に収まる経路については Dijkstra と同じ最短時間)。
+      緩和は窓の行・列単位の配列演算で、ゾーンごとの Python ループはない
+    """
+
+    def __init__(self, G, zones, radius=20):
+        self.G = G
+        self.zones = [str(z) for z in zones]
+        self.radius = int(radius)
+        Z = len(self.zones)
+        index = {z: i for i, z in enumerate(self.zones)}
+
+        mapper = MeshGridMapper()
+        mapper.fit(self.zones)
+        cols, rows, _ = mapper.codes_to_coords(self.zones)
+        self.cols, self.rows = cols.astype(np.int64), rows.astype(np.int64)
+        R = self.radius
+        # ゾーン番号の格子 (窓がはみ出さないよう radius だけ余白, -1 = ゾーンなし)
+        self.lookup = np.full((mapper.rows + 2 * R, mapper.cols + 2 * R), -1, dtype=np.int64)
+        self.lookup[self.rows + R, self.cols + R] = np.arange(Z)
+
+        # Edge positions per role (-1 = no such link); costs are looked up through these
+        side = {s: k for k, s in enumerate(SIDES)}
+        self.edges = []
+        self.out_edge = np.full((Z, 4), -1, dtype=np.int64)
+        self.in_edge = np.full((Z, 4), -1, dtype=np.int64)
+        self.pass_edge = np.full((Z, 4, 4), -1, dtype=np.int64)
+        self.conn_edge = np.full((Z, 4), -1, dtype=np.int64)
+        for u, v in G.edges():
+            zu, tu = u.rsplit('_', 1)
+            zv, tv = v.rsplit('_', 1)
+            i = index.get(zu)
+            if i is None or zv not in index:
+                continue
+            pos = len(self.edges)
+            if tu == 'C' and tv in side:
+                self.out_edge[i, side[tv]] = pos
+            elif tv == 'C' and tu in side:
+                self.in_edge[i, side[tu]] = pos
+            elif zu == zv and tu in side and tv in side:
+                self.pass_edge[i, side[tu], side[tv]] = pos
+            elif tu in side and tv == SIDES[OPPOSITE[side[tu]]]:
+                dy, dx = SIDE_OFFSETS[side[tu]]
+                if (self.rows[index[zv]], self.cols[index[zv]]) != (self.rows[i] + dy, self.cols[i] + dx):
+                    continue
+                self.conn_edge[i, side[tu]] = pos
+            else:
+                continue
+            self.edges.append((u, v))
+
+    def costs(self, config=acs.DEFAULT_CONFIG):
+        """Current congested link costs in self.edges order."""
+        return link_costs(self.G, self.edges, config)
+
+    def _zone_costs(self, costs):
+        """Per-zone cost tables (one extra all-inf row for 'no zone')."""
+        c = np.append(np.asarray(costs, dtype=np.float64), np.inf)
+
+        def pick(edge):
+            table = c[np.where(edge >= 0, edge, len(c) - 1)]
+            return np.concatenate([table, np.full((1,) + table.shape[1:], np.inf)])
+
+        # ゾーン内 (重心 + 境界4つ) の最短コストを Floyd-Warshall で求める。混雑していると
+        # 重心 -> 境界 も 別の境界を経由した方が速いことがある
+        local = np.full((len(self.zones) + 1, 5, 5), np.inf)
+        local[:, 0, 1:] = pick(self.out_edge)
+        local[:, 1:, 0] = pick(self.in_edge)
+        local[:, 1:, 1:] = pick(self.pass_edge)
+        local[:, np.arange(5), np.arange(5)] = 0.0
+        for k in range(5):
+            np.minimum(local, local[:, :, k, None] + local[:, None, k, :], out=local)
+        out_c, in_c, through = local[:, 0, 1:], local[:, 1:, 0], local[:, 1:, 1:]
+        conn = pick(self.conn_edge)
+        # 境界 s から入って境界 t から出る最小コスト + 接続リンク
+        leave = through + conn[:, None, :]
+        return out_c, in_c, conn, leave
+
+    def _chunk_size(self):
+        # label (4) + leave (16) + 作業用 (2) の窓サイズ float32 配列
+        per_origin = 22 * 4 * (2 * self.radius + 1) ** 2
+        return max(1, int(MAX_CHUNK_BYTES // per_origin))
+
+    def times(self, costs, origins):
+        """
+        (2r+1, 2r+1, len(origins)) travel times (minutes) from each origin centroid to the
+        centroid of the zone at every window offset (inf = no zone / not reachable inside
+        the window), and the zone index at those offsets (-1 = none). The origin is at [r, r].
+        """
+        out_c, in_c, conn, leave = self._zone_costs(costs)
+        R, Z = self.radius, len(self.zones)
+        origins = np.asarray(origins, dtype=np.int64)
+        dy = np.arange(-R, R + 1)
+        cell = self.lookup[self.rows[origins][None, None, :] + R + dy[:, None, None],
+                           self.cols[origins][None, None, :] + R + dy[None, :, None]]
+        cell = np.where(cell >= 0, cell, Z)
+        # leave_w[s, t] = leave[cell, s, t] as (window, window, origins) planes
+        leave_w = np.ascontiguousarray(leave.transpose(1, 2, 0), dtype=np.float32)[:, :, cell]
+        label = np.full((4,) + cell.shape, np.inf, dtype=np.float32)
+
+        # Origin centroid -> own boundary t -> neighbor's opposite boundary
+        first = (out_c + conn)[origins].astype(np.float32)
+        for t, (oy, ox) in enumerate(SIDE_OFFSETS):
+            label[OPPOSITE[t], R + oy, R + ox] = first[:, t]
+
+        # Label-correcting scans until no label improves. Like a distance transform, each
+        # direction is scanned line by line (rows southward / northward, columns eastward /
+        # westward), so one scan carries labels across the whole window.
+        S = 2 * R + 1
+        cand = np.empty((S, len(origins)), dtype=np.float32)
+        tmp = np.empty_like(cand)
+        better = np.empty(cand.shape, dtype=bool)
+        for _ in range(cell.size):
+            improved = False
+            for t, (oy, ox) in enumerate(SIDE_OFFSETS):
+                shift = oy or ox
+                lines = range(1, S) if shift > 0 else range(S - 2, -1, -1)
+                for i in lines:
+                    line = (i - shift) if oy else (slice(None), i - shift)
+                    np.add(label[0][line], leave_w[0, t][line], out=cand)
+                    for s in range(1, 4):
+                        np.add(label[s][line], leave_w[s, t][line], out=tmp)
+                        np.minimum(cand, tmp, out=cand)
+                    current = label[OPPOSITE[t]][i if oy else (slice(None), i)]
+                    np.less(cand, current, out=better)
+                    if better.any():
+                        improved = True
+                        np.minimum(current, cand, out=current)
+            if not improved:
+                break
+
+        arrive = label + in_c[cell].transpose(3, 0, 1, 2).astype(np.float32)
+        times = np.min(arrive, axis=0)
+        times[R, R] = 0.0
+        return times, np.where(cell < Z, cell, -1)
+
+    def logsum(self, costs, weights, theta=0.2):
+        """
+        Logsum accessibility per zone: log(1 + sum_j weights[j] * exp(-theta * t_ij)) over
+        the zones within the window. weights: (zones,) opportunities (e.g. attraction).
+        """
+        weights = np.append(np.asarray(weights, dtype=np.float64), 0.0)
+        result = np.empty(len(self.zones), dtype=np.float64)
+        chunk = self._chunk_size()
+        with METRICS.phase("coupling.skim"):
+            for s in range(0, len(self.zones), chunk):
+                origins = np.arange(s, min(s + chunk, len(self.zones)))
+                times, cell = self.times(costs, origins)
+                w = weights[cell]
+                result[origins] = np.log1p(np.sum(w * np.exp(-theta * times.astype(np.float64)), axis=(0, 1)))
+        METRICS.inc("coupling.skim_origins", len(self.zones))
+        return result
+
+
+class CoupledRun:
+    """
+    交通配分と CityGrid の連成実行。
+    毎 assign_every 年: 現在の人口から需要を更新して配分 → 混雑コスト
+    スキム更新: 前回から refresh_years 年経過、またはコストの相対変化 (L1) > cost_threshold
+    acc = (1 - mix) * 静的 acc (benrido) + mix * 正規化ログサム (初回の値域で 0..1)
+    """
+
+    def __init__(self, grid, data, graph, config=acs.DEFAULT_CONFIG, refresh_years=5, cost_threshold=0.05,
+                 assign_every=1, mix=0.5, theta=0.2, radius=20):
+        self.grid = grid
+        self.data = data
+        self.G = graph
+        self.config = config
+        self.refresh_years = refresh_years
+        self.cost_threshold = cost_threshold
+        self.assign_every = assign_every
+        self.mix = mix
+        self.theta = theta
+
+        demand = data.demand.reset_index(drop=True)
+        self.skim = ZoneSkim(graph, demand["zone_id"].astype(str).tolist(), radius=radius)
+        self.base_demand = demand
+        self.static_acc = grid.acc.copy()
+
+        # Zone -> grid layer position (flat); zones outside the grid keep their base demand
+        cells, found = grid.locate_codes(self.skim.zones)
+        self.cell = np.full(len(cells), -1, dtype=np.int64)
+        if found.any():
+            self.cell[found] = grid.cell_index()["layer"][cells[found]]
+        self.pop0 = self._zone_population()
+        self.skim_costs = None
+        self.scale = None
+        self.zone_acc = None
+        self.last_refresh = None
+        self.log = []
+
+    def _zone_population(self):
+        pop = self.grid.population.reshape(-1)
+        return np.where(self.cell >= 0, pop[np.maximum(self.cell, 0)], 0.0).astype(np.float64)
+
+    def demand(self):
+        """Demand table with production / attraction updated by the population change since start."""
+        units = self.config["units"]
+        change = self._zone_population() - self.pop0
+        df = self.base_demand.copy()
+        df["production"] = np.maximum(0.0, df["production"].to_numpy() + units["production"]["pop"] * change)
+        df["attraction"] = np.maximum(0.0, df["attraction"].to_numpy() + units["attraction"]["pop"] * change)
+        return df
+
+    def assign(self):
+        """Re-runs the traffic assignment with the current demand; returns (costs, demand)."""
+        demand = self.demand()
+        with METRICS.phase("coupling.assignment"):
+            acs.TrafficSimulator(self.G, self.config).run(demand)
+        return self.skim.costs(self.config), demand
+
+    def refresh(self, costs, demand):
+        """Recomputes the zone logsum and writes the blended acc layer into the grid."""
+        zone_acc = self.skim.logsum(costs, demand["attraction"].to_numpy(), theta=self.theta)
+        if self.scale is None:
+            lo, hi = float(zone_acc.min()), float(zone_acc.max())
+            self.scale = (lo, hi - lo if hi > lo else 1.0)
+        norm = (zone_acc - self.scale[0]) / self.scale[1]
+        acc = self.static_acc.copy().reshape(-1)
+        ok = self.cell >= 0
+        acc[self.cell[ok]] = (1.0 - self.mix) * acc[self.cell[ok]] + self.mix * norm[ok]
+        self.grid.acc = acc.reshape(self.static_acc.shape).astype(np.float32)
+        self.zone_acc = zone_acc
+        self.skim_costs = costs
+        METRICS.inc("coupling.skim_refreshes")
+
+    def cost_change(self, costs):
+        """Relative L1 change of link costs since the last skim refresh."""
+        if self.skim_costs is None:
+            return float('inf')
+        ok = np.isfinite(costs) & np.isfinite(self.skim_costs)
+        return float(np.sum(np.abs(costs[ok] - self.skim_costs[ok])) / max(np.sum(self.skim_costs[ok]), 1e-12))
+
+    def run(self, years, params=None, verbose=False):
+        """Runs `years` coupled years; returns per-year log entries (printed as they go if verbose)."""
+        costs, demand = None, None
+        for i in range(years):
+            t0 = time.perf_counter()
+            if costs is None or i % self.assign_every == 0:
+                costs, demand = self.assign()
+            change = self.cost_change(costs)
+            due = self.last_refresh is None or self.grid.current_year - self.last_refresh >= self.refresh_years
+            refreshed = due or change > self.cost_threshold
+            if refreshed:
+                self.refresh(costs, demand)
+                self.last_refresh = self.grid.current_year
+            self.grid.run_years(1, params=params)
+            entry = {
+                "year": self.grid.current_year,
+                "refreshed": bool(refreshed),
+                "cost_change": None if np.isinf(change) else round(change, 6),
+                "total_population": float(np.sum(self.grid.population, dtype=np.float64)),
+                "seconds": round(time.perf_counter() - t0, 3)
+            }
+            self.log.append(entry)
+            if verbose:
+                print(f"  year {entry['year']}: {'skim refreshed' if refreshed else 'cached skim'}"
+                      f" (cost change {entry['cost_change']}), {entry['seconds']}s")
+        return self.log
+
+
+def main(argv=None):
+    from city_grid import CityGrid
+
+    parser = argparse.ArgumentParser(description="Coupled traffic / land-use run")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--refresh-years", type=int, default=5)
+    parser.add_argument("--cost-threshold", type=float, default=0.05)
+    parser.add_argument("--assign-every", type=int, default=1)
+    parser.add_argument("--mix", type=float, default=0.5)
+    parser.add_argument("--theta", type=float, default=0.2, help="logsum decay per minute")
+    parser.add_argument("--radius", type=int, default=20, help="skim window radius (cells)")
+    parser.add_argument("--out", default=None, help="write the yearly log as CSV")
+    args = parser.parse_args(argv)
+
+    data = acs.SimulationData(args.data_dir)
+    data.load()
+    if len(data.zones) == 0:
+        print("Error: No zones found. Exiting.")
+        return 1
+    G = build_network(data.zones, args.data_dir)
+
+    stat_dir = os.path.join(args.data_dir, "statistical")
+    mapper = MeshGridMapper()
+    mapper.fit(data.zones)
+    grid = CityGrid(width=mapper.cols, height=mapper.rows, compact=True)
+    grid.set_mapper(mapper)
+    grid.load_population_and_elderly_from_stat(os.path.join(stat_dir, "tblT001101H34.csv"))
+    fac = os.path.join(stat_dir, "tblT001164H34.csv")
+    mapping = os.path.join(stat_dir, "tblT001164H34_mapping_with_benrido.csv")
+    if os.path.exists(fac) and os.path.exists(mapping):
+        grid.compute_benrido_from_statistical(fac, mapping)
+
+    run = CoupledRun(grid, data, G, refresh_years=args.refresh_years, cost_threshold=args.cost_threshold,
+                     assign_every=args.assign_every, mix=args.mix, theta=args.theta, radius=args.radius)
+    t0 = time.perf_counter()
+    log = run.run(args.years, verbose=True)
+    print(f"Coupled run: {args.years} years in {time.perf_counter() - t0:.1f}s "
+          f"({sum(e['refreshed'] for e in log)} skim refreshes)")
+    if args.out:
+        pd.DataFrame(log).to_csv(args.out, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())